@@ -33,10 +33,12 @@ from six.moves import xrange
 from tensorflow.contrib.training import HParams
 from tqdm import tqdm
 
+from mtl.embedders.pretrained import assign_pretrained_embeddings
 from mtl.models.mult import Mult
+from mtl.util.categorical_vocabulary import load_vocab_cutoff
 from mtl.util.constants import ALL_METRICS
 from mtl.util.metrics import accurate_number, metric2func
-from mtl.util.pipeline import Pipeline
+from mtl.util.pipeline import Pipeline, load_length_buckets
 from mtl.util.util import make_dir
 
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -83,6 +85,14 @@ def parse_args():
                    help='Size of batch.')
     p.add_argument('--eval_batch_size', default=128, type=int,
                    help='Size of evaluation batch.')
+    p.add_argument('--num_length_buckets', default=0, type=int,
+                   help='Number of buckets of similar lengths to batch the '
+                        'training examples by, from the length statistics '
+                        'in args.json(0: no bucketing).')
+    p.add_argument('--max_tokens_per_batch', default=None, type=int,
+                   help='With length buckets, batch as many examples of a '
+                        'bucket as fit in this number of tokens instead of '
+                        'batch_size.')
     p.add_argument('--word_embed_dim', default=128, type=int,
                    help='Word embedding size')
     p.add_argument('--share_decoders', action='store_true', default=False,
@@ -136,6 +146,12 @@ def parse_args():
                    help="Path to the file containing precomputed embeddings")
     p.add_argument('--vocab_size_file', type=str,
                    help='Path to the file containing the vocabulary size')
+    p.add_argument('--vocab_min_frequency', type=int, default=None,
+                   help='Minimum frequency of the words to keep, applied '
+                        'when reading TFRecord files written with full_vocab')
+    p.add_argument('--vocab_max_size', type=int, default=None,
+                   help='Maximum vocabulary size, applied when reading '
+                        'TFRecord files written with full_vocab')
     p.add_argument('--architecture', type=str,
                    help='Encoder architecture type (see encoder_factory.py for '
                         'supported architectures)')
@@ -203,6 +219,20 @@ def get_num_records(tf_record_filename):
     return c
 
 
+def get_tfrecord_files(dataset_path, split):
+    """List the TFRecord files of a split of a dataset
+
+    :param dataset_path: path to the dataset's TFRecord files
+    :param split: 'train', 'valid' or 'test'
+    :return: list, the shards listed in args.json, or [split.tf]
+    """
+    with open(os.path.join(dataset_path, 'args.json')) as file:
+        shards = json.load(file).get(split + '_shards')
+    if not shards:
+        shards = [split + '.tf']
+    return [os.path.join(dataset_path, shard) for shard in shards]
+
+
 def get_vocab_size(dataset_paths):
     """Read the vocab_size in args.json in the TFRecord paths
 
@@ -322,8 +352,6 @@ def train_model(model,
     # tvars, grads = get_var_grads(loss)
     # train_op = get_train_op(tvars, grads, lr, args.max_grad_norm,
     #                        global_step_tensor, args.optimizer, name='train_op')
-    init_ops = [tf.global_variables_initializer(),
-                tf.local_variables_initializer()]
     config = get_proto_config(args)
 
     # Get training objective. The inputs are:
@@ -369,17 +397,24 @@ def train_model(model,
 
     saver = tf.train.Saver(max_to_keep=100)
 
-    with tf.train.SingularMonitoredSession(hooks=[saver_hook],
-                                           config=config) as sess:
-
+    def init_fn(scaffold, session):
+        # run once the variables are initialized, before the saver hook
+        # saves the first checkpoint in after_create_session()
         if args.mode == 'train':
-            sess.run(init_ops)
-
+            # pretrained word embeddings are fed to their variables instead
+            # of being stored in the graph
+            assign_pretrained_embeddings(session)
         else:
             assert len(args.datasets) == 1
             checkpoint_path_load = model_info[args.datasets[0]][
                 'checkpoint_path_load']
-            saver.restore(sess, checkpoint_path_load)
+            saver.restore(session, checkpoint_path_load)
+            assign_pretrained_embeddings(session, checkpoint_path_load)
+
+    with tf.train.SingularMonitoredSession(
+            scaffold=tf.train.Scaffold(init_fn=init_fn),
+            hooks=[saver_hook],
+            config=config) as sess:
 
         if args.summaries_dir:
             train_file_writer = tf.summary.FileWriter(
@@ -691,6 +726,7 @@ def test_model(model, dataset_info, args):
             print(checkpoint_path)
 
             saver.restore(sess, checkpoint_path)
+            assign_pretrained_embeddings(sess, checkpoint_path)
 
             for dataset_name in args.datasets:
                 _pred_op = model_info[dataset_name]['test_pred_op']
@@ -806,6 +842,7 @@ def predict(model, dataset_info, args):
                 checkpoint_path = model_info[model_name]['checkpoint_path']
 
             saver.restore(sess, checkpoint_path)
+            assign_pretrained_embeddings(sess, checkpoint_path)
 
             dataset_name = args.predict_dataset
 
@@ -1102,14 +1139,30 @@ def main():
         _dir = dataset_info[dataset_name]['dir']
 
         # Set paths to TFRecord files
-        _dataset_train_path = os.path.join(_dir, "train.tf")
+        # (lists of the shards if the splits are sharded)
+        _dataset_train_path = get_tfrecord_files(_dir, 'train')
         dataset_info[dataset_name]['train_path'] = _dataset_train_path
 
+        dataset_info[dataset_name]['length_buckets'] = None
+        if args.num_length_buckets > 0:
+            buckets = load_length_buckets(_dir, args.num_length_buckets,
+                                          args.batch_size,
+                                          args.max_tokens_per_batch)
+            if buckets is None:
+                logging.warning("No length statistics in %s, batching %s "
+                                "without length buckets.", _dir,
+                                dataset_name)
+            else:
+                logging.info("Length buckets of %s: boundaries %s, batch "
+                             "sizes %s.", dataset_name, buckets[0],
+                             buckets[1])
+            dataset_info[dataset_name]['length_buckets'] = buckets
+
         if args.mode in ['train', 'finetune']:
-            _dataset_valid_path = os.path.join(_dir, "valid.tf")
+            _dataset_valid_path = get_tfrecord_files(_dir, 'valid')
             dataset_info[dataset_name]['valid_path'] = _dataset_valid_path
         elif args.mode == 'test':
-            _dataset_test_path = os.path.join(_dir, "test.tf")
+            _dataset_test_path = get_tfrecord_files(_dir, 'test')
             dataset_info[dataset_name]['test_path'] = _dataset_test_path
         elif args.mode == 'predict':
             _dataset_predict_path = args.predict_tfrecord_path
@@ -1120,6 +1173,14 @@ def main():
     # vocab_size = get_vocab_size(args.vocab_size_file)
     vocab_size = get_vocab_size(args.dataset_paths)
 
+    # ids at or beyond the cutoff are read as <UNK>
+    vocab_cutoff = load_vocab_cutoff(args.dataset_paths[0],
+                                     args.vocab_min_frequency,
+                                     args.vocab_max_size)
+    if vocab_cutoff is not None:
+        logging.info("Vocabulary cut off to %d of %d words.", vocab_cutoff,
+                     vocab_size)
+
     class_sizes = {dataset_name: dataset_info[dataset_name]['class_size'] for
                    dataset_name in dataset_info}
 
@@ -1130,23 +1191,47 @@ def main():
     # This defines ALL the features that ANY model possibly needs access
     # to. That is, some models will only need a subset of these features.
     FEATURES = dict()
+    all_text_field_names = set()
     for dataset, dataset_path in zip(args.datasets, args.dataset_paths):
         with open(os.path.join(dataset_path, 'args.json')) as f:
             json_config = json.load(f)
             text_field_names = json_config['text_field_names']
+            all_text_field_names.update(text_field_names)
+            dataset_info[dataset]['length_keys'] = [
+                text_field_name + '_length'
+                for text_field_name in text_field_names]
 
             for text_field_name in text_field_names:
                 FEATURES[text_field_name + '_length'] = tf.FixedLenFeature([],
                                                                            dtype=tf.int64)
                 if args.input_key == 'tokens':
                     FEATURES[text_field_name] = tf.VarLenFeature(dtype=tf.int64)
+                elif args.input_key == 'bow' and json_config.get(
+                    'bow_format', 'dense') == 'sparse':
+                    # parsed as a SparseTensor of dense shape
+                    # [batch_size, vocab_size]
+                    FEATURES[text_field_name + '_bow'] = tf.SparseFeature(
+                        index_key=text_field_name + '_bow_indices',
+                        value_key=text_field_name + '_bow_values',
+                        dtype=tf.float32,
+                        size=vocab_size)
                 elif args.input_key == 'bow':
+                    if vocab_cutoff is not None:
+                        raise ValueError("vocabulary cutoffs need the sparse "
+                                         "bag of words(bow_format=sparse)")
                     FEATURES[text_field_name + '_bow'] = tf.FixedLenFeature(
                         [vocab_size],
                         dtype=tf.float32)
                 elif args.input_key == 'tfidf':
-                    FEATURES[text_field_name + '_tfidf'] = tf.FixedLenFeature(
-                        [vocab_size], dtype=tf.float32)
+                    if vocab_cutoff is not None:
+                        raise ValueError("vocabulary cutoffs can't be "
+                                         "applied to tf-idf, whose idf is "
+                                         "of the full vocabulary")
+                    FEATURES[text_field_name + '_tfidf'] = tf.SparseFeature(
+                        index_key=text_field_name + '_tfidf_indices',
+                        value_key=text_field_name + '_tfidf_values',
+                        dtype=tf.float32,
+                        size=vocab_size)
                 # elif args.input_key == 'unique':
                 #   FEATURES[text_field_name + '_unique'] = tf.VarLenFeature(
                 #       dtype=tf.int64)
@@ -1161,6 +1246,13 @@ def main():
                     raise ValueError(
                         "Input key %s not supported!" % args.input_key)
 
+    # every feature of word ids, or indexed by word ids, is cut off
+    vocab_keys = []
+    if vocab_cutoff is not None:
+        vocab_keys = [key for key in FEATURES if any(
+            key in [name, name + '_types', name + '_bow', name + '_tfidf']
+            for name in all_text_field_names)]
+
     FEATURES['index'] = tf.FixedLenFeature([], dtype=tf.int64)
     if args.mode in ['train', 'test', 'finetune']:
         if args.task == 'classification':
@@ -1179,8 +1271,13 @@ def main():
         # examples from serialized TF record files.
         for dataset_name in dataset_info:
             _train_path = dataset_info[dataset_name]['train_path']
-            ds = build_input_dataset(_train_path, FEATURES, args.batch_size,
-                                     is_training=True)
+            ds = build_input_dataset(
+                _train_path, FEATURES, args.batch_size,
+                is_training=True,
+                vocab_cutoff=vocab_cutoff,
+                vocab_keys=vocab_keys,
+                length_keys=dataset_info[dataset_name]['length_keys'],
+                buckets=dataset_info[dataset_name]['length_buckets'])
             dataset_info[dataset_name]['train_dataset'] = ds
 
             if args.mode in ['train', 'finetune']:
@@ -1188,28 +1285,40 @@ def main():
                 _valid_path = dataset_info[dataset_name]['valid_path']
                 ds = build_input_dataset(_valid_path, FEATURES,
                                          args.eval_batch_size,
-                                         is_training=False)
+                                         is_training=False,
+                                         vocab_cutoff=vocab_cutoff,
+                                         vocab_keys=vocab_keys)
                 dataset_info[dataset_name]['valid_dataset'] = ds
             elif args.mode == 'test':
                 # Test dataset
                 _test_path = dataset_info[dataset_name]['test_path']
                 ds = build_input_dataset(_test_path, FEATURES,
                                          args.eval_batch_size,
-                                         is_training=False)
+                                         is_training=False,
+                                         vocab_cutoff=vocab_cutoff,
+                                         vocab_keys=vocab_keys)
                 dataset_info[dataset_name]['test_dataset'] = ds
             elif args.mode == 'predict':
                 _pred_path = dataset_info[dataset_name]['pred_path']
                 ds = build_input_dataset(_pred_path, FEATURES,
                                          args.eval_batch_size,
-                                         is_training=False)
+                                         is_training=False,
+                                         vocab_cutoff=vocab_cutoff,
+                                         vocab_keys=vocab_keys)
                 dataset_info[dataset_name]['pred_dataset'] = ds
 
-        # This finds the size of the largest training dataset.
-        training_files = [dataset_info[dataset_name]['train_path'] for
-                          dataset_name
-                          in dataset_info]
-        min_N_train = min(
-            [get_num_records(tf_rec_file) for tf_rec_file in training_files])
+        # This finds the number of batches of the smallest training
+        # dataset, whose batch size may depend on the lengths
+        min_train_batches = None
+        for dataset_name in dataset_info:
+            N_train = sum(get_num_records(tf_rec_file) for tf_rec_file in
+                          dataset_info[dataset_name]['train_path'])
+            buckets = dataset_info[dataset_name]['length_buckets']
+            mean_batch_size = args.batch_size if buckets is None \
+                else buckets[2]
+            if min_train_batches is None or \
+                    N_train / mean_batch_size < min_train_batches:
+                min_train_batches = N_train / mean_batch_size
 
         # Seed TensorFlow RNG
         tf.set_random_seed(args.seed)
@@ -1227,7 +1336,7 @@ def main():
 
         # Steps per epoch.
         # One epoch: smallest dataset has been seen once
-        steps_per_epoch = ceil(min_N_train / args.batch_size)
+        steps_per_epoch = int(ceil(min_train_batches))
 
         # Create model(s):
         # NOTE: models must support the following functions:
@@ -1564,14 +1673,25 @@ def fill_topic_op(args, model_info):
 
 
 def build_input_dataset(tfrecord_path, batch_features, batch_size,
-                        is_training=True):
+                        is_training=True, vocab_cutoff=None, vocab_keys=(),
+                        length_keys=(), buckets=None):
     if is_training:
+        # batch examples of similar lengths if given the length buckets
+        # (see load_length_buckets())
+        bucket_boundaries, bucket_batch_sizes = (None, None) \
+            if buckets is None else buckets[:2]
         ds = Pipeline(tfrecord_path, batch_features, batch_size,
                       num_epochs=None,  # repeat indefinitely
-                      )
+                      vocab_cutoff=vocab_cutoff,
+                      vocab_keys=vocab_keys,
+                      length_keys=length_keys,
+                      bucket_boundaries=bucket_boundaries,
+                      bucket_batch_sizes=bucket_batch_sizes)
     else:
         ds = Pipeline(tfrecord_path, batch_features, batch_size,
-                      num_epochs=1, shuffle=False)
+                      num_epochs=1, shuffle=False,
+                      vocab_cutoff=vocab_cutoff,
+                      vocab_keys=vocab_keys)
 
     # We return the class because we might need to access the
     # initializer op for TESTING, while training only requires the
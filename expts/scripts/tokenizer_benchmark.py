@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Throughput of FastTweetTokenizer against nltk's TweetTokenizer
+
+python tokenizer_benchmark.py [text file, one text per line]
+
+The texts default to the reviews of tests/LMRD_neg.txt.
+"""
+
+import codecs
+import os
+import sys
+import time
+
+from nltk.tokenize import TweetTokenizer
+
+from mtl.util.data_prep import FastTweetTokenizer
+
+REVIEWS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            os.pardir, os.pardir, 'tests', 'LMRD_neg.txt')
+
+
+def texts_per_second(tokenize, texts):
+    start = time.time()
+    for text in texts:
+        tokenize(text)
+    return len(texts) / (time.time() - start)
+
+
+def main(argv):
+    path = argv[1] if len(argv) > 1 else REVIEWS_PATH
+    with codecs.open(path, mode='r', encoding='utf-8') as file:
+        texts = file.read().splitlines()
+    config = dict(strip_handles=True, preserve_case=False, reduce_len=True)
+    reference = TweetTokenizer(**config)
+    fast = FastTweetTokenizer(**config)
+    reference_speed = texts_per_second(reference.tokenize, texts)
+    fast_speed = texts_per_second(fast.tokenize, texts)
+    print('%s: TweetTokenizer %.0f texts/s, FastTweetTokenizer '
+          '%.0f texts/s (%.1fx)' % (os.path.basename(path), reference_speed,
+                                     fast_speed, fast_speed / reference_speed))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
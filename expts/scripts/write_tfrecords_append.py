@@ -0,0 +1,47 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Append the examples of a delta json file to written TFRecord data
+
+Usage: python write_tfrecords_append.py tfrecord_dir append_json_path
+    [num_workers]
+
+tfrecord_dir is the directory of a dataset's args.json, vocab_v2i.json and
+TFRecord files, e.g. data/tf/single/SSTb/min_0_max_-1_..., the vocabulary
+is kept as it is.
+"""
+
+import sys
+
+from mtl.util.dataset import append_write_tfrecord
+
+
+def main():
+    if len(sys.argv) not in [3, 4]:
+        sys.exit(__doc__)
+
+    tfrecord_dir = sys.argv[1]
+    append_json_path = sys.argv[2]
+    num_workers = int(sys.argv[3]) if len(sys.argv) == 4 else 1
+
+    append_write_tfrecord(append_json_path=append_json_path,
+                          tfrecord_dir=tfrecord_dir,
+                          num_workers=num_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,10 +20,15 @@ import sys
 
 from mtl.util.dataset import merge_dict_write_tfrecord, \
     merge_pretrain_write_tfrecord
+from mtl.util.manifest import json_input_files, manifest_unchanged, \
+    remove_manifest, write_manifest
 from mtl.util.util import make_dir, load_json
 
 
 def main(argv):
+    # --force: regenerate the files even if the manifest is up to date
+    force = '--force' in argv
+    argv = [arg for arg in argv if arg != '--force']
     if argv[-1].endswith('.json'):
         args_name = argv[-1]
         argv = argv[:-1]
@@ -47,12 +52,23 @@ def main(argv):
     if 'vocab_all' in args:
         vocab_all = args['vocab_all']
 
-    tfrecord_dir_name = \
-        "min_" + str(args['min_frequency']) + \
-        "_max_" + str(args['max_frequency']) + \
-        "_vocab_" + str(args['max_vocab_size']) + \
-        "_doc_" + str(args['max_document_length']) + \
-        "_tok_" + args['tokenizer'].replace('_tokenizer', '')
+    if args.get('full_vocab', False):
+        # the vocabulary cutoffs are applied when reading
+        tfrecord_dir_name = \
+            "full_vocab" + \
+            "_doc_" + str(args['max_document_length']) + \
+            "_tok_" + args['tokenizer'].replace('_tokenizer', '')
+    else:
+        tfrecord_dir_name = \
+            "min_" + str(args['min_frequency']) + \
+            "_max_" + str(args['max_frequency']) + \
+            "_vocab_" + str(args['max_vocab_size']) + \
+            "_doc_" + str(args['max_document_length']) + \
+            "_tok_" + args['tokenizer'].replace('_tokenizer', '')
+        if args.get('approx_vocab', False):
+            # the merged vocabulary misses the words only frequent over all
+            # the datasets
+            tfrecord_dir_name += "_approx"
 
     if 'pretrained_file' not in args or not args[
         'pretrained_file']:
@@ -61,6 +77,10 @@ def main(argv):
                          datasets]
         assert [os.path.basename(tf_dir) for tf_dir in tfrecord_dirs] == [
             os.path.basename(json_dir) for json_dir in json_dirs]
+        if not force and up_to_date(tfrecord_dir, tfrecord_dirs, json_dirs,
+                                    datasets, args):
+            return tfrecord_dir
+        remove_manifest(tfrecord_dir)
         for i in tfrecord_dirs:
             make_dir(i)
         merge_dict_write_tfrecord(json_dirs=json_dirs,
@@ -84,7 +104,21 @@ def main(argv):
                                   write_bow=args['write_bow'],
                                   write_tfidf=args['write_tfidf'],
                                   preproc=preproc,
-                                  vocab_all=vocab_all)
+                                  vocab_all=vocab_all,
+                                  streaming=args.get('streaming', False),
+                                  num_workers=args.get('num_workers', 1),
+                                  token_cache=args.get('token_cache', False),
+                                  num_shards=args.get('num_shards', 1),
+                                  bow_format=args.get('bow_format', 'dense'),
+                                  full_vocab=args.get('full_vocab', False),
+                                  approx_vocab=args.get('approx_vocab',
+                                                        False),
+                                  approx_vocab_width=args.get(
+                                      'approx_vocab_width', 1 << 22),
+                                  approx_vocab_depth=args.get(
+                                      'approx_vocab_depth', 4),
+                                  num_dataset_workers=args.get(
+                                      'num_dataset_workers', 1))
     else:
         vocab_path = args['pretrained_file']
         vocab_dir = os.path.dirname(vocab_path)
@@ -108,6 +142,10 @@ def main(argv):
 
         tfrecord_dirs = [os.path.join(tfrecord_dir, dataset) for dataset in
                          datasets]
+        if not force and up_to_date(tfrecord_dir, tfrecord_dirs, json_dirs,
+                                    datasets, args):
+            return tfrecord_dir
+        remove_manifest(tfrecord_dir)
         for i in tfrecord_dirs:
             make_dir(i)
         assert [os.path.basename(tf_dir) for tf_dir in tfrecord_dirs] == [
@@ -141,10 +179,55 @@ def main(argv):
                                       expand_vocab=expand_vocab,
                                       pretrained_only=pretrained_only,
                                       preproc=preproc,
-                                      vocab_all=vocab_all)
+                                      vocab_all=vocab_all,
+                                      streaming=args.get('streaming', False),
+                                      num_workers=args.get('num_workers', 1),
+                                      token_cache=args.get('token_cache',
+                                                           False),
+                                      num_shards=args.get('num_shards', 1),
+                                      bow_format=args.get('bow_format',
+                                                          'dense'),
+                                      num_dataset_workers=args.get(
+                                          'num_dataset_workers', 1))
+
+    write_manifest(tfrecord_dir, input_files(json_dirs, args),
+                   manifest_args(datasets, args), tfrecord_dirs)
 
     return tfrecord_dir
 
 
+def input_files(json_dirs, args):
+    file_names = []
+    for json_dir in json_dirs:
+        file_names.extend(json_input_files(json_dir))
+    if args.get('pretrained_file'):
+        file_names.append(args['pretrained_file'])
+    return file_names
+
+
+def manifest_args(datasets, args):
+    used_args = dict(args)
+    used_args['datasets'] = datasets
+    if args.get('full_vocab', False):
+        # cutoffs applied when reading don't change the files
+        used_args.pop('min_frequency', None)
+        used_args.pop('max_vocab_size', None)
+    return used_args
+
+
+def up_to_date(tfrecord_dir, tfrecord_dirs, json_dirs, datasets, args):
+    unchanged, reason = manifest_unchanged(tfrecord_dir,
+                                           input_files(json_dirs, args),
+                                           manifest_args(datasets, args),
+                                           tfrecord_dirs)
+    if unchanged:
+        print("Inputs, arguments and code unchanged since the TFRecord "
+              "files in %s were written, skipping(use --force to "
+              "regenerate them)." % tfrecord_dir)
+    else:
+        print("Writing TFRecord files to %s: %s." % (tfrecord_dir, reason))
+    return unchanged
+
+
 if __name__ == '__main__':
     main(sys.argv)
@@ -48,12 +48,19 @@ def main():
     if 'vocab_all' in args:
         vocab_all = args['vocab_all']
 
-    tfrecord_dir_name = \
-        "min_" + str(args['min_frequency']) + \
-        "_max_" + str(args['max_frequency']) + \
-        "_vocab_" + str(args['max_vocab_size']) + \
-        "_doc_" + str(args['max_document_length']) + \
-        "_tok_" + args['tokenizer'].replace('_tokenizer', '')
+    if args.get('full_vocab', False):
+        # the vocabulary cutoffs are applied when reading
+        tfrecord_dir_name = \
+            "full_vocab" + \
+            "_doc_" + str(args['max_document_length']) + \
+            "_tok_" + args['tokenizer'].replace('_tokenizer', '')
+    else:
+        tfrecord_dir_name = \
+            "min_" + str(args['min_frequency']) + \
+            "_max_" + str(args['max_frequency']) + \
+            "_vocab_" + str(args['max_vocab_size']) + \
+            "_doc_" + str(args['max_document_length']) + \
+            "_tok_" + args['tokenizer'].replace('_tokenizer', '')
 
     print(tfrecord_dir_name)
 
@@ -83,7 +90,17 @@ def main():
                           vocab_given=False,
                           generate_tf_record=True,
                           preproc=preproc,
-                          vocab_all=vocab_all)
+                          vocab_all=vocab_all,
+                          streaming=args.get('streaming', False),
+                          num_workers=args.get('num_workers', 1),
+                          token_cache=args.get('token_cache', False),
+                          num_shards=args.get('num_shards', 1),
+                          bow_format=args.get('bow_format', 'dense'),
+                          full_vocab=args.get('full_vocab', False),
+                          approx_vocab=args.get('approx_vocab', False),
+                          approx_vocab_width=args.get('approx_vocab_width',
+                                                      1 << 22),
+                          approx_vocab_depth=args.get('approx_vocab_depth', 4))
     else:
         vocab_path = args['pretrained_file']
         vocab_dir = os.path.dirname(vocab_path)
@@ -132,7 +149,12 @@ def main():
                           expand_vocab=expand_vocab,
                           pretrained_only=pretrained_only,
                           preproc=preproc,
-                          vocab_all=vocab_all)
+                          vocab_all=vocab_all,
+                          streaming=args.get('streaming', False),
+                          num_workers=args.get('num_workers', 1),
+                          token_cache=args.get('token_cache', False),
+                          num_shards=args.get('num_shards', 1),
+                          bow_format=args.get('bow_format', 'dense'))
 
     with open(os.path.join(tfrecord_dir, 'vocab_size.txt'), 'w') as f:
         f.write(str(dataset.vocab_size))
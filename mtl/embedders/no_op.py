@@ -23,8 +23,13 @@ import tensorflow as tf
 def no_op_embedding(x, *args, **kwargs):
     """For use when an embedding function is required but the inputs
     do not need to be embedded, e.g., bag of words encoding.
+
+    Sparse inputs (e.g. sparse bag of words) are returned as they are.
     """
 
+    if isinstance(x, tf.SparseTensor):
+        return x
+
     rank = len(x.get_shape().as_list())
     if rank == 2:
         # convert token ids into single-element embeddings of the same value
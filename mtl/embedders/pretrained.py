@@ -19,20 +19,96 @@ from __future__ import print_function
 
 import codecs
 import json
+import os
+import weakref
+from collections import namedtuple
 
 import numpy as np
 import tensorflow as tf
-# TODO other word embeddings
-from tqdm import tqdm
 
 from mtl.embedders.embed_sequence import get_weighted_embeddings
+from mtl.util.binary_vocab import load_binary_vocab
+from mtl.util.constants import BINARY_VOCAB_NAME
 from mtl.util.load_embeds import (load_pretrained_matrix,
-                                  load_pretrianed_vocab_dict)
+                                  load_pretrained_rows)
 
 
 # TODO refactor
 
 
+PretrainedAssignment = namedtuple(
+    'PretrainedAssignment',
+    ['variable', 'assign_op', 'placeholder', 'value_fn'])
+
+# PretrainedAssignment of each pretrained embedding variable by variable name,
+# for each graph; the variables are assigned their pretrained values by
+# assign_pretrained_embeddings() once the session is created. Not a graph
+# collection, as a Python function can't be exported to a MetaGraphDef
+_pretrained_assignments = weakref.WeakKeyDictionary()
+
+
+def get_pretrained_variable(name, shape, value_fn, trainable):
+    """Create a variable to be assigned pretrained embeddings
+
+    The variable is initialized with zeros, and assigned the value through
+    a placeholder by assign_pretrained_embeddings() instead of a constant
+    initializer, which would store the whole matrix in the graph(the
+    GraphDef can't be larger than 2GB).
+
+    :param name: name of the variable
+    :param shape: shape of the variable
+    :param value_fn: function returning the pretrained value(numpy array),
+        called when the variable is assigned
+    :param trainable: whether to train the variable
+    :return: the variable
+    """
+    variable = tf.get_variable(name=name,
+                               initializer=tf.zeros_initializer(),
+                               dtype=tf.float32,
+                               shape=shape,
+                               trainable=trainable)
+    assignments = _pretrained_assignments.setdefault(tf.get_default_graph(),
+                                                     {})
+    if variable.name not in assignments:
+        placeholder = tf.placeholder(tf.float32, shape=shape,
+                                     name=name + '_value')
+        assignments[variable.name] = PretrainedAssignment(
+            variable, variable.assign(placeholder), placeholder, value_fn)
+    return variable
+
+
+def assign_pretrained_embeddings(session, checkpoint_path=None):
+    """Assign the pretrained embeddings to the variables created with
+    get_pretrained_variable() in the session's graph
+
+    Every variable is either assigned or restored: with checkpoint_path, the
+    variables saved in the checkpoint are left as restored and only the
+    missing ones are assigned, so that no embedding file is loaded for a
+    restored model.
+
+    :param session: session to run the assign ops in, its variables
+        initialized or restored from checkpoint_path
+    :param checkpoint_path: checkpoint the variables were restored from,
+        None if they're freshly initialized
+    """
+    saved = set()
+    if checkpoint_path is not None:
+        saved = set(name for name, _ in
+                    tf.train.list_variables(checkpoint_path))
+    assignments = _pretrained_assignments.get(session.graph, {})
+    for variable_name in sorted(assignments):
+        assignment = assignments[variable_name]
+        if assignment.variable.op.name in saved:
+            tf.logging.info('Restored pretrained embeddings of %s from %s' %
+                            (assignment.variable.name, checkpoint_path))
+            continue
+        tf.logging.info('Assigning pretrained embeddings to %s' %
+                        assignment.variable.name)
+        session.run(assignment.assign_op,
+                    feed_dict={assignment.placeholder:
+                               np.float32(assignment.value_fn())})
+
+
 def only_pretrained(word_ids,
                     vocab_size,
                     embed_dim,
@@ -50,18 +126,20 @@ def only_pretrained(word_ids,
     """
 
     if kwargs['is_training']:
-        tf.logging.info('Loading pretrained embeddings from %s' %
-                        pretrained_path)
-        pretrained_matrix = load_pretrained_matrix(pretrained_path)
-        assert pretrained_matrix.shape[
-                   0] == vocab_size, "Given vocab size (%d) not equal to than that " \
-                                     "of the pre-trained embedding (%d)!" % (
-                                         vocab_size,
-                                         pretrained_matrix.shape[0])
-        assert pretrained_matrix.shape[
-                   1] == embed_dim, "Given embed dim (%d) and that of the " \
-                                    "pre-trained embedding (%d) don't match!" % (
-                                        embed_dim, pretrained_matrix.shape[1])
+        def load_matrix():
+            tf.logging.info('Loading pretrained embeddings from %s' %
+                            pretrained_path)
+            pretrained_matrix = load_pretrained_matrix(pretrained_path)
+            assert pretrained_matrix.shape[0] == vocab_size, \
+                "Given vocab size (%d) not equal to than that " \
+                "of the pre-trained embedding (%d)!" % (
+                    vocab_size, pretrained_matrix.shape[0])
+            assert pretrained_matrix.shape[1] == embed_dim, \
+                "Given embed dim (%d) and that of the " \
+                "pre-trained embedding (%d) don't match!" % (
+                    embed_dim, pretrained_matrix.shape[1])
+            return pretrained_matrix
+
         # pretrained file name - .txt
         # word_embedding_name = os.path.basename(pretrained_path)[:-4]
         tf.logging.info(
@@ -69,12 +147,12 @@ def only_pretrained(word_ids,
             'from the training set' %
             pretrained_path)
 
-        # initialize word_embedding layer from pre-trained matrix
-        word_embedding = tf.get_variable(
+        # initialize word_embedding layer from pre-trained matrix, only
+        # loaded if the variable isn't restored
+        word_embedding = get_pretrained_variable(
             name='embedding_pretrained',
-            initializer=tf.constant_initializer(np.float32(pretrained_matrix)),
-            dtype=tf.float32,
-            shape=[pretrained_matrix.shape[0], embed_dim],
+            shape=[vocab_size, embed_dim],
+            value_fn=load_matrix,
             trainable=trainable)
     else:
         # not initializing again but only define placeholders with same names
@@ -113,22 +191,36 @@ def expand_pretrained(word_ids,
     :param embed_dim: dimension of the embeddings given in the config file
     :param pretrained_path: path to the pre-trained word embedding file
     :param trainable: whether to train the pred-trained word embeddings
+    :param random_size: (optional) number of words of the vocabulary not in
+        the pre-trained embeddings(given in args.json), the pre-trained
+        embeddings are loaded to get it otherwise
     :return: embed lookup layer
     """
     # pretrained file name - .txt
     # word_embedding_name = os.path.basename(pretrained_path)[:-4]
-    tf.logging.info('Loading pretrained embeddings from %s' %
-                    pretrained_path)
-    pretrained_matrix = load_pretrained_matrix(pretrained_path)
-    assert pretrained_matrix.shape[
-               0] <= vocab_size, "Given vocab size (%d) is less than that of " \
-                                 "the " \
-                                 "pre-trained embedding (%d)!" % (
-                                     vocab_size, pretrained_matrix.shape[0])
-    assert pretrained_matrix.shape[
-               1] == embed_dim, "Given embed dim (%d) and that of the " \
-                                "pre-trained embedding (%d) don't match!" % (
-                                    embed_dim, pretrained_matrix.shape[1])
+    if kwargs.get('random_size') is not None:
+        pretrained_size = vocab_size - kwargs['random_size']
+    else:
+        tf.logging.info('Loading pretrained embeddings from %s' %
+                        pretrained_path)
+        pretrained_size = load_pretrained_matrix(pretrained_path).shape[0]
+    assert pretrained_size <= vocab_size, \
+        "Given vocab size (%d) is less than that of the " \
+        "pre-trained embedding (%d)!" % (vocab_size, pretrained_size)
+
+    def load_matrix():
+        tf.logging.info('Loading pretrained embeddings from %s' %
+                        pretrained_path)
+        pretrained_matrix = load_pretrained_matrix(pretrained_path)
+        assert pretrained_matrix.shape[0] == pretrained_size, \
+            "Size of the pre-trained embedding (%d) and that of the " \
+            "vocabulary not in the training set (%d) don't match!" % (
+                pretrained_matrix.shape[0], pretrained_size)
+        assert pretrained_matrix.shape[1] == embed_dim, \
+            "Given embed dim (%d) and that of the " \
+            "pre-trained embedding (%d) don't match!" % (
+                embed_dim, pretrained_matrix.shape[1])
+        return pretrained_matrix
 
     if kwargs['is_training']:
 
@@ -137,16 +229,16 @@ def expand_pretrained(word_ids,
             'from the training set' %
             pretrained_path)
 
-        loaded_embedding = tf.get_variable(
+        # only loaded if the variable isn't restored
+        loaded_embedding = get_pretrained_variable(
             name='embedding_pretrained',
-            initializer=tf.constant_initializer(np.float32(pretrained_matrix)),
-            dtype=tf.float32,
-            shape=[pretrained_matrix.shape[0], embed_dim],
+            shape=[pretrained_size, embed_dim],
+            value_fn=load_matrix,
             trainable=trainable)
 
         # randomly initialize word embeddings for words that appear in the
         # training set but not in pre-trained word embeddings
-        extra_vocab_num = vocab_size - pretrained_matrix.shape[0]
+        extra_vocab_num = vocab_size - pretrained_size
         print(
             'There are %d words in the training set(s) that are not found in the '
             'pre-trained word embedding dictionary. '
@@ -165,13 +257,13 @@ def expand_pretrained(word_ids,
 
         loaded_embedding = tf.get_variable(
             name='embedding_pretrained',
-            initializer=tf.zeros(shape=[pretrained_matrix.shape[0], embed_dim],
+            initializer=tf.zeros(shape=[pretrained_size, embed_dim],
                                  dtype=tf.float32),
             dtype=tf.float32,
             trainable=trainable
         )
 
-        extra_vocab_num = vocab_size - pretrained_matrix.shape[0]
+        extra_vocab_num = vocab_size - pretrained_size
         random_embedding = tf.get_variable(
             name='embedding_training',
             initializer=tf.zeros(shape=[extra_vocab_num, embed_dim],
@@ -246,33 +338,44 @@ def init_pretrained(word_ids,
             trainable=True
         )
 
-    # load training vocab
-    with codecs.open(reverse_vocab_path) as file:
-        reverse_vocab = json.load(file)
+    def load_matrix():
+        # load training vocab, from the binary vocabulary if it's up to date
+        binary_vocab = load_binary_vocab(
+            os.path.join(os.path.dirname(reverse_vocab_path),
+                         BINARY_VOCAB_NAME),
+            reverse_vocab_path)
+        if binary_vocab is not None:
+            reverse_vocab = binary_vocab.words()
+        else:
+            with codecs.open(reverse_vocab_path) as file:
+                reverse_vocab_dict = json.load(file)
+            reverse_vocab = [reverse_vocab_dict[str(i)]
+                             for i in range(len(reverse_vocab_dict))]
 
-    tf.logging.info('Loading pretrained embeddings from %s' % pretrained_path)
-    pretrained_vocab = load_pretrianed_vocab_dict(pretrained_path)
-    pretrained_matrix = load_pretrained_matrix(pretrained_path)
+        tf.logging.info('Loading pretrained embeddings from %s' %
+                        pretrained_path)
+        # only the rows of the training vocab found in pretrained
+        loaded_rows = load_pretrained_rows(pretrained_path,
+                                           reverse_vocab[random_size:])
 
-    assert pretrained_matrix.shape[
-               1] == embed_dim, "Given embed dim (%d) and that of the " \
-                                "pre-trained embedding (%d) don't match!" % (
-                                    embed_dim, pretrained_matrix.shape[1])
+        assert loaded_rows.shape[1] == embed_dim, \
+            "Given embed dim (%d) and that of the " \
+            "pre-trained embedding (%d) don't match!" % (
+                embed_dim, loaded_rows.shape[1])
+
+        loaded_matrix = np.zeros([vocab_size - random_size, embed_dim],
+                                 dtype=np.float32)
+        loaded_matrix[:len(loaded_rows)] = loaded_rows
+        return loaded_matrix
 
     # pretrained file name - .txt
     # word_embedding_name = os.path.basename(pretrained_path)[:-4]
-    loaded_matrix = np.zeros([vocab_size - random_size, embed_dim])
-
-    for i in tqdm(range(random_size, len(reverse_vocab))):
-        v = reverse_vocab[str(i)]
-        loaded_matrix[i - random_size] = pretrained_matrix[
-            pretrained_vocab.get(v)]
-
-    loaded_embedding = tf.get_variable(
+    # the vocabulary and pretrained embeddings are only loaded if the
+    # variable isn't restored
+    loaded_embedding = get_pretrained_variable(
         name='embedding_pretrained',
-        initializer=tf.constant_initializer(np.float32(loaded_matrix)),
-        dtype=tf.float32,
         shape=[vocab_size - random_size, embed_dim],
+        value_fn=load_matrix,
         trainable=trainable)
 
     tf.logging.info('Generating embedding lookup layer from %s and the words '
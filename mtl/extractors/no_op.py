@@ -26,7 +26,19 @@ def concat_extractor(inputs, lengths, **kwargs):
   
     Outputs
     -------
-      outputs: a Tensor of size [batch_size, len(inputs)*D].
+      outputs: a Tensor of size [batch_size, len(inputs)*D], a SparseTensor if
+        all the inputs are SparseTensors (e.g. sparse bag of words).
     """
 
+    if all(isinstance(x, tf.SparseTensor) for x in inputs):
+        outputs = tf.sparse_concat(axis=1, sp_inputs=inputs)
+        sizes = [x.get_shape()[-1].value for x in inputs]
+        if None not in sizes:
+            # make the static shape known for the following dense layer
+            outputs = tf.sparse_reshape(outputs, [-1, sum(sizes)])
+        return outputs
+    inputs = [tf.sparse_tensor_to_dense(x)
+              if isinstance(x, tf.SparseTensor) else x
+              for x in inputs]
+
     return tf.concat(inputs, axis=1)  # concat along time axis
@@ -39,6 +39,24 @@ def dense_layer(x, output_size, name, activation=tf.nn.selu):
     else:
         init = glorot_uniform_initializer()
 
+    if isinstance(x, tf.SparseTensor):
+        # e.g. sparse bag of words, multiplied without densifying it; same
+        # variables as tf.layers.dense
+        input_size = x.get_shape()[-1].value
+        if input_size is None:
+            raise ValueError("last dimension of sparse inputs must be known")
+        with tf.variable_scope(name):
+            kernel = tf.get_variable('kernel',
+                                     shape=[input_size, output_size],
+                                     initializer=init)
+            bias = tf.get_variable('bias',
+                                   shape=[output_size],
+                                   initializer=zeros_initializer())
+        outputs = tf.sparse_tensor_dense_matmul(x, kernel) + bias
+        if activation is not None:
+            outputs = activation(outputs)
+        return outputs
+
     return tf.layers.dense(x,
                            output_size,
                            name=name,
@@ -70,7 +88,16 @@ def mlp(x, is_training, hidden_dims=[256, 256], num_layers=2,
         dropout = tf.nn.dropout
 
     if is_training and (input_keep_prob < 1.0):
-        x = dropout(x, input_keep_prob, name='input_dropout')
+        if isinstance(x, tf.SparseTensor):
+            # drop the non-zero entries, keeping the static shape
+            x = tf.sparse_reshape(
+                tf.SparseTensor(x.indices,
+                                dropout(x.values, input_keep_prob,
+                                        name='input_dropout'),
+                                x.dense_shape),
+                [-1, x.get_shape()[-1].value])
+        else:
+            x = dropout(x, input_keep_prob, name='input_dropout')
 
     for i in xrange(num_layers):
         with tf.variable_scope("layer_%d" % i):
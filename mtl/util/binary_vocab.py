@@ -0,0 +1,320 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Binary memory-mapped vocabulary format
+
+A binary vocabulary is a directory of .npy arrays, loaded with
+mmap_mode='r' so that opening it is instantaneous and the pages are shared
+by all the processes reading it:
+
+  strings.npy:  uint8, the utf-8 encoded words sorted by bytes, concatenated
+  offsets.npy:  int64, the len(words) + 1 offsets of the sorted words in
+                strings.npy
+  char_offsets.npy: int64, the same offsets in characters of the decoded
+                strings
+  prefixes.npy: uint64, the first 8 bytes of each sorted word(big-endian,
+                zero padded), searched to narrow down the binary search
+  ids.npy:      int64, the id of each sorted word
+  positions.npy: int64, the position in the sorted words of each id
+  counts.npy:   int64, the frequency of each id(0 if unknown)
+
+The ids are 0..len(words) - 1. It is written alongside the json
+vocabularies(vocab_v2i.json/vocab_i2v.json as vocab.bin, vocab_freq.json as
+vocab_freq.bin) and only used while it is newer than the json file it
+replaces.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+
+import numpy as np
+
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+BINARY_VOCAB_ARRAYS = ['strings', 'offsets', 'char_offsets', 'prefixes',
+                       'ids', 'positions', 'counts']
+
+# number of ids placed in ids.npy at a time by BinaryVocabWriter
+_ID_CHUNK_SIZE = 1 << 20
+
+
+def save_binary_vocab(save_dir, words, counts=None):
+    """Save a vocabulary in the binary format
+
+    :param save_dir: directory to save the arrays to, replaced if it exists
+    :param words: list of the words, the i-th one having id i
+    :param counts: optional frequency of each word id
+    """
+    encoded = [word.encode('utf-8') for word in words]
+    order = sorted(range(len(encoded)), key=encoded.__getitem__)
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(encoded[i]) for i in order], out=offsets[1:])
+    char_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(words[i]) for i in order], out=char_offsets[1:])
+    prefixes = np.array([_prefix(encoded[i]) for i in order],
+                        dtype=np.uint64)
+    strings = np.frombuffer(b''.join(encoded[i] for i in order),
+                            dtype=np.uint8)
+    ids = np.asarray(order, dtype=np.int64)
+    positions = np.empty_like(ids)
+    positions[ids] = np.arange(len(ids), dtype=np.int64)
+    if counts is None:
+        counts = np.zeros(len(ids), dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    assert len(counts) == len(ids)
+
+    # write to a temporary directory first so that readers never see a
+    # partially written vocabulary
+    tmp_dir = save_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in zip(BINARY_VOCAB_ARRAYS,
+                           [strings, offsets, char_offsets, prefixes, ids,
+                            positions, counts]):
+        np.save(os.path.join(tmp_dir, name + '.npy'), array)
+    shutil.rmtree(save_dir, ignore_errors=True)
+    os.rename(tmp_dir, save_dir)
+
+
+class BinaryVocabWriter(object):
+    """Write a binary vocabulary without holding its words in memory
+
+    The words are given in sorted order(their utf-8 bytes are sorted as the
+    Python strings are) with add_sorted_words(), then the position in the
+    sorted words and the count of each id in id order with add_ids(). They
+    are appended to raw files, which close() turns into the .npy arrays.
+    """
+
+    _RAW_FILES = [('strings', np.uint8), ('lengths', np.int64),
+                  ('char_lengths', np.int64), ('prefixes', np.uint64),
+                  ('positions', np.int64), ('counts', np.int64)]
+
+    def __init__(self, save_dir):
+        """
+        :param save_dir: directory to save the arrays to, replaced if it
+            exists
+        """
+        self._save_dir = save_dir
+        # written to a temporary directory first so that readers never see
+        # a partially written vocabulary
+        self._tmp_dir = save_dir.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
+        os.makedirs(self._tmp_dir)
+        self._files = {name: open(self._raw_path(name), 'wb')
+                       for name, _ in self._RAW_FILES}
+        self._num_words = 0
+        self._num_ids = 0
+
+    def _raw_path(self, name):
+        return os.path.join(self._tmp_dir, name + '.raw')
+
+    def add_sorted_words(self, words):
+        """Append words following the ones already added in sorted order
+
+        :param words: list of strings
+        """
+        encoded = [word.encode('utf-8') for word in words]
+        self._files['strings'].write(b''.join(encoded))
+        np.array([len(word) for word in encoded],
+                 dtype=np.int64).tofile(self._files['lengths'])
+        np.array([len(word) for word in words],
+                 dtype=np.int64).tofile(self._files['char_lengths'])
+        np.array([_prefix(word) for word in encoded],
+                 dtype=np.uint64).tofile(self._files['prefixes'])
+        self._num_words += len(words)
+
+    def add_ids(self, positions, counts):
+        """Append the next ids
+
+        :param positions: list of the position in the sorted words of each id
+        :param counts: list of the frequency of each id
+        """
+        np.asarray(positions, dtype=np.int64).tofile(
+            self._files['positions'])
+        np.asarray(counts, dtype=np.int64).tofile(self._files['counts'])
+        self._num_ids += len(positions)
+
+    def close(self):
+        """Write the arrays, every added word having an id"""
+        for file in self._files.values():
+            file.close()
+        assert self._num_ids == self._num_words
+        dtypes = dict(self._RAW_FILES)
+        raw = {name: self._load_raw(name, dtype)
+               for name, dtype in self._RAW_FILES}
+        num_words = self._num_words
+
+        def save(name, dtype, size):
+            return np.lib.format.open_memmap(
+                os.path.join(self._tmp_dir, name + '.npy'), mode='w+',
+                dtype=dtype, shape=(size,))
+
+        arrays = dict()
+        arrays['strings'] = save('strings', np.uint8, len(raw['strings']))
+        arrays['strings'][:] = raw['strings']
+        for name, lengths in [('offsets', 'lengths'),
+                              ('char_offsets', 'char_lengths')]:
+            arrays[name] = save(name, np.int64, num_words + 1)
+            arrays[name][0] = 0
+            np.cumsum(raw[lengths], out=arrays[name][1:])
+        for name in ['prefixes', 'positions', 'counts']:
+            arrays[name] = save(name, dtypes[name], num_words)
+            arrays[name][:] = raw[name]
+        arrays['ids'] = save('ids', np.int64, num_words)
+        for start in range(0, num_words, _ID_CHUNK_SIZE):
+            end = min(start + _ID_CHUNK_SIZE, num_words)
+            arrays['ids'][raw['positions'][start:end]] = np.arange(
+                start, end, dtype=np.int64)
+        for array in arrays.values():
+            array.flush()
+        del arrays, raw
+        for name, _ in self._RAW_FILES:
+            os.remove(self._raw_path(name))
+        shutil.rmtree(self._save_dir, ignore_errors=True)
+        os.rename(self._tmp_dir, self._save_dir)
+
+    def _load_raw(self, name, dtype):
+        if os.path.getsize(self._raw_path(name)) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self._raw_path(name), dtype=dtype, mode='r')
+
+
+def _prefix(encoded_word):
+    """First 8 bytes of an encoded word as an integer, ordered as the
+    words"""
+    return int.from_bytes(encoded_word[:8].ljust(8, b'\0'), 'big')
+
+
+def binary_vocab_up_to_date(binary_dir, json_path=None):
+    """Whether the binary vocabulary exists and isn't older than json_path"""
+    offsets_path = os.path.join(binary_dir, 'offsets.npy')
+    if not os.path.exists(offsets_path):
+        return False
+    if json_path is None or not os.path.exists(json_path):
+        return True
+    return os.path.getmtime(offsets_path) >= os.path.getmtime(json_path)
+
+
+def load_binary_vocab(binary_dir, json_path=None):
+    """Load a binary vocabulary if it's up to date
+
+    :param binary_dir: directory of the binary vocabulary
+    :param json_path: json vocabulary file the binary one was written with
+    :return: BinaryVocab, or None if the json file has to be read instead
+    """
+    if not binary_vocab_up_to_date(binary_dir, json_path):
+        return None
+    return BinaryVocab(binary_dir)
+
+
+class BinaryVocab(Mapping):
+    """Read only word to id mapping of a binary vocabulary
+
+    Words are looked up by binary search in the memory-mapped sorted string
+    table, ids by indexing, without loading the vocabulary into memory.
+    """
+
+    def __init__(self, binary_dir):
+        self._dir = binary_dir
+        arrays = [np.load(os.path.join(binary_dir, name + '.npy'),
+                          mmap_mode='r')
+                  for name in BINARY_VOCAB_ARRAYS]
+        (self._strings, self._offsets, self._char_offsets, self._prefixes,
+         self._ids, self._positions, self._counts) = arrays
+
+    def _sorted_word(self, position):
+        return self._strings[self._offsets[position]:
+                             self._offsets[position + 1]].tobytes()
+
+    def _position(self, word):
+        """Position of the word in the sorted words, -1 if not found
+
+        A word saved more than once(e.g. in a pre-trained embedding file)
+        has the position of its last id, as in a dictionary built in id
+        order.
+        """
+        if not isinstance(word, str):
+            return -1
+        key = word.encode('utf-8')
+        prefix = np.uint64(_prefix(key))
+        low = int(np.searchsorted(self._prefixes, prefix, side='left'))
+        high = int(np.searchsorted(self._prefixes, prefix, side='right'))
+        # words sharing the first 8 bytes, the equal ones being sorted by id
+        while low < high:
+            mid = (low + high) // 2
+            if self._sorted_word(mid) <= key:
+                low = mid + 1
+            else:
+                high = mid
+        if low > 0 and self._sorted_word(low - 1) == key:
+            return low - 1
+        return -1
+
+    def __getitem__(self, word):
+        position = self._position(word)
+        if position < 0:
+            raise KeyError(word)
+        return int(self._ids[position])
+
+    def __contains__(self, word):
+        return self._position(word) >= 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        """Iterate over the words in id order"""
+        for word_id in range(len(self)):
+            yield self.word(word_id)
+
+    def word(self, word_id):
+        """The word of an id"""
+        return self._sorted_word(self._positions[word_id]).decode('utf-8')
+
+    def count(self, word):
+        """Frequency of a word, 0 if unknown"""
+        position = self._position(word)
+        if position < 0:
+            return 0
+        return int(self._counts[self._ids[position]])
+
+    def words(self):
+        """List of all the words in id order, decoded at once"""
+        strings = self._strings.tobytes().decode('utf-8')
+        offsets = self._char_offsets.tolist()
+        sorted_words = [strings[start:end]
+                        for start, end in zip(offsets[:-1], offsets[1:])]
+        return [sorted_words[position]
+                for position in self._positions.tolist()]
+
+    def to_dict(self):
+        """Word to id dictionary of the whole vocabulary"""
+        return {word: word_id for word_id, word in enumerate(self.words())}
+
+    def freq_dict(self):
+        """Word to frequency dictionary in id order"""
+        return dict(zip(self.words(), self._counts.tolist()))
+
+    @property
+    def counts(self):
+        """Memory-mapped frequency of each id"""
+        return self._counts
@@ -21,9 +21,14 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
+import os
 
+import numpy as np
 import six
 
+from mtl.util.constants import VOCAB_ID_COUNTS_NAME
+
 
 class CategoricalVocabulary(object):
     """Categorical variables vocabulary class.
@@ -101,6 +106,24 @@ class CategoricalVocabulary(object):
                 self._reverse_mapping.append(category)
         return self._mapping[category]
 
+    def get_ids(self, categories):
+        """Returns the ids of many words in the vocabulary at once.
+
+        Same as get() on each category, but a frozen vocabulary is looked up
+        without a Python loop.
+
+        Args:
+          categories: list of strings or integers to lookup in vocabulary.
+
+        Returns:
+          int64 numpy array, id of each category in the vocabulary.
+        """
+        if self._freeze:
+            ids = map(self._mapping.get, categories, itertools.repeat(0))
+        else:
+            ids = map(self.get, categories)
+        return np.fromiter(ids, dtype=np.int64, count=len(categories))
+
     def add(self, category, count=1):
         """Adds count of the category to the frequency table.
 
@@ -113,6 +136,16 @@ class CategoricalVocabulary(object):
             return
         self._freq[category] += count
 
+    def add_counts(self, counts):
+        """Adds the counts of many categories to the frequency table.
+
+        Args:
+          counts: dict(e.g. collections.Counter), mapping from category to
+            how many to add.
+        """
+        for category, count in six.iteritems(counts):
+            self.add(category, count)
+
     def trim(self, min_frequency, max_frequency=-1, max_vocab_size=None):
         """Trims vocabulary for minimum frequency.
 
@@ -125,15 +158,23 @@ class CategoricalVocabulary(object):
             Useful to remove very frequent categories (like stop words).
 
         """
-        # Sort by alphabet then reversed frequency.
         if not max_vocab_size:
             max_vocab_size = float('inf')
-        self._freq = sorted(
-            sorted(
-                six.iteritems(self._freq),
-                key=lambda x: (isinstance(x[0], str), x[0])),
-            key=lambda x: x[1],
-            reverse=True)
+        # categories appearing min_frequency times or less are never kept
+        items = [item for item in six.iteritems(self._freq)
+                 if item[1] > min_frequency]
+        max_kept = _max_kept(max_vocab_size)
+        if max_kept is not None:
+            # only the categories skipped for max_frequency and the
+            # max_kept ones after them are visited
+            num_visited = max_kept
+            if max_frequency > 0:
+                num_visited += sum(1 for _, count in items
+                                   if max_frequency <= count)
+            items = _most_frequent(items, num_visited)
+        # Sort by reversed frequency then alphabet.
+        items.sort(key=_trim_order)
+        self._freq = items
         self._mapping = {self._unknown_token: 0}
         if self._support_reverse:
             self._reverse_mapping = [self._unknown_token]
@@ -142,8 +183,6 @@ class CategoricalVocabulary(object):
         for category, count in self._freq:
             if 0 < max_frequency <= count:
                 continue
-            if count <= min_frequency:
-                break
             self._mapping[category] = idx
             idx += 1
             if self._support_reverse:
@@ -186,3 +225,80 @@ class CategoricalVocabulary(object):
     @property
     def reverse_mapping(self):
         return self._reverse_mapping
+
+
+def _trim_order(item):
+    """Sort key of trim(): decreasing frequency, then integers before
+    strings, then increasing category"""
+    category, count = item
+    return -count, isinstance(category, str), category
+
+
+def _max_kept(max_vocab_size):
+    """Number of categories trim() stops after, None if it doesn't stop
+
+    The size is only reached(vocab_size == max_vocab_size after counting the
+    first kept category) by whole sizes of at least 2.
+    """
+    if max_vocab_size == float('inf') or max_vocab_size < 2 or \
+            max_vocab_size != int(max_vocab_size):
+        return None
+    return int(max_vocab_size) - 1
+
+
+def _most_frequent(items, k):
+    """The (category, count) items among the k first ones in trim() order
+
+    A partial selection finds the k-th largest count, so that only the items
+    at least as frequent(ties included) are kept for sorting.
+
+    :param items: list of (category, count)
+    :param k: number of items required
+    :return: list of at least min(k, len(items)) items, unsorted
+    """
+    if k >= len(items):
+        return items
+    counts = np.fromiter((count for _, count in items), dtype=np.float64,
+                         count=len(items))
+    threshold = np.partition(counts, len(items) - k)[len(items) - k]
+    return [item for item, count in zip(items, counts) if count >= threshold]
+
+
+def vocab_cutoff(id_counts, min_frequency=0, max_vocab_size=-1):
+    """Size of the vocabulary trim() would keep from a full vocabulary
+
+    The ids of a vocabulary trimmed with min_frequency=0 and no maximum
+    frequency or size are sorted by decreasing frequency, so trimming it with
+    min_frequency and max_vocab_size keeps the ids below the returned cutoff,
+    the others becoming the unknown token(0).
+
+    :param id_counts: frequency of each word id, id_counts[0] being the
+        unknown token's
+    :param min_frequency: words appearing less than or equal to this number
+        of times are cut off
+    :param max_vocab_size: maximum size of the vocabulary(including the
+        unknown token), no limit if not larger than 1 as in trim()
+    :return: int, the number of ids kept(including the unknown token)
+    """
+    cutoff = 1 + int(np.sum(np.asarray(id_counts)[1:] > min_frequency))
+    if max_vocab_size is not None and max_vocab_size > 1:
+        cutoff = min(cutoff, max_vocab_size)
+    return cutoff
+
+
+def load_vocab_cutoff(dataset_path, min_frequency=None, max_vocab_size=None):
+    """Vocabulary cutoff of TFRecord files written with full_vocab
+
+    :param dataset_path: directory of the TFRecord files
+    :return: the cutoff, or None if neither min_frequency nor max_vocab_size
+        is given
+    """
+    if min_frequency is None and max_vocab_size is None:
+        return None
+    id_counts_path = os.path.join(dataset_path, VOCAB_ID_COUNTS_NAME)
+    if not os.path.exists(id_counts_path):
+        raise ValueError("vocabulary cutoffs need TFRecord files written "
+                         "with full_vocab, %s not found" % id_counts_path)
+    return vocab_cutoff(np.load(id_counts_path),
+                        min_frequency=min_frequency or 0,
+                        max_vocab_size=max_vocab_size or -1)
@@ -27,6 +27,14 @@ TRAIN_RATIO = 0.8  # train out of all
 VALID_RATIO = 0.1  # valid out of all / valid out of train
 RANDOM_SEED = 42
 
+"""Preprocessing"""
+TOKENIZE_CHUNK_SIZE = 1000  # number of examples sent to a tokenizing process
+# at a time
+STEM_CACHE_SIZE = 1 << 20  # maximum number of tokens whose stem is cached
+# by each stemmer in each process
+LOWER_CACHE_SIZE = 1 << 20  # maximum number of tokens whose lowercased form
+# is cached by the fast tweet tokenizer in each process
+
 """Special Symbols"""
 OLD_LINEBREAKS = ['<br /><br />', '\n', '\r',
                   '\\r', '\\n']  # all the line break marks
@@ -64,6 +72,19 @@ VOCAB_NAMES = [
     'crawl-300d-2M.vec.zip',
 ]
 
+# frequency of each word id of a full vocabulary, see
+# categorical_vocabulary.vocab_cutoff()
+VOCAB_ID_COUNTS_NAME = 'vocab_id_counts.npy'
+
+# binary memory-mapped vocabularies written along with vocab_v2i.json/
+# vocab_i2v.json and vocab_freq.json, see binary_vocab.py
+BINARY_VOCAB_NAME = 'vocab.bin'
+BINARY_VOCAB_FREQ_NAME = 'vocab_freq.bin'
+
+# directory of the float32 matrix and binary vocabulary a pre-trained word
+# embedding file is converted to, next to the file, see load_embeds.py
+PRETRAINED_CACHE_SUFFIX = '.npy_cache'
+
 """Experiment names"""
 
 
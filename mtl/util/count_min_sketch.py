@@ -0,0 +1,96 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class CountMinSketch(object):
+    """Approximate token counts in a fixed depth x width table
+
+    Each token is counted in one cell of every row, chosen by a different
+    hash function for each row. The estimate of a token's count, the minimum
+    of its cells, is never lower than the true count, and is higher by at
+    most e / width * (total count) with probability 1 - exp(-depth).
+
+    Tokens are hashed with hash(), which is only consistent within a process
+    (and the processes forked from it), so a sketch shouldn't be saved and
+    reused.
+    """
+
+    def __init__(self, width=1 << 22, depth=4, seed=0):
+        """
+        :param width: number of cells of each row
+        :param depth: number of rows(hash functions)
+        :param seed: random seed of the hash functions
+        """
+        self._width = width
+        self._table = np.zeros((depth, width), dtype=np.int64)
+        rng = np.random.RandomState(seed)
+        # odd multipliers and offsets of the multiply-shift hash functions
+        self._multipliers = rng.randint(0, 1 << 62, size=depth,
+                                        dtype=np.int64).astype(np.uint64) * \
+            np.uint64(2) + np.uint64(1)
+        self._offsets = rng.randint(0, 1 << 62, size=depth,
+                                    dtype=np.int64).astype(np.uint64)
+
+    def _cells(self, tokens):
+        """Cell of each token in each row
+
+        :param tokens: list of hashable tokens
+        :return: depth x len(tokens) int64 array
+        """
+        hashes = np.fromiter((hash(token) for token in tokens),
+                             dtype=np.int64, count=len(tokens))
+        hashes = hashes.view(np.uint64)
+        with np.errstate(over='ignore'):
+            mixed = hashes[np.newaxis, :] * self._multipliers[:, np.newaxis] \
+                + self._offsets[:, np.newaxis]
+        return ((mixed >> np.uint64(32)) % np.uint64(self._width)).astype(
+            np.int64)
+
+    def update(self, tokens):
+        """Count each occurrence of the tokens
+
+        :param tokens: list of hashable tokens
+        """
+        if not tokens:
+            return
+        for row, cells in zip(self._table, self._cells(tokens)):
+            row += np.bincount(cells, minlength=self._width)
+
+    def estimate(self, tokens):
+        """Estimated counts of the tokens, never lower than the true ones
+
+        :param tokens: list of hashable tokens
+        :return: 1-D int64 array
+        """
+        if not tokens:
+            return np.zeros(0, dtype=np.int64)
+        cells = self._cells(tokens)
+        return np.min(
+            [row[row_cells] for row, row_cells in zip(self._table, cells)],
+            axis=0)
+
+    @property
+    def width(self):
+        return self._width
+
+    @property
+    def depth(self):
+        return len(self._table)
@@ -15,6 +15,7 @@
 
 """Data Preprocessing"""
 
+import functools
 import itertools
 import re
 from collections import Counter
@@ -24,6 +25,17 @@ from nltk import WordNetLemmatizer
 from nltk.stem.porter import PorterStemmer
 from nltk.stem.snowball import EnglishStemmer
 from nltk.tokenize import TweetTokenizer
+from nltk.tokenize.casual import EMOTICON_RE
+
+# FastTweetTokenizer reuses TweetTokenizer's internals(including its
+# WORD_RE/PHONE_WORD_RE), which older nltk versions don't have
+try:
+    from nltk.tokenize.casual import (HANDLES_RE, HANG_RE,
+                                      _replace_html_entities)
+except ImportError:
+    HANDLES_RE = HANG_RE = _replace_html_entities = None
+
+from mtl.util.constants import LOWER_CACHE_SIZE, STEM_CACHE_SIZE
 
 """STOP WORDS"""
 NLTK_STOPWORDS = set(
@@ -96,8 +108,109 @@ def my_tokenizer(text):
     return tokens
 
 
+"""Fast tweet tokenizer"""
+
+# nltk's word regexes are compiled with the regex module, which is slower
+# than re; re matches the same tokens on ascii text, but its \s also matches
+# the information separators \x1c-\x1f, which regex's doesn't
+_RE_UNSAFE_RE = re.compile(r"[^\x00-\x1b\x20-\x7f]")
+# reduce_lengthening()'s runs of 3 or more characters, leaving those of 3 as
+# they are
+_REDUCE_LEN_RE = re.compile(r"(.)\1{3,}")
+
+
+def _first_three(match):
+    return match.group()[:3]
+
+
+@functools.lru_cache(maxsize=LOWER_CACHE_SIZE)
+def _lower_token(token):
+    """TweetTokenizer's lowercasing, which keeps emoticons like :D as is"""
+    return token if EMOTICON_RE.search(token) else token.lower()
+
+
+class FastTweetTokenizer(TweetTokenizer):
+    """TweetTokenizer giving the same tokens with less work per text
+
+    The texts are still tokenized one by one, the speedup is per text:
+
+    - html entities and handles are only replaced in texts containing "&"
+      and "@" respectively
+    - the words of texts without non-ascii characters are matched by the
+      same regex compiled with re instead of the regex module(without
+      nltk's wall-clock timeout against adversarial inputs)
+    - lowercased tokens are cached, as the same frequent tokens are checked
+      for emoticons and lowercased over and over
+
+    With an nltk version lacking the internals it relies on, the texts are
+    tokenized by TweetTokenizer.tokenize().
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FastTweetTokenizer, self).__init__(*args, **kwargs)
+        self._fast = HANG_RE is not None and all(
+            hasattr(self, name) for name in
+            ['match_phone_numbers', 'WORD_RE', 'PHONE_WORD_RE'])
+        if not self._fast:
+            return
+        if self.match_phone_numbers:
+            self._word_re = self.PHONE_WORD_RE
+        else:
+            self._word_re = self.WORD_RE
+        self._ascii_word_re = re.compile(self._word_re.pattern,
+                                         re.VERBOSE | re.I | re.UNICODE)
+
+    def tokenize(self, text):
+        """Tokenize a text like TweetTokenizer.tokenize()
+
+        :param text: string
+        :return: list of tokens
+        """
+        if not self._fast:
+            return super(FastTweetTokenizer, self).tokenize(text)
+        if '&' in text:
+            text = _replace_html_entities(text)
+        if self.strip_handles and '@' in text:
+            text = HANDLES_RE.sub(' ', text)
+        if self.reduce_len:
+            text = _REDUCE_LEN_RE.sub(_first_three, text)
+            # then HANG_RE can only shorten runs of linebreaks, the only
+            # characters reduce_lengthening() leaves repeated
+            if '\n\n\n\n' in text:
+                text = HANG_RE.sub(_first_three, text)
+        else:
+            text = HANG_RE.sub(_first_three, text)
+        if _RE_UNSAFE_RE.search(text):
+            words = self._word_re.findall(text)
+        else:
+            words = self._ascii_word_re.findall(text)
+        if not self.preserve_case:
+            words = [_lower_token(word) for word in words]
+        return words
+
+
+fast_tweet_tokenizer = FastTweetTokenizer(strip_handles=True,
+                                          preserve_case=False,
+                                          reduce_len=True)
+
+fast_tweet_tokenizer_keep_handles = FastTweetTokenizer(strip_handles=False,
+                                                       preserve_case=False,
+                                                       reduce_len=True)
+
+
 """Stemmers"""
 
+# one stemmer instance per process, whose stems are cached as the same
+# frequent tokens are stemmed over and over; forked worker processes get a
+# copy of the caches as they are when forking
+_porter_stem = functools.lru_cache(maxsize=STEM_CACHE_SIZE)(
+    PorterStemmer().stem)
+_snowball_stem = functools.lru_cache(maxsize=STEM_CACHE_SIZE)(
+    EnglishStemmer().stem)
+_wordnet_lemmatize = functools.lru_cache(maxsize=STEM_CACHE_SIZE)(
+    WordNetLemmatizer().lemmatize)
+_STEM_CACHES = [_porter_stem, _snowball_stem, _wordnet_lemmatize]
+
 
 def porter_stemmer(tokens):
     """Stem the tokens using nltk.stem.porter.PorterStemmer(
@@ -110,37 +223,35 @@ def porter_stemmer(tokens):
     :param tokens: a list of tokens
     :return: list of stemmed tokens
     """
-    stemmer = PorterStemmer()
-    stemmed = []
-    for item in tokens:
-        stemmed.append(stemmer.stem(item))
-    return stemmed
+    return [_porter_stem(item) for item in tokens]
 
 
 def snowball_stemmer(tokens):
-    """TODO
+    """Stem the tokens using nltk.stem.snowball.EnglishStemmer
 
-    :param tokens:
-    :return:
+    :param tokens: a list of tokens
+    :return: list of stemmed tokens
     """
-    stemmer = EnglishStemmer()
-    stemmed = []
-    for item in tokens:
-        stemmed.append(stemmer.stem(item))
-    return stemmed
+    return [_snowball_stem(item) for item in tokens]
 
 
 def wordnet_stemmer(tokens):
-    """TODO
+    """Lemmatize the tokens(as nouns) using nltk.stem.WordNetLemmatizer
+
+    :param tokens: a list of tokens
+    :return: list of lemmatized tokens
+    """
+    return [_wordnet_lemmatize(item) for item in tokens]
+
+
+def stem_cache_stats():
+    """Hits and misses of the stem caches of this process
 
-    :param tokens:
-    :return:
+    :return: (hits, misses), summed over the stemmers
     """
-    stemmer = WordNetLemmatizer()
-    stemmed = []
-    for item in tokens:
-        stemmed.append(stemmer.lemmatize(item))
-    return stemmed
+    infos = [cache.cache_info() for cache in _STEM_CACHES]
+    return (sum(info.hits for info in infos),
+            sum(info.misses for info in infos))
 
 
 # transform data['text'](string) to ngram model using
@@ -229,13 +340,73 @@ def remove_stopwords(tokens, stopwords, **kwargs):
     return tokens_kept, weights_kept
 
 
-def preproc(string):
+def preproc_reference(string):
+    """The original definition of preproc(), kept to check that the fast
+    path gives the same output(see tests/data_prep_test.py)"""
     string = remove_urls(string)
     string = remove_tags(string)
     string = clean_str(string)
     return string
 
 
+"""Fast path of preproc()"""
+
+# characters clean_str() replaces with spaces, runs of them becoming one
+# space in the end anyway
+_DISALLOWED_RE = re.compile(r"[^A-Za-z0-9(),!?\'\`]+")
+# clean_str()'s contractions, which can't overlap as each apostrophe is
+# followed by a single character
+_CONTRACTION_RE = re.compile(r"\'s|\'ve|n\'t|\'re|\'d|\'ll")
+# clean_str()'s punctuation padding, where the backslashes it adds before
+# "(", ")" and "?" are then replaced with double quotes by
+# re.sub(r"\\""", "\"", string)
+_PUNCTUATION_TABLE = {
+    ord(','): ' , ',
+    ord('!'): ' ! ',
+    ord('('): ' "( ',
+    ord(')'): ' ") ',
+    ord('?'): ' "? '
+}
+_SPACES_RE = re.compile(r" {2,}")
+# characters that html5lib may change in a document without markup
+_HTML_SPECIAL_CHARS = ('<', '&', '\x00', '\r')
+
+
+def fast_remove_urls(string):
+    """remove_urls() without a regex per token: tokens starting with http:
+    or https: are dropped"""
+    return " ".join(tok for tok in string.split()
+                    if not tok.startswith(('http:', 'https:')))
+
+
+def fast_remove_tags(string):
+    """remove_tags() skipping the html parser when there can't be any
+    markup or character reference to remove other than linebreaks(<br />,
+    the only markup of most reviews)"""
+    text = string.replace('<br />', '')
+    for char in _HTML_SPECIAL_CHARS:
+        if char in text:
+            return remove_tags(string)
+    return text
+
+
+def fast_clean_str(string):
+    """clean_str() with precompiled, combined regexes"""
+    string = _DISALLOWED_RE.sub(" ", string)
+    string = _CONTRACTION_RE.sub(r" \g<0>", string)
+    string = string.translate(_PUNCTUATION_TABLE)
+    return _SPACES_RE.sub(" ", string)
+
+
+def preproc(string):
+    """Remove urls and html tags and clean the string, giving the same
+    output as preproc_reference()"""
+    string = fast_remove_urls(string)
+    string = fast_remove_tags(string)
+    string = fast_clean_str(string)
+    return string
+
+
 def main():
     sentence = 'this is aaaaaaaaa a aaaaaa badly beautiful day . , / ? ! \' :) ' \
                '" \' ' \
@@ -24,9 +24,13 @@ import functools
 import gzip
 import itertools
 import json
+import multiprocessing
 import operator
 import os
+import shutil
 import sys
+import zlib
+from collections import Counter
 from pathlib import Path
 
 import numpy as np
@@ -34,21 +38,32 @@ import tensorflow as tf
 from six.moves import xrange
 from tqdm import tqdm
 
+from mtl.util.binary_vocab import save_binary_vocab, load_binary_vocab
 from mtl.util.categorical_vocabulary import CategoricalVocabulary
 from mtl.util.constants import OLD_LINEBREAKS, LINEBREAK, EOS, BOS, OOV
-from mtl.util.constants import RANDOM_SEED
+from mtl.util.constants import RANDOM_SEED, TOKENIZE_CHUNK_SIZE
 from mtl.util.constants import TRAIN_RATIO, VALID_RATIO
-from mtl.util.constants import VOCAB_NAMES
+from mtl.util.constants import VOCAB_NAMES, VOCAB_ID_COUNTS_NAME
+from mtl.util.constants import BINARY_VOCAB_NAME, BINARY_VOCAB_FREQ_NAME
 from mtl.util.data_prep import (tweet_tokenizer,
                                 tweet_tokenizer_keep_handles,
+                                fast_tweet_tokenizer,
+                                fast_tweet_tokenizer_keep_handles,
                                 ruder_tokenizer,
                                 split_tokenizer, lower_tokenizer, preproc,
                                 remove_stopwords, porter_stemmer,
-                                snowball_stemmer, wordnet_stemmer)
+                                snowball_stemmer, wordnet_stemmer,
+                                stem_cache_stats)
 from mtl.util.load_embeds import combine_vocab, reorder_vocab, \
     load_pretrianed_vocab_dict
+from mtl.util.sequences import CSRSequences
 from mtl.util.text import VocabularyProcessor, tokenizer_simple
-from mtl.util.util import bag_of_words, tfidf, make_dir
+from mtl.util.token_cache import token_cache_key, save_token_cache, \
+    load_token_cache
+from mtl.util.util import bag_of_words, sparse_bag_of_words, \
+    document_frequencies, inverse_document_frequencies, sparse_tfidf, \
+    make_dir, iter_json_examples
+from mtl.util.vocab_merge import external_merge_vocab_freq
 
 flags = tf.flags
 logging = tf.logging
@@ -67,6 +82,7 @@ class Dataset:
                  vocab_name='vocab_freq.json',
                  predict_json_path='predict.json.gz',
                  predict_tf_path='predict.tf',
+                 append_json_path=None,
                  **kwargs):
 
         """
@@ -108,16 +124,53 @@ class Dataset:
         :param padding: True if token(word id) list needs padding to
                 max_document_length
         :param write_bow: True if to write bag of words as a feature in the TFRecord
+        :param bow_format: 'dense' to write the bag of words as a vocab_size
+            float list(<field>_bow), 'sparse' to only write the word ids in
+            the text and their values(<field>_bow_indices/_bow_values)
+        :param full_vocab: True if to write the word ids of the full
+            frequency sorted vocabulary(min_frequency=0, no max_vocab_size)
+            along with the frequency of each id(vocab_id_counts.npy), so that
+            min_frequency/max_vocab_size cutoffs can be applied when reading
+            the TFRecord files(see categorical_vocabulary.vocab_cutoff())
+        :param approx_vocab: True if to only count the words appearing more
+            than min_frequency times, found with a count-min sketch of
+            approx_vocab_width x approx_vocab_depth counters, so that the
+            infrequent words are never stored; the basic vocabulary
+            (vocab_freq.json) then only has the words above min_frequency
+        :param approx_vocab_width: number of counters of each row of the
+            count-min sketch
+        :param approx_vocab_depth: number of rows(hash functions) of the
+            count-min sketch
         :param write_tfidf: True if to write tf-idf as a feature in the TFRecord
+            (sparse, <field>_tfidf_indices/_tfidf_values, with the idf of the
+            training data saved to idf.npy along with the vocabulary)
         :param predict_mode: True if to only write unlabeled text to predict
         :param predict_json_path: File path of the gzipped json file of the text to
             predict
         :param predict_tf_path: File path of the TFRecord file of the text to predict
+        :param append_mode: True if to add the examples of append_json_path to
+            the dataset already written to tfrecord_dir, keeping its
+            vocabulary(vocab_dir should be tfrecord_dir), see
+            append_write_tfrecord()
+        :param append_json_path: File path of the gzipped json file of the
+            examples to append
         :param expand_vocab: whether to expand the training vocab with pre-trained
             word embeddings' vocab
         :param preproc: whether to remove urls, trailing/leading whitespaces and
             replace linebreaks
         :param vocab_all: whether to use all three splits when building vocabulary
+        :param streaming: whether to read the examples incrementally instead of
+            loading the whole json file into memory; raw examples are released
+            once they are tokenized
+        :param num_workers: number of processes used to preprocess and
+            tokenize the text, 1 to tokenize in the current process
+        :param token_cache: whether to cache the tokenized text next to the
+            data file, so that later runs with the same data and preprocessing
+            arguments skip reading and tokenizing the data
+        :param num_shards: number of TFRecord files(shards) to write for each
+            split, e.g. train-00000-of-00004.tf, 1 to write train.tf etc.;
+            the shards and splits are written by num_workers processes and
+            the file names are saved as e.g. train_shards in args.json
         """
 
         self._json_dir = json_dir
@@ -127,6 +180,7 @@ class Dataset:
 
         self._args = {
             'predict_mode': False,
+            'append_mode': False,
             'text_field_names': ['text'],
             'label_field_name': ['label'],
             'label_type': 'int',
@@ -147,12 +201,37 @@ class Dataset:
             'train_ratio': TRAIN_RATIO,
             'valid_ratio': VALID_RATIO,
             'random_seed': RANDOM_SEED,
-            'subsample_ratio': 1
+            'subsample_ratio': 1,
+            'streaming': False,
+            'num_workers': 1,
+            'token_cache': False,
+            'num_shards': 1,
+            'bow_format': 'dense',
+            'full_vocab': False,
+            'approx_vocab': False,
+            'approx_vocab_width': 1 << 22,
+            'approx_vocab_depth': 4
         }
         for k, v in kwargs.items():
             # print(k)
             self._args[k] = v
 
+        if self._args['bow_format'] not in ['dense', 'sparse']:
+            raise ValueError(
+                "unrecognized bow format: %s" % self._args['bow_format'])
+
+        if self._args['full_vocab']:
+            # cutoffs are applied when reading the TFRecord files, which only
+            # works for the frequency sorted prefixes of the vocabulary
+            if self._args['max_frequency'] > 0:
+                raise ValueError("max_frequency can't be used with full_vocab")
+            print("Writing the full vocabulary, min_frequency=%s and "
+                  "max_vocab_size=%s are to be applied when reading." % (
+                      self._args['min_frequency'],
+                      self._args['max_vocab_size']))
+            self._args['min_frequency'] = 0
+            self._args['max_vocab_size'] = -1
+
         if self._args['max_document_length'] == -1:
             self._args['max_document_length'] = float('inf')
 
@@ -173,9 +252,17 @@ class Dataset:
         if self._args['predict_mode']:
             assert predict_json_path is not None
             self._data_file_name = predict_json_path
+        elif self._args['append_mode']:
+            assert append_json_path is not None
+            self._data_file_name = append_json_path
         else:
             assert json_dir is not None
             self._data_file_name = os.path.join(json_dir, 'data.json.gz')
+            if not os.path.exists(self._data_file_name) and os.path.exists(
+                os.path.join(json_dir, 'data.jsonl.gz')):
+                # line delimited json, one example per line
+                self._data_file_name = os.path.join(json_dir,
+                                                    'data.jsonl.gz')
 
         self._tokenizer = None
         self.get_tokenizer()
@@ -184,19 +271,27 @@ class Dataset:
         self.get_stemmer()
 
         self._data = None
-        self.read_data()
-
         self._label_list = None
         self._label_set = None
         self._num_classes = None
-        self.get_label()
-
         self._num_examples = 0
         self._sequences = dict()
         self._sequence_lengths = dict()
         self._ids = []
         self._weights = dict()
-        self.get_text()
+        self._idf = None
+        # whether the idf is given in vocab_dir(e.g. that of merged datasets)
+        self._idf_given = False
+        # added to the positions of the examples written as their index
+        # feature, the number of examples already written when appending
+        self._index_offset = 0
+
+        self._token_cache_dir = None
+        if not self.load_token_cache():
+            self.read_data()
+            self.get_label()
+            self.get_text()
+            self.save_token_cache()
 
         self.get_index()
         self.get_max_doc_len()  # TODO remove?
@@ -226,16 +321,45 @@ class Dataset:
             self._vocab_dir = tfrecord_dir
             self._save_vocab_dir = self._vocab_dir
             self.save_vocab()
+            self.write_tfrecord_args()
 
         else:
-            print("Public vocabulary given. Use that to build vocabulary "
-                  "processor.")
-            assert vocab_name in VOCAB_NAMES, vocab_name
-            self._vocab_dir = vocab_dir
-            self._tfrecord_dir = tfrecord_dir  # used to save the combined
-            # vocabulary when loading pretrained word embeddings
-            self._categorical_vocab = self.load_vocab()
+            self.write_tfrecord_with_vocab(tfrecord_dir, vocab_dir, vocab_name)
+
+    def write_tfrecord_with_vocab(self, tfrecord_dir, vocab_dir, vocab_name,
+                                  idf_given=False):
+        """Map the tokenized text with a given (e.g. merged) vocabulary and
+        write the TFRecord files
+
+        Used directly by the merging functions to write the TFRecord files of a
+        dataset already loaded to build the basic vocabulary, so that the data
+        doesn't need to be read and tokenized again.
 
+        :param tfrecord_dir: directory to save generated TFRecord files
+        :param vocab_dir: directory to load the given vocabulary
+        :param vocab_name: 'vocab_freq.json' or 'vocab_v2i.json'
+        :param idf_given: whether to write the tf-idf features with the idf
+            saved in vocab_dir instead of that of the dataset's training data
+        """
+        print("Public vocabulary given. Use that to build vocabulary "
+              "processor.")
+        assert vocab_name in VOCAB_NAMES, vocab_name
+        # forget the basic vocabulary if it has been built
+        self._categorical_vocab = None
+        self._vocab_processor = None
+        self._vocab_freq_dict = None
+        self._vocab_v2i_dict = None
+        self._vocab_i2v_dict = None
+        self._save_vocab_dir = None
+        self._load_vocab_name = vocab_name
+        self._vocab_dir = vocab_dir
+        self._idf_given = idf_given
+        self._tfrecord_dir = tfrecord_dir  # used to save the combined
+        # vocabulary when loading pretrained word embeddings
+        self._categorical_vocab = self.load_vocab()
+        self.write_tfrecord_args()
+
+    def write_tfrecord_args(self):
         # save mapping/reverse mapping to the disk
         # freq:            vocab_dir/vocab_freq.json
         # mapping:         vocab_dir/vocab_v2i.json
@@ -244,21 +368,104 @@ class Dataset:
         self._args['vocab_size'] = len(self._categorical_vocab.mapping)
         print("used vocab size =", self._args['vocab_size'])
 
-        # generate tfidf list if write_tfidf is True
+        # inverse document frequencies used to write the tf-idf features
         if self._args['write_tfidf']:
-            # TODO: determine if tfidf should be calculated based on each
-            # sequence kind or on all sequences regardless of kind
-            raise NotImplementedError(
-                "tfidf (%s) not currently supported" % tfidf)
+            self.get_idf()
+
+        if self._args['append_mode']:
+            # the vocabulary and the idf stay the same
+            self.write_append_tfrecord()
+            self.update_args()
+            return
 
         self.write_tfrecord()
 
         if self._args['predict_mode']:
-            self._tfrecord_dir = os.path.dirname(predict_tf_path)
+            self._tfrecord_dir = os.path.dirname(self._predict_tf_path)
+        else:
+            if self._args['write_tfidf']:
+                self.save_idf()
+            if self._args['full_vocab']:
+                self.save_vocab_id_counts()
         self.write_args()
 
         self.save_vocab()
 
+    def get_idf(self):
+        """Compute the inverse document frequencies from the training data
+
+        Every text field of every training example counts as one document,
+        all the text fields sharing the same vocabulary. In predict mode the
+        idf saved along with the vocabulary (in vocab_dir) is used instead, as
+        well as when appending examples and when the idf is given(that of
+        all the merged datasets).
+        """
+        if self._args['predict_mode'] or self._args['append_mode'] or \
+                self._idf_given:
+            idf_path = os.path.join(self._vocab_dir, 'idf.npy')
+            if not os.path.exists(idf_path):
+                raise ValueError(
+                    "idf of the training data not found: %s" % idf_path)
+            self._idf = np.load(idf_path)
+            assert len(self._idf) == self._args['vocab_size']
+            return
+
+        df, num_docs = self.training_document_frequencies()
+        self._idf = inverse_document_frequencies(df, num_docs)
+
+    def training_document_frequencies(self, vocab_v2i_dict=None):
+        """Document frequencies of the word ids in the training data
+
+        :param vocab_v2i_dict: vocabulary to map the tokens with first, if
+            the texts aren't mapped to word ids yet(e.g. to compute the idf
+            of merged datasets before writing their TFRecord files)
+        :return: (df, num_docs), see document_frequencies()
+        """
+        print("Computing document frequencies from training data...")
+        train_index = np.asarray(self._train_index, dtype=np.int64)
+        if vocab_v2i_dict is None:
+            return document_frequencies(
+                (self._sequences[text_field_name][index]
+                 for text_field_name in self._args['text_field_names']
+                 for index in train_index),
+                self._args['vocab_size'])
+
+        # mapped like transform_text() does with the given vocabulary
+        vocab_processor = VocabularyProcessor(
+            vocabulary=CategoricalVocabulary(unknown_token=OOV,
+                                             support_reverse=False,
+                                             mapping=vocab_v2i_dict),
+            max_document_length=self._args['max_document_length'],
+            tokenizer_fn=tokenizer_simple)
+        sequences = []
+        for text_field_name in self._args['text_field_names']:
+            values, offsets = vocab_processor.transform_csr(
+                [self._sequences[text_field_name][index]
+                 for index in train_index],
+                pad=self._args['padding'])
+            sequences.append(CSRSequences(values, offsets))
+        return document_frequencies(itertools.chain.from_iterable(sequences),
+                                    len(vocab_v2i_dict))
+
+    def save_idf(self):
+        np.save(os.path.join(self._tfrecord_dir, 'idf.npy'), self._idf)
+
+    def save_vocab_id_counts(self):
+        """Save the frequency of each word id of the full vocabulary"""
+        mapping = self._categorical_vocab.mapping
+        freq = self._categorical_vocab.freq
+        if not freq:
+            # mapping loaded from vocab_v2i.json, e.g. merged vocabularies
+            freq = self.load_vocab_freq_dict()
+        id_counts = np.zeros(len(mapping), dtype=np.int64)
+        for word, word_id in mapping.items():
+            id_counts[word_id] = freq.get(word, 0)
+        if np.any(np.diff(id_counts[1:]) > 0):
+            raise ValueError("full_vocab needs a vocabulary sorted by "
+                             "frequency")
+        np.save(os.path.join(self._tfrecord_dir, VOCAB_ID_COUNTS_NAME),
+                id_counts)
+
     def get_max_doc_len(self):
         # only compute from training data
         if self._args['max_document_length'] == -1:
@@ -267,8 +474,9 @@ class Dataset:
                     'Maximum document length not given, computing from training '
                     'data..')
                 for text_field_name in tqdm(self._args['text_field_names']):
-                    tmp_max = max(len(self._sequences[text_field_name][i])
-                                  for i in self._train_index)
+                    tmp_max = int(np.max(
+                        self._sequence_lengths[text_field_name][
+                            np.asarray(self._train_index, dtype=np.int64)]))
                 self._args['max_document_length'] = max(tmp_max,
                                                         self._args[
                                                             'max_document_length'])
@@ -282,9 +490,39 @@ class Dataset:
             print('Maximum document length given:',
                   self._args['max_document_length'])
 
+    def get_length_quantiles(self):
+        """Record the percentiles of the training sequence lengths
+
+        length_quantiles in args.json maps each text field to the 0th, 1st,
+        ..., 100th percentiles of the lengths of its training sequences, from
+        which the training pipeline derives its length buckets. The lengths
+        are the <field>_length features the pipeline buckets the examples by,
+        capped at max_document_length: longer sequences are truncated and
+        all go to the last bucket anyway.
+        """
+        train_index = np.asarray(self._train_index, dtype=np.int64)
+        self._args['length_quantiles'] = dict()
+        if len(train_index) == 0:
+            return
+        for text_field_name in self._args['text_field_names']:
+            self._args['length_quantiles'][text_field_name] = \
+                length_quantiles(self.capped_lengths(text_field_name,
+                                                     train_index))
+
+    def capped_lengths(self, text_field_name, index):
+        """Sequence lengths of the examples capped at max_document_length"""
+        lengths = self._sequence_lengths[text_field_name][index]
+        if np.isinf(self._args['max_document_length']):
+            return lengths
+        return np.minimum(lengths, int(self._args['max_document_length']))
+
     def get_index(self):
         if self._args['predict_mode']:
             self._predict_index = np.asarray(range(self._num_examples))
+        elif self._args['append_mode']:
+            (self._train_index, self._valid_index, self._test_index,
+             self._unlabeled_index) = self.append_split(
+                self._args['train_ratio'], self._args['valid_ratio'])
         else:
             assert self._ids == []
             print("Generating train/valid/test splits...")
@@ -308,22 +546,13 @@ class Dataset:
             return
 
         # write TFRecords for train/valid/test data
+        self.get_length_quantiles()
 
         # write labeled data to TFRecord files
         make_dir(self._tfrecord_dir)
-        self._args['train_path'] = os.path.join(self._tfrecord_dir, 'train.tf')
-        self._args['valid_path'] = os.path.join(self._tfrecord_dir, 'valid.tf')
-        self._args['test_path'] = os.path.join(self._tfrecord_dir, 'test.tf')
-
-        print("Writing TFRecord file for the training data...")
-        self.write_examples(
-            self._args['train_path'], self._train_index, labeled=True)
-        print("Writing TFRecord file for the validation data...")
-        self.write_examples(
-            self._args['valid_path'], self._valid_index, labeled=True)
-        print("Writing TFRecord file for the test data...")
-        self.write_examples(
-            self._args['test_path'], self._test_index, labeled=True)
+        splits = [('train', self._train_index, True),
+                  ('valid', self._valid_index, True),
+                  ('test', self._test_index, True)]
 
         # write unlabeled data to TFRecord files if there're any
 
@@ -334,26 +563,192 @@ class Dataset:
         else:
             print("Unlabeled data found.")
             self._args['_has_unlabeled'] = True
-            print("Writing TFRecord files for the unlabeled data...")
-            self._args['unlabeled_path'] = os.path.join(self._tfrecord_dir,
-                                                        'unlabeled.tf')
-            self.write_examples(
-                self._args['unlabeled_path'], self._unlabeled_index,
-                labeled=False)
+            splits.append(('unlabeled', self._unlabeled_index, False))
+
+        # split_shards: file names relative to tfrecord_dir
+        # split_path: the file, or the pattern of the shards' file names
+        num_shards = self._args['num_shards']
+        jobs = []
+        for split, split_index, labeled in splits:
+            if num_shards <= 1:
+                file_names = [split + '.tf']
+                self._args[split + '_path'] = os.path.join(self._tfrecord_dir,
+                                                           file_names[0])
+                shard_indices = [split_index]
+            else:
+                file_names = ['%s-%05d-of-%05d.tf' % (split, i, num_shards)
+                              for i in range(num_shards)]
+                self._args[split + '_path'] = os.path.join(
+                    self._tfrecord_dir,
+                    '%s-*-of-%05d.tf' % (split, num_shards))
+                shard_indices = np.array_split(np.asarray(split_index),
+                                               num_shards)
+            self._args[split + '_shards'] = file_names
+            for file_name, shard_index in zip(file_names, shard_indices):
+                jobs.append((os.path.join(self._tfrecord_dir, file_name),
+                             shard_index, labeled))
+
+        self.write_shards(jobs)
+
+    def write_append_tfrecord(self):
+        """Write the appended examples to new shards next to the existing
+        TFRecord files
+
+        The new shards of the k-th append(counting from 0) are named e.g.
+        train-append0000k-00000-of-00002.tf, splits without new examples get
+        no files. The appended examples are indexed after the examples
+        already written(num_examples in args.json).
+
+        Like the vocabulary, the word counts and the idf stay those of the
+        original training data: the word ids, and the full_vocab cutoffs
+        applied to them, are ordered by these counts.
+        """
+        args_path = os.path.join(self._tfrecord_dir, "args.json")
+        with codecs.open(args_path, mode='r', encoding='utf-8') as file:
+            self._append_args = json.load(file)
+
+        if 'num_examples' in self._append_args:
+            self._index_offset = self._append_args['num_examples']
+        elif self._append_args.get('subsample_ratio', 1) < 1:
+            raise ValueError("can't append to a subsampled dataset whose "
+                             "args.json has no num_examples")
+        else:
+            # written before num_examples was recorded, every example is in
+            # one of the splits
+            self._index_offset = sum(
+                self._append_args.get(split + '_size', 0)
+                for split in ['train', 'valid', 'test', 'unlabeled'])
+
+        labels = set(label for label in self._label_list
+                     if label is not None)
+        unknown = labels.difference(self._append_args['labels'])
+        if unknown:
+            raise ValueError("unrecognized labels: %s" % sorted(unknown))
+
+        append_id = self._append_args.get('num_appends', 0)
+        num_shards = max(self._args['num_shards'], 1)
+        splits = [('train', self._train_index, True),
+                  ('valid', self._valid_index, True),
+                  ('test', self._test_index, True),
+                  ('unlabeled', self._unlabeled_index, False)]
+        self._append_shards = dict()
+        jobs = []
+        for split, split_index, labeled in splits:
+            if len(split_index) == 0:
+                continue
+            split_shards = min(num_shards, len(split_index))
+            file_names = ['%s-append%05d-%05d-of-%05d.tf' % (
+                split, append_id, i, split_shards)
+                          for i in range(split_shards)]
+            self._append_shards[split] = file_names
+            shard_indices = np.array_split(np.asarray(split_index),
+                                           split_shards)
+            for file_name, shard_index in zip(file_names, shard_indices):
+                jobs.append((os.path.join(self._tfrecord_dir, file_name),
+                             shard_index, labeled))
+
+        self.write_shards(jobs)
+
+    def update_args(self):
+        """Add the appended shards and examples to args.json in place"""
+        args_path = os.path.join(self._tfrecord_dir, "args.json")
+        args = self._append_args
+
+        for split, file_names in self._append_shards.items():
+            if args.get(split + '_shards'):
+                shards = args[split + '_shards']
+            elif args.get(split + '_path'):
+                shards = [os.path.basename(args[split + '_path'])]
+            else:
+                shards = []
+            args[split + '_shards'] = shards + file_names
+            if not args.get(split + '_path'):
+                args[split + '_path'] = os.path.join(self._tfrecord_dir,
+                                                     file_names[0])
+            args[split + '_size'] = args.get(split + '_size', 0) + \
+                                    self._args[split + '_size']
+        if 'unlabeled' in self._append_shards:
+            args['has_unlabeled'] = True
+        args['num_appends'] = args.get('num_appends', 0) + 1
+        args['num_examples'] = self._index_offset + self._num_examples
+
+        if len(self._train_index) > 0 and 'length_quantiles' in args:
+            train_size = args['train_size'] - self._args['train_size']
+            train_index = np.asarray(self._train_index, dtype=np.int64)
+            for text_field_name in self._args['text_field_names']:
+                lengths = self.capped_lengths(text_field_name, train_index)
+                quantiles = args['length_quantiles'].get(text_field_name)
+                if quantiles and train_size > 0:
+                    args['length_quantiles'][text_field_name] = \
+                        merge_length_quantiles(quantiles, train_size,
+                                               lengths)
+                else:
+                    args['length_quantiles'][text_field_name] = \
+                        length_quantiles(lengths)
+
+        print("Updated split sizes: train : valid : test : unlabeled = "
+              "%d : %d : %d : %d" % (args['train_size'], args['valid_size'],
+                                     args['test_size'],
+                                     args['unlabeled_size']))
+
+        # replace the file at once so that it's never left half written
+        tmp_path = args_path + '.tmp'
+        with codecs.open(tmp_path, mode='w', encoding='utf-8') as file:
+            json.dump(args, file, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, args_path)
+
+    def write_shards(self, jobs):
+        """Write TFRecord files, in parallel if num_workers > 1
+
+        The dataset is shared with forked writing processes instead of being
+        pickled. Files are written one after another when already running in
+        a pool worker, which can't start processes.
+
+        :param jobs: list of (file_name, split_index, labeled)
+        """
+        num_workers = min(self._args['num_workers'], len(jobs))
+        if num_workers <= 1 or multiprocessing.current_process().daemon:
+            for file_name, split_index, labeled in jobs:
+                print("Writing TFRecord file", file_name)
+                self.write_examples(file_name, split_index, labeled)
+            return
+
+        global _dataset_to_write
+        _dataset_to_write = self
+        print("Writing %d TFRecord files with %d processes..." % (
+            len(jobs), num_workers))
+        pool = multiprocessing.get_context('fork').Pool(num_workers)
+        try:
+            pool.starmap(_write_examples, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+            _dataset_to_write = None
 
     def get_label(self):
         print('Generating label list...')
         if self._args['label_type'] == 'int':
-            transfer = int
+            self._label_transfer = int
         elif self._args['label_type'] == 'float':
-            transfer = float
+            self._label_transfer = float
         else:
             raise TypeError('Label type other than "int" and "float" is not '
                             'implemetned!')
-        self._label_list = [transfer(item[self._args['label_field_name']])
-                            if self._args['label_field_name'] in item else None
-                            for
-                            item in tqdm(self._data)]
+        if self._args['streaming']:
+            # labels are collected in get_text() while streaming through the
+            # examples
+            self._label_list = []
+            return
+        self._label_list = [self.get_item_label(item)
+                            for item in tqdm(self._data)]
+        self.get_label_set()
+
+    def get_item_label(self, item):
+        if self._args['label_field_name'] in item:
+            return self._label_transfer(item[self._args['label_field_name']])
+        return None
+
+    def get_label_set(self):
         # TODO: is it possible that the label list read doesn't cover all the
         # labels?
         self._label_set = set(self._label_list)
@@ -361,9 +756,17 @@ class Dataset:
         self._num_classes = len(set(self._label_list))
 
     def read_data(self):
+        if self._args['streaming']:
+            print('Streaming data from', self._data_file_name)
+            self._data = iter_json_examples(self._data_file_name)
+            return
         print('Loading data from', self._data_file_name)
         with gzip.open(self._data_file_name, mode='rt') as file:
-            self._data = json.load(file, encoding='utf-8')
+            if self._data_file_name.endswith('.jsonl.gz'):
+                self._data = [json.loads(line) for line in file
+                              if line.strip()]
+            else:
+                self._data = json.load(file, encoding='utf-8')
 
     def get_text(self):
         # tokenize and reconstruct as string(which vocabulary processor
@@ -391,54 +794,15 @@ class Dataset:
 
         print("Generating text lists...")
         min_seq_len = sys.maxsize
-        for index, item in tqdm(enumerate(self._data)):
-            self._num_examples += 1
-
-            if self._args['predict_mode']:
-                if 'id' in item:
-                    self._ids.append(item['id'])
-
-            for text_field_name in self._args['text_field_names']:
-                text = item[text_field_name]
-
-                if self._args['preproc']:
-
-                    # remove leading and trailing whitespaces(to get rid of redundant
-                    # linebreaks)
-                    text = text.strip()
-                    text = preproc(text)
-
-                    # replace line breaks
-                    for old_linebreak in OLD_LINEBREAKS:
-                        text = text.replace(old_linebreak, LINEBREAK)
-
-                text = self._tokenizer(text)
-                if self._stemmer:
-                    text = self._stemmer(text)
-
-                text = [BOS] + text + [EOS]
-
-                if 'weight' in item:
+        for index, tokenized in tqdm(enumerate(self.tokenize_examples())):
+            for text_field_name, (text, weights) in zip(
+                self._args['text_field_names'], tokenized):
 
+                if weights is not None:
                     if text_field_name not in self._weights:
                         self._weights[text_field_name] = []
-                    weights = [float(weight) for weight in
-                               item['weight'].split()]
-                    # TODO un-hardcode
-                    # add 1.0 for BOS and EOS
-                    weights = [1.0] + weights + [1.0]
                     self._weights[text_field_name].append(weights)
 
-                if self._args['stopwords']:
-                    if 'weight' in item:
-                        text, self._weights[text_field_name][index] = \
-                            remove_stopwords(text, stopwords='nltk',
-                                             weights=
-                                             self._weights[text_field_name][
-                                                 index])
-                    else:
-                        text = remove_stopwords(text, stopwords='nltk')
-
                 if len(text) < 3:
                     print(" Empty text in", self._json_dir, 'index', index)
                 # assert len(text) >= 3, old_text
@@ -454,6 +818,15 @@ class Dataset:
 
         print('Minimum sequence length: %d' % min_seq_len)
 
+        # raw examples are not needed any more once tokenized
+        self._data = None
+        if self._args['streaming']:
+            self.get_label_set()
+
+        for text_field_name in self._args['text_field_names']:
+            self._sequence_lengths[text_field_name] = np.asarray(
+                self._sequence_lengths[text_field_name], dtype=np.int64)
+
         for text_field_name in self._args['text_field_names']:
             # Check that every example has every field
             assert len(self._sequences[text_field_name]) == self._num_examples, \
@@ -462,33 +835,143 @@ class Dataset:
             assert len(
                 self._sequence_lengths[text_field_name]) == self._num_examples
 
+    def iter_examples(self):
+        """Yield the text fields and the weights of each example
+
+        The label and the id of the example are recorded on the way, so that
+        they stay aligned with the tokenized text.
+        """
+        for item in self._data:
+            self._num_examples += 1
+
+            if self._args['streaming']:
+                self._label_list.append(self.get_item_label(item))
+
+            if self._args['predict_mode']:
+                if 'id' in item:
+                    self._ids.append(item['id'])
+
+            yield ([item[text_field_name]
+                    for text_field_name in self._args['text_field_names']],
+                   item.get('weight'))
+
+    def tokenize_examples(self):
+        """Yield the tokenized text fields of each example in order
+
+        The examples are tokenized in chunks, text by text. With
+        num_workers > 1 the chunks are tokenized by a pool of processes; imap
+        keeps the original order.
+        """
+        chunks = iter_chunks(self.iter_examples(), TOKENIZE_CHUNK_SIZE)
+        if self._args['num_workers'] <= 1:
+            tokenizer = get_tokenizer_fn(self._args['tokenizer_'])
+            hits, misses = stem_cache_stats()
+            for chunk in chunks:
+                for tokenized in tokenize_examples(
+                        chunk, tokenizer, self._stemmer,
+                        self._args['preproc'], self._args['stopwords']):
+                    yield tokenized
+            if self._stemmer:
+                end_hits, end_misses = stem_cache_stats()
+                report_stem_cache(end_hits - hits, end_misses - misses)
+            return
+
+        print('Tokenizing with %d processes...' % self._args['num_workers'])
+        pool = multiprocessing.Pool(
+            self._args['num_workers'],
+            initializer=_init_tokenize_worker,
+            initargs=(self._args['tokenizer_'], self._args['stemmer'],
+                      self._args['preproc'], self._args['stopwords']))
+        hits, misses = 0, 0
+        try:
+            # the chunks are read lazily by the pool's task thread, which
+            # blocks once the task queue's pipe is full, so the workers never
+            # wait for a group of chunks to finish and streamed examples are
+            # only read a few chunks ahead
+            for tokenized_chunk, (chunk_hits, chunk_misses) in pool.imap(
+                    _tokenize_chunk, chunks, chunksize=1):
+                hits += chunk_hits
+                misses += chunk_misses
+                for tokenized in tokenized_chunk:
+                    yield tokenized
+        finally:
+            pool.close()
+            pool.join()
+        if self._stemmer:
+            report_stem_cache(hits, misses)
+
+    def get_token_cache_dir(self):
+        """Cache directory of the tokenized text, next to the data file"""
+        config = {k: self._args[k] for k in ['text_field_names',
+                                             'label_field_name',
+                                             'label_type',
+                                             'tokenizer_',
+                                             'stemmer',
+                                             'stopwords',
+                                             'preproc',
+                                             'predict_mode']}
+        return os.path.join(os.path.dirname(self._data_file_name),
+                            'token_cache',
+                            token_cache_key(self._data_file_name, config))
+
+    def load_token_cache(self):
+        """Load the tokenized text from the cache if there's one
+
+        :return: True if the cache was found and loaded
+        """
+        if not self._args['token_cache']:
+            return False
+        self._token_cache_dir = self.get_token_cache_dir()
+        if not os.path.exists(self._token_cache_dir):
+            print('Tokenized text not cached yet.')
+            return False
+
+        print('Loading tokenized text from', self._token_cache_dir)
+        self._sequences, self._weights, meta = load_token_cache(
+            self._token_cache_dir, self._args['text_field_names'])
+        for text_field_name in self._args['text_field_names']:
+            self._sequence_lengths[text_field_name] = np.asarray(
+                [len(text) for text in self._sequences[text_field_name]],
+                dtype=np.int64)
+        self._num_examples = meta['num_examples']
+        self._label_list = meta['labels']
+        self._ids = meta['ids']
+        self.get_label_set()
+        return True
+
+    def save_token_cache(self):
+        if not self._args['token_cache']:
+            return
+        print('Caching tokenized text to', self._token_cache_dir)
+        make_dir(os.path.dirname(self._token_cache_dir))
+        save_token_cache(self._token_cache_dir,
+                         self._args['text_field_names'],
+                         self._sequences,
+                         self._weights,
+                         {'num_examples': self._num_examples,
+                          'labels': self._label_list,
+                          'ids': self._ids})
+
+    def __getstate__(self):
+        # the tokenizer and stemmer functions are rebuilt from the arguments
+        # when unpickling, e.g. when returned by a worker process
+        state = self.__dict__.copy()
+        if '_tokenizer' in state:
+            state['_tokenizer'] = None
+            state['_stemmer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if '_tokenizer' in state:
+            self.get_tokenizer()
+            self.get_stemmer()
+
     def get_tokenizer(self):
-        if self._args['tokenizer_'] == "tweet_tokenizer":
-            self._tokenizer = tweet_tokenizer.tokenize
-        elif self._args['tokenizer_'] == "tweet_tokenizer_keep_handles":
-            self._tokenizer = tweet_tokenizer_keep_handles.tokenize
-        elif self._args['tokenizer_'] == "ruder_tokenizer":
-            self._tokenizer = functools.partial(ruder_tokenizer,
-                                                preserve_case=False)
-        elif self._args['tokenizer_'] == "split_tokenizer":
-            self._tokenizer = functools.partial(split_tokenizer)
-        elif self._args['tokenizer_'] == "lower_tokenizer":
-            self._tokenizer = functools.partial(lower_tokenizer)
-        else:
-            raise ValueError(
-                "unrecognized tokenizer: %s" % self._args['tokenizer_'])
+        self._tokenizer = get_tokenizer_fn(self._args['tokenizer_'])
 
     def get_stemmer(self):
-        if self._args['stemmer'] == 'porter_stemmer':
-            self._stemmer = porter_stemmer
-        elif self._args['stemmer'] == 'snowball_stemmer':
-            self._stemmer = snowball_stemmer
-        elif self._args['stemmer'] == 'wordnet_stemmer':
-            self._stemmer = wordnet_stemmer
-        elif not self._args['stemmer']:
-            self._stemmer = None
-        else:
-            raise ValueError("unrecognized stemmer: %s" % self._args['stemmer'])
+        self._stemmer = get_stemmer_fn(self._args['stemmer'])
 
     def build_vocab(self):
         """Builds vocabulary for this dataset only using tensorflow's
@@ -500,7 +983,7 @@ class Dataset:
 
         training_docs = self.get_training_docs()
 
-        self._vocab_processor.fit(training_docs)
+        self.fit_vocab_processor(training_docs)
 
         self.transform_text()
 
@@ -518,10 +1001,9 @@ class Dataset:
 
     def save_vocab_freq(self):
         make_dir(self._save_vocab_dir)
-        with codecs.open(os.path.join(self._save_vocab_dir, "vocab_freq.json"),
-                         mode='w', encoding='utf-8')as file:
-            json.dump(self._vocab_freq_dict, file,
-                      ensure_ascii=False, indent=4)
+        save_vocab_freq_dict(self._vocab_freq_dict,
+                             os.path.join(self._save_vocab_dir,
+                                          "vocab_freq.json"))
 
     def save_v2i_dict(self):
         make_dir(self._save_vocab_dir)
@@ -560,6 +1042,14 @@ class Dataset:
         if self._vocab_v2i_dict or self._categorical_vocab:
             self.save_v2i_dict()
             self.save_i2v_dict()
+            if self._categorical_vocab:
+                save_binary_mapping(
+                    self._save_vocab_dir, self._categorical_vocab.mapping,
+                    self._vocab_freq_dict or self._categorical_vocab.freq)
+            else:
+                save_binary_mapping(self._save_vocab_dir,
+                                    self._vocab_v2i_dict,
+                                    self._vocab_freq_dict)
 
     def get_training_docs(self):
         # build vocabulary only according to training data
@@ -585,14 +1075,17 @@ class Dataset:
         's training data) are taken into account when merging with other
         vocabularies"""
 
+        # the approximate counting only keeps the words above min_frequency
         self._vocab_processor = VocabularyProcessor(
             max_document_length=self._args['max_document_length'],
+            min_frequency=self._args['min_frequency']
+            if self._args['approx_vocab'] else 0,
             tokenizer_fn=tokenizer_simple)
 
         # build vocabulary only according to training data
         training_docs = self.get_training_docs()
 
-        self._vocab_processor.fit(training_docs)
+        self.fit_vocab_processor(training_docs)
         self._categorical_vocab = self._vocab_processor.vocabulary_
 
         self._vocab_freq_dict = self._vocab_processor.vocabulary_.freq
@@ -604,11 +1097,7 @@ class Dataset:
     def load_make_vocab(self):
         """Load word frequency vocabulary and generate word id mapping"""
         make_dir(self._vocab_dir)
-        print('Use word frequency dictionary:',
-              os.path.join(self._vocab_dir, 'vocab_freq.json'))
-        with codecs.open(os.path.join(self._vocab_dir, 'vocab_freq.json'),
-                         mode='r', encoding='utf-8') as file:
-            self._vocab_freq_dict = json.load(file)
+        self._vocab_freq_dict = self.load_vocab_freq_dict()
 
         categorical_vocab = CategoricalVocabulary(unknown_token=OOV)
         for word in self._vocab_freq_dict:
@@ -619,6 +1108,18 @@ class Dataset:
         categorical_vocab.freeze()
         return categorical_vocab
 
+    def load_vocab_freq_dict(self):
+        """Load vocab_dir/vocab_freq.json, from its binary version
+        (vocab_freq.bin) if it's up to date"""
+        json_path = os.path.join(self._vocab_dir, 'vocab_freq.json')
+        print('Use word frequency dictionary:', json_path)
+        binary_vocab = load_binary_vocab(
+            os.path.join(self._vocab_dir, BINARY_VOCAB_FREQ_NAME), json_path)
+        if binary_vocab is not None:
+            return binary_vocab.freq_dict()
+        with codecs.open(json_path, mode='r', encoding='utf-8') as file:
+            return json.load(file)
+
     def init_vocab_processor(self):
         self._vocab_processor = VocabularyProcessor(
             max_document_length=self._args['max_document_length'],
@@ -627,6 +1128,20 @@ class Dataset:
             max_frequency=self._args['max_frequency'],
             tokenizer_fn=tokenizer_simple)
 
+    def fit_vocab_processor(self, training_docs):
+        if self._args['approx_vocab']:
+            print("Counting the words above min_frequency=%s with a %d x %d "
+                  "count-min sketch..." % (self._args['min_frequency'],
+                                           self._args['approx_vocab_depth'],
+                                           self._args['approx_vocab_width']))
+            self._vocab_processor.fit(
+                training_docs,
+                sketch_width=self._args['approx_vocab_width'],
+                sketch_depth=self._args['approx_vocab_depth'])
+        else:
+            self._vocab_processor.fit(training_docs,
+                                      num_workers=self._args['num_workers'])
+
     def get_train_vocab_list(self):
         """Get all the word types in the training docs
 
@@ -637,7 +1152,7 @@ class Dataset:
 
         training_docs = self.get_training_docs()
 
-        self._vocab_processor.fit(training_docs)
+        self.fit_vocab_processor(training_docs)
 
         return self._vocab_processor.vocabulary_.reverse_mapping
 
@@ -647,12 +1162,7 @@ class Dataset:
         if self._load_vocab_name == 'vocab_freq.json':
             # used when to merge new vocabulary using the vocabulary given
 
-            print('Use word frequency dictionary:',
-                  os.path.join(self._vocab_dir, 'vocab_freq.json'))
-
-            with codecs.open(os.path.join(self._vocab_dir, 'vocab_freq.json'),
-                             mode='r', encoding='utf-8') as file:
-                self._vocab_freq_dict = json.load(file)
+            self._vocab_freq_dict = self.load_vocab_freq_dict()
 
             categorical_vocab = CategoricalVocabulary(unknown_token=OOV)
             for word in self._vocab_freq_dict:
@@ -671,10 +1181,16 @@ class Dataset:
             if self._load_vocab_name == 'vocab_v2i.json':
                 print('Use self-generated vocab mapping.')
                 # this vocabulary mapping is generated solely on the training data
-                with codecs.open(
-                    os.path.join(self._vocab_dir, 'vocab_v2i.json'),
-                    mode='r', encoding='utf-8') as file:
-                    self._vocab_v2i_dict = json.load(file)
+                json_path = os.path.join(self._vocab_dir, 'vocab_v2i.json')
+                binary_vocab = load_binary_vocab(
+                    os.path.join(self._vocab_dir, BINARY_VOCAB_NAME),
+                    json_path)
+                if binary_vocab is not None:
+                    self._vocab_v2i_dict = binary_vocab.to_dict()
+                else:
+                    with codecs.open(json_path, mode='r',
+                                     encoding='utf-8') as file:
+                        self._vocab_v2i_dict = json.load(file)
             else:
                 # use the pretrained word embeddings' dictionary
 
@@ -704,6 +1220,10 @@ class Dataset:
                             train_vocab_list)
 
                         self._args['vocab_size'] = len(self._vocab_v2i_dict)
+                        # number of words not in pretrained, which come first
+                        # in the vocab, so that the embedders know the size of
+                        # the pretrained embeddings without loading them
+                        self._args['random_size'] = len(self._vocab_extra)
 
                         # save the combined vocab to the disk for future use
                         self._save_vocab_dir = self._tfrecord_dir
@@ -760,25 +1280,21 @@ class Dataset:
         return self._vocab_processor.vocabulary_
 
     def transform_text(self):
-        if self._args['padding']:
-            # TODO: update implementation of transform_pad() to take a max length
-            # as different kinds of sequences within a single example will have
-            # different max lengths
-            for text_field_name in self._args['text_field_names']:
-                self._sequences[text_field_name] = list(
-                    self._vocab_processor.transform_pad(
-                        self._sequences[text_field_name]))
-        else:
-            for text_field_name in self._args['text_field_names']:
-                self._sequences[text_field_name] = list(
-                    self._vocab_processor.transform(
-                        self._sequences[text_field_name]))
+        """Map the tokens to word ids
 
+        The word ids of each text field are stored in a CSRSequences (a flat
+        int32 array with the offsets of each example) instead of a list per
+        example.
+        """
         for text_field_name in self._args['text_field_names']:
-            self._sequences[text_field_name] = [list(i)
-                                                for i
-                                                in self._sequences[
-                                                    text_field_name]]
+            # TODO: update implementation of padding to take a max length as
+            # different kinds of sequences within a single example will have
+            # different max lengths
+            values, offsets = self._vocab_processor.transform_csr(
+                self._sequences[text_field_name],
+                pad=self._args['padding'])
+            self._sequences[text_field_name] = CSRSequences(
+                values.astype(np.int32), offsets)
 
     def write_examples(self, file_name, split_index, labeled):
         # write to TFRecord data file
@@ -790,7 +1306,7 @@ class Dataset:
                 # Gather sequences and sequence statistics
                 feature['index'] = tf.train.Feature(
                     int64_list=tf.train.Int64List(
-                        value=[index]))
+                        value=[index + self._index_offset]))
 
                 if self._ids:
                     feature['id'] = tf.train.Feature(
@@ -813,17 +1329,15 @@ class Dataset:
                                 value=self._weights[text_field_name][index])
                         )
 
+                    sequence = self._sequences[text_field_name][index]
                     types, counts = get_types_and_counts(
-                        self._sequences[text_field_name][
-                            index])  # including BOS and EOS
+                        sequence)  # including BOS and EOS
                     assert len(types) == len(counts)
                     assert len(types) > 0
-                    for t in types:
-                        assert t >= 0
-                        assert t < self._args['vocab_size']
-                    for c in counts:
-                        assert c > 0
-                        assert c <= len(self._sequences[text_field_name][index])
+                    assert types.min() >= 0
+                    assert types.max() < self._args['vocab_size']
+                    assert counts.min() > 0
+                    assert counts.max() <= len(sequence)
 
                     feature[text_field_name + '_types'] = tf.train.Feature(
                         int64_list=tf.train.Int64List(value=types))
@@ -834,14 +1348,38 @@ class Dataset:
                         text_field_name + '_types_length'] = tf.train.Feature(
                         int64_list=tf.train.Int64List(value=[len(types)]))
 
-                    if self._args['write_bow']:
+                    if self._args['write_bow'] and \
+                        self._args['bow_format'] == 'sparse':
+                        # only the word ids present and their values
+                        bow_indices, bow_values = sparse_bag_of_words(
+                            sequence)
+                        feature[
+                            text_field_name + '_bow_indices'] = \
+                            tf.train.Feature(int64_list=tf.train.Int64List(
+                                value=bow_indices))
+                        feature[
+                            text_field_name + '_bow_values'] = \
+                            tf.train.Feature(float_list=tf.train.FloatList(
+                                value=bow_values))
+                    elif self._args['write_bow']:
                         # This assumes a single vocabulary shared among all sequence kinds
                         bow = bag_of_words(
-                            self._sequences[text_field_name][index],
-                            self._args['vocab_size']).tolist()
+                            sequence, self._args['vocab_size']).tolist()
                         feature[text_field_name + '_bow'] = tf.train.Feature(
                             float_list=tf.train.FloatList(value=bow))
 
+                    if self._args['write_tfidf']:
+                        tfidf_indices, tfidf_values = sparse_tfidf(
+                            sequence, self._idf)
+                        feature[
+                            text_field_name + '_tfidf_indices'] = \
+                            tf.train.Feature(int64_list=tf.train.Int64List(
+                                value=tfidf_indices))
+                        feature[
+                            text_field_name + '_tfidf_values'] = \
+                            tf.train.Feature(float_list=tf.train.FloatList(
+                                value=tfidf_values))
+
                     # if self._args['write_unique']:
                     #   feature[text_field_name + '_unique'] = tf.train.Feature(
                     #     int64_list=tf.train.Int64List(
@@ -871,14 +1409,6 @@ class Dataset:
                     # assert label is None
                     pass
 
-                if self._args['write_tfidf']:
-                    raise NotImplementedError("tfidf not supported")
-                    # feature['tfidf'] = tf.train.Feature(
-                    #   float_list=tf.train.FloatList(
-                    #     value=self._tfidf_list[index]
-                    #   )
-                    # )
-
                 example = tf.train.Example(
                     features=tf.train.Features(
                         feature=feature))
@@ -975,6 +1505,7 @@ class Dataset:
     def write_args(self):
         # save dataset arguments
 
+        self._args['num_examples'] = self._num_examples
         self._args['has_ids'] = self._ids is not None
         self._args['has_weights'] = self._weights is not None
         self._args['max_vocab_size_allowed'] = self._args.pop('max_vocab_size')
@@ -990,6 +1521,41 @@ class Dataset:
             json.dump(self._args, file, ensure_ascii=False, indent=4)
         assert os.path.exists(args_path), 'Failed to save args.json!'
 
+    def append_split(self, train_ratio, valid_ratio):
+        """Deterministically assign the appended examples to splits
+
+        Each labeled example goes to train/valid/test according to the crc32
+        of its tokens, so the same example always lands in the same split
+        whatever else is appended along with it. Examples without labels are
+        unlabeled.
+        """
+        train_ind, valid_ind, test_ind, unlabeled_ind = [], [], [], []
+        for index in range(self._num_examples):
+            if self._label_list[index] is None:
+                unlabeled_ind.append(index)
+                continue
+            key = '\n'.join(
+                ' '.join(self._sequences[text_field_name][index])
+                for text_field_name in self._args['text_field_names'])
+            bucket = zlib.crc32(key.encode('utf-8')) / 2 ** 32
+            if bucket < train_ratio:
+                train_ind.append(index)
+            elif bucket < train_ratio + valid_ratio:
+                valid_ind.append(index)
+            else:
+                test_ind.append(index)
+
+        print("Appended examples: train : valid : test : unlabeled = "
+              "%d : %d : %d : %d" % (len(train_ind), len(valid_ind),
+                                     len(test_ind), len(unlabeled_ind)))
+
+        self._args['train_size'] = len(train_ind)
+        self._args['valid_size'] = len(valid_ind)
+        self._args['test_size'] = len(test_ind)
+        self._args['unlabeled_size'] = len(unlabeled_ind)
+
+        return train_ind, valid_ind, test_ind, unlabeled_ind
+
     @staticmethod
     def subsample(index, random_seed, subsample_ratio=0.1):
         np.random.seed(random_seed)
@@ -1027,6 +1593,10 @@ class Dataset:
     def max_document_length(self):
         return self._args['max_document_length']
 
+    @property
+    def vocab_freq(self):
+        return self._vocab_freq_dict
+
     @property
     def mapping(self):
         return self._categorical_vocab.mapping
@@ -1036,28 +1606,386 @@ class Dataset:
         return self._categorical_vocab.reverse_mapping
 
 
-def merge_save_vocab_dicts(vocab_paths, save_path):
+def get_tokenizer_fn(tokenizer_):
+    if tokenizer_ == "tweet_tokenizer":
+        return tweet_tokenizer.tokenize
+    elif tokenizer_ == "tweet_tokenizer_keep_handles":
+        return tweet_tokenizer_keep_handles.tokenize
+    elif tokenizer_ == "fast_tweet_tokenizer":
+        return fast_tweet_tokenizer.tokenize
+    elif tokenizer_ == "fast_tweet_tokenizer_keep_handles":
+        return fast_tweet_tokenizer_keep_handles.tokenize
+    elif tokenizer_ == "ruder_tokenizer":
+        return functools.partial(ruder_tokenizer, preserve_case=False)
+    elif tokenizer_ == "split_tokenizer":
+        return functools.partial(split_tokenizer)
+    elif tokenizer_ == "lower_tokenizer":
+        return functools.partial(lower_tokenizer)
+    else:
+        raise ValueError("unrecognized tokenizer: %s" % tokenizer_)
+
+
+def get_stemmer_fn(stemmer):
+    if stemmer == 'porter_stemmer':
+        return porter_stemmer
+    elif stemmer == 'snowball_stemmer':
+        return snowball_stemmer
+    elif stemmer == 'wordnet_stemmer':
+        return wordnet_stemmer
+    elif not stemmer:
+        return None
+    else:
+        raise ValueError("unrecognized stemmer: %s" % stemmer)
+
+
+def tokenize_example(texts, weight, tokenizer, stemmer, preproc_, stopwords):
+    """Preprocess and tokenize the text fields of one example
+
+    :param texts: list of the raw text of each text field
+    :param weight: string of the token weights joined with spaces, or None
+    :param tokenizer: tokenizer function
+    :param stemmer: stemmer function or None
+    :param preproc_: whether to remove urls/tags and replace linebreaks
+    :param stopwords: whether to remove stop words
+    :return: list of (tokens, weights) for each text field, weights being
+        None if not given
     """
-    :param vocab_paths: list of vocabulary paths
-    :param save_path: path to save the merged vocab
-    :return:
+    return tokenize_examples([(texts, weight)], tokenizer, stemmer, preproc_,
+                             stopwords)[0]
+
+
+def tokenize_examples(examples, tokenizer, stemmer, preproc_, stopwords):
+    """Preprocess and tokenize the text fields of a list of examples
+
+    :param examples: list of (texts, weight) as taken by tokenize_example()
+    :param tokenizer: tokenizer function, called on each text
+    :param stemmer: stemmer function or None
+    :param preproc_: whether to remove urls/tags and replace linebreaks
+    :param stopwords: whether to remove stop words
+    :return: list of the tokenize_example() output of each example
     """
-    merged_vocab_dict = dict()
-    for path in vocab_paths:
-        with codecs.open(path, mode='r', encoding='utf-8') as file:
-            vocab_dict = json.load(file)
-            merged_vocab_dict = combine_dicts(merged_vocab_dict, vocab_dict)
+    texts = [text for example_texts, _ in examples for text in example_texts]
+    if preproc_:
+        texts = [preproc_text(text) for text in texts]
+    token_lists = iter([tokenizer(text) for text in texts])
+    return [[postproc_tokens(next(token_lists), weight, stemmer, stopwords)
+             for _ in example_texts]
+            for example_texts, weight in examples]
+
+
+def preproc_text(text):
+    """Remove urls/tags and replace linebreaks"""
+    # remove leading and trailing whitespaces(to get rid of redundant
+    # linebreaks)
+    text = text.strip()
+    text = preproc(text)
+
+    # replace line breaks
+    for old_linebreak in OLD_LINEBREAKS:
+        text = text.replace(old_linebreak, LINEBREAK)
+    return text
+
+
+def postproc_tokens(text, weight, stemmer, stopwords):
+    """Stem the tokens of a text, add BOS/EOS and remove stop words
+
+    :return: (tokens, weights), weights being None if weight is None
+    """
+    if stemmer:
+        text = stemmer(text)
+
+    text = [BOS] + text + [EOS]
+
+    weights = None
+    if weight is not None:
+        weights = [float(w) for w in weight.split()]
+        # TODO un-hardcode
+        # add 1.0 for BOS and EOS
+        weights = [1.0] + weights + [1.0]
+
+    if stopwords:
+        if weights is not None:
+            text, weights = remove_stopwords(text, stopwords='nltk',
+                                             weights=weights)
+        else:
+            text = remove_stopwords(text, stopwords='nltk')
+
+    return text, weights
+
+
+# dataset shared with the forked processes writing its TFRecord files
+_dataset_to_write = None
+
+
+def length_quantiles(lengths):
+    """The 0th, 1st, ..., 100th percentiles of the lengths(the next higher
+    length when between two of them)
+
+    :param lengths: non-empty 1-D array of sequence lengths
+    :return: list of 101 ints
+    """
+    lengths = np.sort(np.asarray(lengths, dtype=np.int64))
+    ranks = np.ceil(np.arange(101) * (len(lengths) - 1) / 100.).astype(
+        np.int64)
+    return lengths[ranks].tolist()
+
+
+def merge_length_quantiles(quantiles, size, lengths):
+    """Approximate percentiles of the lengths of size examples summarized
+    by their quantiles and of new examples
+
+    Each of the 1st to 100th percentiles stands for size / 100 examples.
+
+    :param quantiles: length_quantiles() of the size examples
+    :param size: number of examples the quantiles are of
+    :param lengths: 1-D array of the lengths of the new examples
+    :return: list of 101 ints
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    values = np.concatenate([np.asarray(quantiles[1:], dtype=np.int64),
+                             lengths])
+    weights = np.concatenate([np.full(100, size / 100.),
+                              np.ones(len(lengths))])
+    order = np.argsort(values, kind='mergesort')
+    values = values[order]
+    cumulative = np.cumsum(weights[order])
+    ranks = np.searchsorted(
+        cumulative, np.arange(1, 101) / 100. * cumulative[-1] - 1e-9)
+    merged = [min(int(quantiles[0]), int(lengths.min()))] + \
+        values[np.minimum(ranks, len(values) - 1)].tolist()
+    return merged
+
+
+def _write_examples(file_name, split_index, labeled):
+    _dataset_to_write.write_examples(file_name, split_index, labeled)
+
+
+# preprocessing configuration of the tokenizing worker processes
+_tokenize_worker_args = None
+
+
+def _init_tokenize_worker(tokenizer_, stemmer, preproc_, stopwords):
+    global _tokenize_worker_args
+    _tokenize_worker_args = (get_tokenizer_fn(tokenizer_),
+                             get_stemmer_fn(stemmer),
+                             preproc_,
+                             stopwords)
+
+
+def iter_chunks(iterable, chunk_size):
+    """Lazily split an iterable into lists of chunk_size items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _tokenize_chunk(chunk):
+    """Tokenize a chunk of examples in a worker process
+
+    :return: (tokenized examples, (hits, misses) of the worker's stem caches
+        while tokenizing the chunk)
+    """
+    hits, misses = stem_cache_stats()
+    tokenized = tokenize_examples(chunk, *_tokenize_worker_args)
+    end_hits, end_misses = stem_cache_stats()
+    return tokenized, (end_hits - hits, end_misses - misses)
+
+
+def report_stem_cache(hits, misses):
+    if hits + misses:
+        print("Stem cache hit rate: %.2f%% (%d hits, %d misses)" % (
+            100.0 * hits / (hits + misses), hits, misses))
+
+
+def _build_dataset(kwargs):
+    return Dataset(**kwargs)
+
+
+def build_datasets(dataset_kwargs, num_dataset_workers=1):
+    """Build one Dataset per set of arguments, in parallel if required
+
+    :param dataset_kwargs: list of keyword arguments of each Dataset
+    :param num_dataset_workers: number of processes building the datasets,
+        the datasets are pickled back to the current process and each of them
+        is tokenized in a single process
+    :return: list of the built datasets, in the same order
+    """
+    if num_dataset_workers <= 1 or len(dataset_kwargs) <= 1:
+        return [Dataset(**kwargs) for kwargs in dataset_kwargs]
+
+    # worker processes can't start their own tokenizing processes
+    dataset_kwargs = [dict(kwargs, num_workers=1) for kwargs in dataset_kwargs]
+
+    print('Building %d datasets with %d processes...' % (
+        len(dataset_kwargs), num_dataset_workers))
+    pool = multiprocessing.Pool(min(num_dataset_workers, len(dataset_kwargs)))
+    try:
+        return pool.map(_build_dataset, dataset_kwargs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+# datasets shared with the forked processes writing their TFRecord files
+_datasets_to_write = None
+
+
+def _write_dataset_tfrecord(index, tfrecord_dir, vocab_dir, vocab_name,
+                            idf_given):
+    dataset = _datasets_to_write[index]
+    dataset.write_tfrecord_with_vocab(tfrecord_dir,
+                                      vocab_dir=vocab_dir,
+                                      vocab_name=vocab_name,
+                                      idf_given=idf_given)
+    return dataset.args
+
+
+def write_datasets_tfrecord(datasets, tfrecord_dirs, vocab_dir, vocab_name,
+                            num_dataset_workers=1, idf_given=False):
+    """Write the TFRecord files of each dataset with the same vocabulary
+
+    :param datasets: list of tokenized datasets
+    :param tfrecord_dirs: list of directories to save the TFRecord files
+    :param vocab_dir: directory to load the given vocabulary
+    :param vocab_name: 'vocab_freq.json' or 'vocab_v2i.json'
+    :param num_dataset_workers: number of processes writing the datasets,
+        the datasets are shared with the forked processes instead of being
+        pickled
+    :param idf_given: whether to write the tf-idf features with the idf
+        saved in vocab_dir(see save_merged_idf())
+    :return: args_dicts: list of args(dict) of each dataset
+    """
+    if num_dataset_workers <= 1 or len(datasets) <= 1:
+        args_dicts = []
+        for dataset, tfrecord_dir in zip(datasets, tfrecord_dirs):
+            dataset.write_tfrecord_with_vocab(tfrecord_dir,
+                                              vocab_dir=vocab_dir,
+                                              vocab_name=vocab_name,
+                                              idf_given=idf_given)
+            args_dicts.append(dataset.args)
+        return args_dicts
+
+    global _datasets_to_write
+    _datasets_to_write = datasets
+    print('Writing %d datasets with %d processes...' % (
+        len(datasets), num_dataset_workers))
+    pool = multiprocessing.get_context('fork').Pool(
+        min(num_dataset_workers, len(datasets)))
+    try:
+        return pool.starmap(_write_dataset_tfrecord,
+                            [(i, tfrecord_dir, vocab_dir, vocab_name,
+                              idf_given)
+                             for i, tfrecord_dir in enumerate(tfrecord_dirs)],
+                            chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        _datasets_to_write = None
+
+
+def save_merged_idf(datasets, vocab_v2i_dict, merged_dir):
+    """Compute the idf of the training data of all the merged datasets and
+    save it to merged_dir/idf.npy, along with the merged vocabulary
+
+    The TFRecord files of every dataset are then written with this idf
+    (see write_datasets_tfrecord()), which predict mode loads from the
+    vocabulary directory.
+
+    :param datasets: list of tokenized datasets
+    :param vocab_v2i_dict: merged word id mapping
+    :param merged_dir: directory of the merged vocabulary
+    """
+    df = np.zeros(len(vocab_v2i_dict), dtype=np.int64)
+    num_docs = 0
+    for dataset in datasets:
+        dataset_df, dataset_num_docs = dataset.training_document_frequencies(
+            vocab_v2i_dict)
+        df += dataset_df
+        num_docs += dataset_num_docs
+    np.save(os.path.join(merged_dir, 'idf.npy'),
+            inverse_document_frequencies(df, num_docs))
+
+
+def merge_vocab_freq_dicts(vocab_freq_dicts):
+    """
+    :param vocab_freq_dicts: iterable of word frequency dictionaries
+    :return: merged word frequency dictionary sorted according to frequency
+    """
+    merged_vocab_counter = Counter()
+    for vocab_dict in vocab_freq_dicts:
+        merged_vocab_counter.update(vocab_dict)
 
     # sort merged vocabulary according to frequency
-    merged_vocab_list = sorted(merged_vocab_dict.items(),
+    merged_vocab_list = sorted(merged_vocab_counter.items(),
                                key=operator.itemgetter(1),
                                reverse=True)
     merged_vocab_dict = dict()
     for i in merged_vocab_list:
         merged_vocab_dict[i[0]] = i[1]
+    return merged_vocab_dict
 
+
+def save_vocab_freq_dict(vocab_freq_dict, save_path):
+    """Save a word frequency dictionary as compact json(no indentation),
+    along with its binary version(vocab_freq.bin) in the same directory"""
     with codecs.open(save_path, mode='w', encoding='utf-8') as file:
-        json.dump(merged_vocab_dict, file, ensure_ascii=False, indent=4)
+        json.dump(vocab_freq_dict, file, ensure_ascii=False,
+                  separators=(',', ':'))
+    save_binary_vocab(
+        os.path.join(os.path.dirname(save_path), BINARY_VOCAB_FREQ_NAME),
+        list(vocab_freq_dict), list(vocab_freq_dict.values()))
+
+
+def save_binary_mapping(save_dir, mapping, freq=None):
+    """Save a word id mapping as a binary vocabulary(vocab.bin)
+
+    Skipped if the ids aren't 0..len(mapping) - 1, the json files being
+    used instead.
+
+    :param save_dir: directory of the json vocabulary files
+    :param mapping: word to id dictionary
+    :param freq: optional word frequency dictionary
+    """
+    words = [None] * len(mapping)
+    for word, word_id in mapping.items():
+        if not isinstance(word, str) or not 0 <= word_id < len(words) or \
+                words[word_id] is not None:
+            return
+        words[word_id] = word
+    counts = None
+    if freq:
+        counts = [freq.get(word, 0) for word in words]
+    save_binary_vocab(os.path.join(save_dir, BINARY_VOCAB_NAME), words,
+                      counts)
+
+
+def merge_save_vocab_dicts(vocab_paths, save_path, max_words_in_memory=None):
+    """
+    :param vocab_paths: list of vocabulary paths
+    :param save_path: path to save the merged vocab
+    :param max_words_in_memory: if given, merge the vocabularies with an
+        external sort-merge holding at most one vocabulary or this number of
+        merged words in memory(see vocab_merge.py), instead of counting the
+        union of the vocabularies in memory
+    :return:
+    """
+    if max_words_in_memory:
+        external_merge_vocab_freq(
+            vocab_paths, save_path, max_words_in_memory=max_words_in_memory,
+            binary_dir=os.path.join(os.path.dirname(save_path),
+                                    BINARY_VOCAB_FREQ_NAME))
+        return
+
+    def load_vocab_dicts():
+        for path in vocab_paths:
+            with codecs.open(path, mode='r', encoding='utf-8') as file:
+                yield json.load(file)
+
+    save_vocab_freq_dict(merge_vocab_freq_dicts(load_vocab_dicts()),
+                         save_path)
 
 
 def combine_dicts(x, y):
@@ -1065,6 +1993,58 @@ def combine_dicts(x, y):
             set(itertools.chain(x, y))}
 
 
+def append_write_tfrecord(append_json_path,
+                          tfrecord_dir,
+                          streaming=False,
+                          num_workers=1,
+                          token_cache=False):
+    """Append new examples to a dataset whose TFRecord files are written
+
+    The examples are preprocessed with the arguments saved in
+    tfrecord_dir/args.json and mapped with the saved vocab_v2i.json, only
+    the new shards are written and args.json is updated in place.
+
+    :param append_json_path: gzipped json(l) file of the new examples
+    :param tfrecord_dir: directory of the TFRecord files and args.json
+    :return: Dataset of the appended examples
+    """
+    with codecs.open(os.path.join(tfrecord_dir, 'args.json'), mode='r',
+                     encoding='utf-8') as file:
+        args = json.load(file)
+
+    return Dataset(json_dir=None,
+                   tfrecord_dir=tfrecord_dir,
+                   vocab_dir=tfrecord_dir,
+                   vocab_name='vocab_v2i.json',
+                   generate_basic_vocab=False,
+                   vocab_given=True,
+                   generate_tf_record=True,
+                   append_mode=True,
+                   append_json_path=append_json_path,
+                   max_document_length=args['max_document_length'],
+                   max_vocab_size=args['max_vocab_size_allowed'],
+                   min_frequency=args['min_frequency'],
+                   max_frequency=args['max_frequency'],
+                   text_field_names=args['text_field_names'],
+                   label_field_name=args['label_field_name'],
+                   label_type=args['label_type'],
+                   tokenizer_=args['tokenizer_'],
+                   stemmer=args['stemmer'],
+                   stopwords=args['stopwords'],
+                   preproc=args['preproc'],
+                   vocab_all=args['vocab_all'],
+                   padding=args['padding'],
+                   write_bow=args['write_bow'],
+                   bow_format=args.get('bow_format', 'dense'),
+                   write_tfidf=args['write_tfidf'],
+                   train_ratio=args['train_ratio'],
+                   valid_ratio=args['valid_ratio'],
+                   num_shards=args.get('num_shards', 1),
+                   streaming=streaming,
+                   num_workers=num_workers,
+                   token_cache=token_cache)
+
+
 def merge_dict_write_tfrecord(json_dirs,
                               tfrecord_dirs,
                               merged_dir,
@@ -1085,10 +2065,21 @@ def merge_dict_write_tfrecord(json_dirs,
                               write_bow=False,
                               write_tfidf=False,
                               preproc=True,
-                              vocab_all=False):
+                              vocab_all=False,
+                              streaming=False,
+                              num_workers=1,
+                              token_cache=False,
+                              num_shards=1,
+                              bow_format='dense',
+                              full_vocab=False,
+                              approx_vocab=False,
+                              approx_vocab_width=1 << 22,
+                              approx_vocab_depth=4,
+                              num_dataset_workers=1):
     """Merge all the dictionaries for each dataset and write TFRecord files
 
-    1. generate word frequency dictionary for each dataset
+    1. load and tokenize each dataset once, generating its word frequency
+    dictionary
     2. add them up to a new word frequency dictionary
     3. generate the word id mapping using arguments
     4. use the same word id mapping to generate TFRecord files for each dataset
@@ -1099,43 +2090,62 @@ def merge_dict_write_tfrecord(json_dirs,
     :return: args_dicts: list of args(dict) of each dataset
     """
 
-    # generate vocab for every dataset without writing their own TFRecord files
-    # the generated vocab freq dicts shall be saved at
-    # json_dir/vocab_freq_dict.json
+    # load and tokenize every dataset once, generating their vocab without
+    # writing their own TFRecord files
+    # the generated vocab freq dicts are kept in memory(each one is saved
+    # at merged_dir/vocab_freq.json in turn)
+    # the tokenized datasets are kept to write the TFRecord files with the
+    # merged vocabulary
 
     # Assumes that all datasets have
     # the same text_field_names and label_field_name
     # max_document_lengths = []
+    dataset_kwargs = []
     for json_dir, tfrecord_dir in zip(json_dirs, tfrecord_dirs):
-        dataset = Dataset(json_dir,
-                          tfrecord_dir=tfrecord_dir,
-                          vocab_dir=merged_dir,
-                          max_document_length=max_document_length,
-                          max_vocab_size=max_vocab_size,
-                          min_frequency=min_frequency,
-                          max_frequency=-max_frequency,
-                          text_field_names=text_field_names,
-                          label_field_name=label_field_name,
-                          label_type=label_type,
-                          tokenizer_=tokenizer_,
-                          stemmer=stemmer,
-                          stopwords=stopwords,
-                          generate_basic_vocab=True,
-                          vocab_given=False,
-                          generate_tf_record=False,
-                          preproc=preproc,
-                          vocab_all=vocab_all)
-        # max_document_lengths.append(dataset.max_document_length)
+        dataset_kwargs.append(dict(json_dir=json_dir,
+                                   tfrecord_dir=tfrecord_dir,
+                                   vocab_dir=merged_dir,
+                                   max_document_length=max_document_length,
+                                   max_vocab_size=max_vocab_size,
+                                   min_frequency=min_frequency,
+                                   max_frequency=max_frequency,
+                                   text_field_names=text_field_names,
+                                   label_field_name=label_field_name,
+                                   label_type=label_type,
+                                   train_ratio=train_ratio,
+                                   valid_ratio=valid_ratio,
+                                   subsample_ratio=subsample_ratio,
+                                   padding=padding,
+                                   write_bow=write_bow,
+                                   write_tfidf=write_tfidf,
+                                   tokenizer_=tokenizer_,
+                                   stemmer=stemmer,
+                                   stopwords=stopwords,
+                                   generate_basic_vocab=True,
+                                   vocab_given=False,
+                                   generate_tf_record=False,
+                                   preproc=preproc,
+                                   vocab_all=vocab_all,
+                                   streaming=streaming,
+                                   num_workers=num_workers,
+                                   token_cache=token_cache,
+                                   num_shards=num_shards,
+                                   bow_format=bow_format,
+                                   full_vocab=full_vocab,
+                                   approx_vocab=approx_vocab,
+                                   approx_vocab_width=approx_vocab_width,
+                                   approx_vocab_depth=approx_vocab_depth))
+    datasets = build_datasets(dataset_kwargs, num_dataset_workers)
+    # max_document_lengths.append(dataset.max_document_length)
     # if max_document_length == -1:
     #   max_document_length = max(max_document_lengths)
 
-    # merge all the vocabularies
-    vocab_paths = []
-    for json_dir in json_dirs:
-        vocab_path = os.path.join(json_dir, "vocab_freq.json")
-        vocab_paths.append(vocab_path)
-    merge_save_vocab_dicts(vocab_paths, os.path.join(merged_dir,
-                                                     "vocab_freq.json"))
+    # merge all the vocabularies, the datasets and their word frequency
+    # dictionaries being in memory already
+    merged_vocab_freq_dict = merge_vocab_freq_dicts(
+        dataset.vocab_freq for dataset in datasets)
+    save_vocab_freq_dict(merged_vocab_freq_dict,
+                         os.path.join(merged_dir, "vocab_freq.json"))
 
     print("merged public word frequency dictionary saved to path",
           os.path.join(merged_dir, "vocab_freq.json"))
@@ -1163,7 +2173,8 @@ def merge_dict_write_tfrecord(json_dirs,
                       # write_bow=write_bow,
                       # write_tfidf=write_tfidf,
                       preproc=preproc,
-                      vocab_all=vocab_all
+                      vocab_all=vocab_all,
+                      full_vocab=full_vocab
                       )
     with codecs.open(os.path.join(merged_dir, 'vocab_v2i.json'),
                      mode='w', encoding='utf-8') as file:
@@ -1175,42 +2186,21 @@ def merge_dict_write_tfrecord(json_dirs,
     with codecs.open(os.path.join(merged_dir, 'vocab_i2v.json'),
                      mode='w', encoding='utf-8') as file:
         json.dump(vocab_i2v_dict, file, ensure_ascii=False, indent=4)
+    save_binary_mapping(merged_dir, dataset.mapping, merged_vocab_freq_dict)
+    if write_tfidf:
+        save_merged_idf(datasets, dataset.mapping, merged_dir)
 
     # with open(os.path.join(merged_dir, "vocab_size.txt"), "w") as file:
     #   file.write(str(dataset.vocab_size))
 
     # write TFRecords for each dataset with the same word id mapping
-    args_dicts = []
-    for json_dir in json_dirs:
-        tfrecord_dir = os.path.join(merged_dir, os.path.basename(
-            os.path.normpath(json_dir)))
-        dataset = Dataset(json_dir,
-                          tfrecord_dir=tfrecord_dir,
-                          vocab_dir=merged_dir,
-                          generate_basic_vocab=False,
-                          vocab_given=True,
-                          vocab_name='vocab_v2i.json',
-                          generate_tf_record=True,
-                          text_field_names=text_field_names,
-                          label_field_name=label_field_name,
-                          label_type=label_type,
-                          max_document_length=max_document_length,
-                          max_vocab_size=max_vocab_size,
-                          min_frequency=min_frequency,
-                          max_frequency=max_frequency,
-                          train_ratio=train_ratio,
-                          valid_ratio=valid_ratio,
-                          subsample_ratio=subsample_ratio,
-                          padding=padding,
-                          write_bow=write_bow,
-                          write_tfidf=write_tfidf,
-                          tokenizer_=tokenizer_,
-                          stemmer=stemmer,
-                          stopwords='nltk',
-                          preproc=preproc,
-                          vocab_all=vocab_all
-                          )
-        args_dicts.append(dataset.args)
+    tfrecord_dirs = [os.path.join(merged_dir,
+                                  os.path.basename(os.path.normpath(json_dir)))
+                     for json_dir in json_dirs]
+    args_dicts = write_datasets_tfrecord(
+        datasets, tfrecord_dirs, vocab_dir=merged_dir,
+        vocab_name='vocab_v2i.json', num_dataset_workers=num_dataset_workers,
+        idf_given=write_tfidf)
 
     return args_dicts
 
@@ -1240,7 +2230,13 @@ def merge_pretrain_write_tfrecord(json_dirs,
                                   expand_vocab=False,
                                   pretrained_only=True,
                                   preproc=True,
-                                  vocab_all=True):
+                                  vocab_all=True,
+                                  streaming=False,
+                                  num_workers=1,
+                                  token_cache=False,
+                                  num_shards=1,
+                                  bow_format='dense',
+                                  num_dataset_workers=1):
     """Use the dictionary of the pre-trained word embedding, combine the words
 
     from the training data of all the datasets if necessary
@@ -1257,9 +2253,12 @@ def merge_pretrain_write_tfrecord(json_dirs,
     :return: args_dicts: list of args(dict) of each dataset
     """
 
-    # generate vocab for every dataset without writing their own TFRecord files
+    # load and tokenize every dataset once, generating their vocab without
+    # writing their own TFRecord files
     # the generated vocab freq dicts shall be saved at
-    # json_dir/vocab_freq_dict.json
+    # json_dir/vocab_freq.json
+    # the tokenized datasets are kept to write the TFRecord files with the
+    # combined vocabulary
 
     pretrained_path = os.path.join(vocab_dir, vocab_name)
 
@@ -1272,26 +2271,40 @@ def merge_pretrain_write_tfrecord(json_dirs,
         train_vocab_set = set()  # use list to keep order
     if padding:
         max_document_lengths = []
+    dataset_kwargs = []
     for json_dir, tfrecord_dir in zip(json_dirs, tfrecord_dirs):
-        dataset = Dataset(json_dir,
-                          tfrecord_dir=tfrecord_dir,
-                          vocab_dir=merged_dir,
-                          max_document_length=max_document_length,
-                          max_vocab_size=max_vocab_size,
-                          min_frequency=min_frequency,
-                          max_frequency=max_frequency,
-                          text_field_names=text_field_names,
-                          label_field_name=label_field_name,
-                          label_type=label_type,
-                          tokenizer_=tokenizer_,
-                          stemmer=stemmer,
-                          stopwords=stopwords,
-                          generate_basic_vocab=True,
-                          vocab_given=False,
-                          generate_tf_record=False,
-                          preproc=preproc,
-                          vocab_all=vocab_all,
-                          pretrained_only=pretrained_only)
+        dataset_kwargs.append(dict(json_dir=json_dir,
+                                   tfrecord_dir=tfrecord_dir,
+                                   vocab_dir=merged_dir,
+                                   max_document_length=max_document_length,
+                                   max_vocab_size=max_vocab_size,
+                                   min_frequency=min_frequency,
+                                   max_frequency=max_frequency,
+                                   text_field_names=text_field_names,
+                                   label_field_name=label_field_name,
+                                   label_type=label_type,
+                                   train_ratio=train_ratio,
+                                   valid_ratio=valid_ratio,
+                                   subsample_ratio=subsample_ratio,
+                                   padding=padding,
+                                   write_bow=write_bow,
+                                   write_tfidf=write_tfidf,
+                                   tokenizer_=tokenizer_,
+                                   stemmer=stemmer,
+                                   stopwords=stopwords,
+                                   generate_basic_vocab=True,
+                                   vocab_given=False,
+                                   generate_tf_record=False,
+                                   preproc=preproc,
+                                   vocab_all=vocab_all,
+                                   streaming=streaming,
+                                   num_workers=num_workers,
+                                   token_cache=token_cache,
+                                   num_shards=num_shards,
+                                   bow_format=bow_format,
+                                   pretrained_only=pretrained_only))
+    datasets = build_datasets(dataset_kwargs, num_dataset_workers)
+    for dataset in datasets:
         train_vocab_set = train_vocab_set.union(set(dataset.mapping))
         if padding:
             max_document_lengths.append(max_document_length)
@@ -1338,49 +2351,36 @@ def merge_pretrain_write_tfrecord(json_dirs,
     with codecs.open(os.path.join(merged_dir, 'vocab_i2v.json'),
                      mode='w', encoding='utf-8') as file:
         json.dump(vocab_i2v_dict, file, ensure_ascii=False, indent=4)
+    save_binary_mapping(merged_dir, vocab_v2i_all)
+    if write_tfidf:
+        save_merged_idf(datasets, vocab_v2i_all, merged_dir)
 
     # with open(os.path.join(merged_dir, 'vocab_size.txt'), 'w') as file:
     #   file.write(str(len(vocab_v2i_all)))
 
     # write TFRecords for each dataset with the same word id mapping
-    args_dicts = []
-    for json_dir in json_dirs:
-        tfrecord_dir = os.path.join(merged_dir, os.path.basename(
-            os.path.normpath(json_dir)))
-        dataset = Dataset(json_dir,
-                          tfrecord_dir=tfrecord_dir,
-                          generate_basic_vocab=False,
-                          vocab_given=True,
-                          vocab_dir=merged_dir,
-                          vocab_name='vocab_v2i.json',
-                          generate_tf_record=True,
-                          text_field_names=text_field_names,
-                          label_field_name=label_field_name,
-                          label_type=label_type,
-                          max_document_length=max_document_length,
-                          max_vocab_size=max_vocab_size,
-                          min_frequency=min_frequency,
-                          max_frequency=max_frequency,
-                          train_ratio=train_ratio,
-                          valid_ratio=valid_ratio,
-                          subsample_ratio=subsample_ratio,
-                          padding=padding,
-                          write_bow=write_bow,
-                          write_tfidf=write_tfidf,
-                          tokenizer_=tokenizer_,
-                          stemmer=stemmer,
-                          stopwords='nltk',
-                          preproc=preproc,
-                          vocab_all=vocab_all,
-                          pretrained_only=pretrained_only)
-        args_dicts.append(dataset.args)
+    tfrecord_dirs = [os.path.join(merged_dir,
+                                  os.path.basename(os.path.normpath(json_dir)))
+                     for json_dir in json_dirs]
+    args_dicts = write_datasets_tfrecord(
+        datasets, tfrecord_dirs, vocab_dir=merged_dir,
+        vocab_name='vocab_v2i.json', num_dataset_workers=num_dataset_workers,
+        idf_given=write_tfidf)
 
     return args_dicts
 
 
 def get_types_and_counts(token_list):
-    counts = {x: token_list.count(x) for x in token_list}
-    return counts.keys(), counts.values()
+    """Word types of a sequence of word ids, in order of first appearance,
+    and their counts
+
+    :param token_list: 1-D array or list of word ids
+    :return: (types, counts) arrays
+    """
+    types, first_index, counts = np.unique(token_list, return_index=True,
+                                           return_counts=True)
+    order = np.argsort(first_index)
+    return types[order], counts[order]
 
 
 def main():
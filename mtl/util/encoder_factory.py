@@ -24,7 +24,8 @@ import os
 
 import tensorflow as tf
 
-from mtl.embedders.pretrained import init_pretrained
+from mtl.embedders.pretrained import expand_pretrained, init_pretrained
+from mtl.util.categorical_vocabulary import load_vocab_cutoff
 from mtl.util.embedder_factory import create_embedders
 from mtl.util.extractor_factory import create_extractors
 from mtl.util.hparams import dict2func
@@ -125,11 +126,20 @@ def get_extra_embed_kwargs(args, embed_fns, embed_kwargs):
     # Put 'vocab_size' into embedder_kwargs for all datasets
     with open(os.path.join(args.dataset_paths[0], 'args.json')) as file:
         vocab_size = int(json.load(file)['vocab_size'])
+    # smaller embedding table if the vocabulary is cut off when reading
+    vocab_cutoff = load_vocab_cutoff(
+        args.dataset_paths[0],
+        getattr(args, 'vocab_min_frequency', None),
+        getattr(args, 'vocab_max_size', None))
+    if vocab_cutoff is not None:
+        vocab_size = vocab_cutoff
 
     for ds in embed_kwargs:
         embed_kwargs[ds]['vocab_size'] = vocab_size
 
     # for embedder init_pretrained read reverse_vocab_path and random_size_path
+    # expand_pretrained also takes random_size if it's given, not to load the
+    # pretrained embeddings only to get their size
     for ds, dataset_path in zip(args.datasets, args.dataset_paths):
         if embed_fns[ds] == init_pretrained:
             with open(os.path.join(dataset_path, 'args.json')) as file:
@@ -137,5 +147,10 @@ def get_extra_embed_kwargs(args, embed_fns, embed_kwargs):
                 embed_kwargs[ds]['random_size'] = int(tmp['random_size'])
                 embed_kwargs[ds]['reverse_vocab_path'] = tmp[
                     'reverse_vocab_path']
+        elif embed_fns[ds] == expand_pretrained:
+            with open(os.path.join(dataset_path, 'args.json')) as file:
+                tmp = json.load(file)
+                if tmp.get('random_size') is not None:
+                    embed_kwargs[ds]['random_size'] = int(tmp['random_size'])
 
     return embed_kwargs
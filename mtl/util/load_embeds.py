@@ -21,14 +21,19 @@ that of the training dataset(s)"""
 
 from __future__ import unicode_literals
 
-import array
 import io
+import os
+import shutil
+import tempfile
 from zipfile import ZipFile
 
 import numpy as np
 from gensim.models import KeyedVectors
 from tqdm import tqdm
 
+from mtl.util.binary_vocab import BinaryVocab, save_binary_vocab
+from mtl.util.constants import PRETRAINED_CACHE_SUFFIX
+
 
 def combine_vocab(pretrained_path, train_vocab_list):
     """Expand the training vocab with the pretrained embedding vocabulary.
@@ -110,77 +115,211 @@ def load_pretrained_matrix(filepath):
     """Load the pretrained word embedding matrix.
 
     :param filepath: full file path of the pretrained embedding file
-    :return: np array, pretrained word vectors.
+    :return: np array, pretrained word vectors(float32, memory-mapped from
+        the cache of the file).
     """
     print('Loading embedding matrix from {}...'.format(filepath))
+    return load_pretrained(filepath)[1]
 
-    num = 0
-    if filepath.endswith('.bin.gz'):  # word2vec
-        word_vectors = []
-        model = KeyedVectors.load_word2vec_format(filepath, binary=True)
-        vocab_list = {v: i for i, v in enumerate(list(model.vocab.keys()))}
-        for v in vocab_list:
-            word_vectors.append(model.get_vector(v))
-        word_vectors = np.array(word_vectors).reshape(len(word_vectors),
-                                                      len(word_vectors[0]))
-    elif filepath.endswith('.txt'):  # glove
-        word_vectors = array.array('d')
+
+def load_pretrianed_vocab_dict(filepath):
+    """Load the pretrained word embedding vocab dictionary.
+
+    :param filepath: full file path of the pretrained embedding file
+    :return: dict, pretrained word id mapping(shared by the callers in the
+        process, not to be modified).
+    """
+    print('Loading pretrained embedding dictionary from {}...'.format(filepath))
+    if filepath not in _pretrained_vocab_dicts:
+        _pretrained_vocab_dicts[filepath] = load_pretrained(filepath)[
+            0].to_dict()
+    return _pretrained_vocab_dicts[filepath]
+
+
+# (vocabulary, matrix) and vocab dictionary of each pretrained embedding file
+# loaded in this process
+_pretrained = {}
+_pretrained_vocab_dicts = {}
+
+
+def load_pretrained(filepath):
+    """Load the vocabulary and matrix of a pretrained embedding file
+
+    The file is parsed once and converted to a float32 .npy matrix and a
+    binary vocabulary(see binary_vocab.py) in a cache directory next to it,
+    which is memory-mapped afterwards. The cache is converted again if the
+    file is newer.
+
+    :param filepath: full file path of the pretrained embedding file
+    :return: (BinaryVocab of the word of each row, float32 matrix)
+    """
+    if filepath not in _pretrained:
+        cache_dir = filepath + PRETRAINED_CACHE_SUFFIX
+        if not pretrained_cache_up_to_date(filepath, cache_dir):
+            try:
+                convert_pretrained(filepath, cache_dir)
+            except (IOError, OSError) as e:
+                # e.g. read-only directory: convert to a temporary directory,
+                # whose files stay memory-mapped once it's removed
+                print('Can\'t cache {}({}), converting it for this process '
+                      'only...'.format(filepath, e))
+                tmp_dir = tempfile.mkdtemp(prefix='pretrained_')
+                try:
+                    convert_pretrained(filepath,
+                                       os.path.join(tmp_dir, 'cache'))
+                    _pretrained[filepath] = _load_pretrained_cache(
+                        os.path.join(tmp_dir, 'cache'))
+                finally:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                return _pretrained[filepath]
+        _pretrained[filepath] = _load_pretrained_cache(cache_dir)
+    return _pretrained[filepath]
+
+
+def _load_pretrained_cache(cache_dir):
+    return (BinaryVocab(os.path.join(cache_dir, 'vocab')),
+            np.load(os.path.join(cache_dir, 'matrix.npy'), mmap_mode='r'))
+
+
+def pretrained_cache_up_to_date(filepath, cache_dir):
+    """Whether the cache of a pretrained embedding file exists and isn't
+    older than the file"""
+    matrix_path = os.path.join(cache_dir, 'matrix.npy')
+    if not os.path.exists(matrix_path):
+        return False
+    if not os.path.exists(filepath):
+        return True
+    return os.path.getmtime(matrix_path) >= os.path.getmtime(filepath)
+
+
+def convert_pretrained(filepath, cache_dir):
+    """Parse a pretrained embedding file and save its matrix and vocabulary
+
+    :param filepath: GloVe(.txt), fastText(.zip) or word2vec(.bin.gz) file
+    :param cache_dir: directory to save matrix.npy(float32) and vocab/(
+        binary vocabulary of the word of each row) to, replaced if it exists
+    """
+    print('Converting pretrained embeddings {} to {}...'.format(filepath,
+                                                                cache_dir))
+    # write to a temporary directory first so that readers never see a
+    # partially converted file
+    tmp_dir = cache_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    matrix_path = os.path.join(tmp_dir, 'matrix.npy')
+
+    if filepath.endswith('.txt'):  # glove
+        with io.open(filepath, 'r', encoding='utf-8') as file:
+            num = sum(1 for _ in file)
+        words = []
+        matrix = None
         with io.open(filepath, 'r', encoding='utf-8') as file:
-            for _, line in tqdm(enumerate(file)):
+            for i, line in tqdm(enumerate(file), total=num):
+                delimiter = '\t' if '\t' in line else ' '
+                words.append(line.split(delimiter)[0])
                 entries = line.split(' ')[1:]
-                word_vectors.extend(float(x) for x in entries)
-                num += 1
-        dim = len(entries)
-        word_vectors = (np.array(word_vectors)
-                        .reshape(num, dim))
+                if matrix is None:
+                    matrix = np.lib.format.open_memmap(
+                        matrix_path, mode='w+', dtype=np.float32,
+                        shape=(num, len(entries)))
+                matrix[i] = [float(x) for x in entries]
     elif filepath.endswith('.zip'):  # fasttext
-        word_vectors = array.array('d')
+        words = []
         with ZipFile(filepath, 'r') as myzip:
             with myzip.open(filepath[filepath.rfind('/') + 1:filepath.find(
-                '.zip')]) as file:
+                    '.zip')]) as file:
                 num, dim = map(int, file.readline().split())
-                for _, line in tqdm(enumerate(file.readlines())):
-                    entries = line.decode('utf-8').split(' ')[1:]
-                    word_vectors.extend(float(x) for x in entries)
-                word_vectors = (np.array(word_vectors)
-                                .reshape(num, dim))
+                matrix = np.lib.format.open_memmap(
+                    matrix_path, mode='w+', dtype=np.float32,
+                    shape=(num, dim))
+                for i, line in tqdm(enumerate(file), total=num):
+                    entries = line.decode('utf-8').split(' ')
+                    words.append(entries[0])
+                    matrix[i] = [float(x) for x in entries[1:]]
+        assert len(set(words)) == num
+    elif 'bin' in filepath:  # word2vec
+        model = KeyedVectors.load_word2vec_format(filepath, binary=True)
+        if hasattr(model, 'index_to_key'):
+            words = list(model.index_to_key)
+        else:
+            words = list(model.vocab.keys())
+        matrix = np.lib.format.open_memmap(
+            matrix_path, mode='w+', dtype=np.float32,
+            shape=(len(words), model.vector_size))
+        for i, word in enumerate(words):
+            matrix[i] = model.get_vector(word)
     else:
         raise ValueError('No such embedding file as {}!'.format(filepath))
 
-    return word_vectors
+    if matrix is None:
+        matrix = np.lib.format.open_memmap(matrix_path, mode='w+',
+                                           dtype=np.float32, shape=(0, 0))
+    matrix.flush()
+    del matrix
+    save_binary_vocab(os.path.join(tmp_dir, 'vocab'), words)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.rename(tmp_dir, cache_dir)
 
 
-def load_pretrianed_vocab_dict(filepath):
-    """Load the pretrained word embedding vocab dictionary.
+def load_pretrained_rows(filepath, words):
+    """Load the pretrained word vectors of some words only
+
+    The vectors are taken from the cache of the file if it's up to
+    date(see load_pretrained()), otherwise a GloVe or fastText file is
+    parsed line by line and only the lines of the given words are kept, so
+    that the memory used is proportional to len(words), not to the size of
+    the file.
 
     :param filepath: full file path of the pretrained embedding file
-    :return: dict, pretrained word id mapping.
+    :param words: list of the words to load
+    :return: float32 [len(words), dim] array, the vector of each word(zeros
+        for the words not in the file)
     """
-    print('Loading pretrained embedding dictionary from {}...'.format(filepath))
-
-    if 'bin' in filepath:
-        vocab_dict = {v: i for i, v in enumerate(list(
-            KeyedVectors.load_word2vec_format(
-                filepath,
-                binary='bin' in filepath).vocab.keys()))}
-    elif filepath.endswith('.txt'):
-        vocab_dict = {}
+    if filepath in _pretrained or not filepath.endswith(('.txt', '.zip')) \
+            or pretrained_cache_up_to_date(
+                filepath, filepath + PRETRAINED_CACHE_SUFFIX):
+        vocab, matrix = load_pretrained(filepath)
+        rows = np.zeros([len(words), matrix.shape[1]], dtype=np.float32)
+        found = [(i, word_id) for i, word_id in enumerate(map(vocab.get,
+                                                              words))
+                 if word_id is not None]
+        if found:
+            indices, ids = zip(*found)
+            rows[list(indices)] = matrix[list(ids)]
+        return rows
+
+    print('Loading the vectors of {} words from {}...'.format(len(words),
+                                                              filepath))
+    # the rows of each word, which may be repeated
+    index = {}
+    for i, word in enumerate(words):
+        index.setdefault(word, []).append(i)
+    rows = None
+    if filepath.endswith('.txt'):  # glove
         with io.open(filepath, 'r', encoding='utf-8') as file:
-            for i, line in tqdm(enumerate(file)):
+            for line in tqdm(file):
+                if rows is None:
+                    rows = np.zeros([len(words), len(line.split(' ')) - 1],
+                                    dtype=np.float32)
                 delimiter = '\t' if '\t' in line else ' '
-                vocab_dict[line.split(delimiter)[0]] = i
-    elif filepath.endswith('.zip'):  # fasttext
-        vocab_dict = {}
+                i = index.get(line.split(delimiter, 1)[0])
+                if i:
+                    rows[i] = [float(x) for x in line.split(' ')[1:]]
+    else:  # fasttext
         with ZipFile(filepath, 'r') as myzip:
             with myzip.open(filepath[filepath.rfind('/') + 1:filepath.find(
-                '.zip')]) as file:
+                    '.zip')]) as file:
                 num, dim = map(int, file.readline().split())
-                for i, line in tqdm(enumerate(file.readlines())):
-                    vocab_dict[line.decode('utf-8').split(' ')[0]] = i
-                assert len(vocab_dict) == num
-    else:
-        raise ValueError('No such embedding file as {}!'.format(filepath))
-    return vocab_dict
+                rows = np.zeros([len(words), dim], dtype=np.float32)
+                for line in tqdm(file, total=num):
+                    # a space can't be part of an utf-8 encoded character
+                    i = index.get(line.split(b' ', 1)[0].decode('utf-8'))
+                    if i:
+                        rows[i] = [float(x) for x in
+                                   line.decode('utf-8').split(' ')[1:]]
+    if rows is None:
+        rows = np.zeros([len(words), 0], dtype=np.float32)
+    return rows
 
 
 # load fasttext
@@ -0,0 +1,202 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""Manifest of the inputs, arguments and code used to write TFRecord files
+
+The manifest (manifest.json in the output directory) records
+
+  inputs:        size, modification time and sha1 of every input file
+  args:          the arguments the outputs were generated with, except the
+                 ones only affecting the speed(EXECUTION_ARGS)
+  dataset_args:  the effective arguments(args.json) of each dataset written
+  code_version:  sha1 of the source of the preprocessing modules
+
+so that a later run with the same inputs, arguments and code can skip the
+regeneration.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import hashlib
+import json
+import os
+
+from mtl.util.util import file_sha1
+
+MANIFEST_NAME = 'manifest.json'
+
+# modules whose changes may change the generated files
+PREPROC_MODULES = ['binary_vocab.py',
+                   'categorical_vocabulary.py',
+                   'constants.py',
+                   'count_min_sketch.py',
+                   'data_prep.py',
+                   'dataset.py',
+                   'load_embeds.py',
+                   'sequences.py',
+                   'text.py',
+                   'token_cache.py',
+                   'util.py',
+                   'vocab_merge.py']
+
+
+# arguments that only change how fast the files are written
+EXECUTION_ARGS = ['streaming',
+                  'num_workers',
+                  'num_dataset_workers',
+                  'token_cache']
+
+
+def relevant_args(args):
+    return {k: v for k, v in args.items() if k not in EXECUTION_ARGS}
+
+
+def code_version():
+    """sha1 of the source files of the preprocessing modules"""
+    sha1 = hashlib.sha1()
+    util_dir = os.path.dirname(os.path.abspath(__file__))
+    for module in PREPROC_MODULES:
+        sha1.update(module.encode('utf-8'))
+        sha1.update(file_sha1(os.path.join(util_dir, module)).encode('utf-8'))
+    return sha1.hexdigest()
+
+
+def file_info(file_name):
+    stat = os.stat(file_name)
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha1': file_sha1(file_name)
+    }
+
+
+def file_unchanged(file_name, info):
+    """Whether a file still matches its recorded info
+
+    The content is only hashed again when the size matches but the
+    modification time doesn't.
+    """
+    if not os.path.exists(file_name):
+        return False
+    stat = os.stat(file_name)
+    if stat.st_size != info['size']:
+        return False
+    if stat.st_mtime == info['mtime']:
+        return True
+    return file_sha1(file_name) == info['sha1']
+
+
+def json_input_files(json_dir):
+    """The files in a json dataset directory read by Dataset"""
+    file_names = []
+    for name in ['data.json.gz', 'data.jsonl.gz']:
+        file_name = os.path.join(json_dir, name)
+        if os.path.exists(file_name):
+            file_names.append(file_name)
+            break
+    index_path = os.path.join(json_dir, 'index.json.gz')
+    if os.path.exists(index_path):
+        file_names.append(index_path)
+    return file_names
+
+
+def output_files(tfrecord_dir):
+    """args.json and the TFRecord files it lists, relative to tfrecord_dir"""
+    args_path = os.path.join(tfrecord_dir, 'args.json')
+    if not os.path.exists(args_path):
+        return None
+    with codecs.open(args_path, mode='r', encoding='utf-8') as file:
+        args = json.load(file)
+    file_names = ['args.json']
+    for split in ['train', 'valid', 'test', 'unlabeled']:
+        if args.get(split + '_shards'):
+            file_names.extend(args[split + '_shards'])
+        elif args.get(split + '_path'):
+            file_names.append(os.path.basename(args[split + '_path']))
+    return file_names
+
+
+def write_manifest(output_dir, input_files, args, tfrecord_dirs):
+    """Record the inputs and arguments of the files written to output_dir
+
+    :param output_dir: directory to save manifest.json
+    :param input_files: list of the input file paths
+    :param args: json serializable dict of the arguments used
+    :param tfrecord_dirs: list of the directories of the written datasets,
+        each containing an args.json
+    """
+    dataset_args = dict()
+    for tfrecord_dir in tfrecord_dirs:
+        with codecs.open(os.path.join(tfrecord_dir, 'args.json'), mode='r',
+                         encoding='utf-8') as file:
+            dataset_args[tfrecord_dir] = json.load(file)
+    manifest = {
+        'inputs': {file_name: file_info(file_name)
+                   for file_name in input_files},
+        'args': relevant_args(args),
+        'dataset_args': dataset_args,
+        'code_version': code_version()
+    }
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with codecs.open(manifest_path, mode='w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=4)
+    print("Manifest saved to", manifest_path)
+
+
+def remove_manifest(output_dir):
+    """Remove the manifest before (re)writing the files it describes, so
+    that an interrupted run isn't considered up to date"""
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+
+def manifest_unchanged(output_dir, input_files, args, tfrecord_dirs):
+    """Whether the files in output_dir are up to date
+
+    :return: (unchanged, reason), reason describing the first difference
+        found
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return False, 'no manifest'
+    with codecs.open(manifest_path, mode='r', encoding='utf-8') as file:
+        manifest = json.load(file)
+
+    if manifest.get('code_version') != code_version():
+        return False, 'preprocessing code changed'
+    # compare as json to ignore the differences json doesn't keep
+    if json.dumps(manifest.get('args'), sort_keys=True) != \
+            json.dumps(relevant_args(args), sort_keys=True):
+        return False, 'arguments changed'
+    if sorted(manifest['inputs']) != sorted(input_files):
+        return False, 'input files changed'
+    for file_name in input_files:
+        if not file_unchanged(file_name, manifest['inputs'][file_name]):
+            return False, 'input file changed: %s' % file_name
+    for tfrecord_dir in tfrecord_dirs:
+        if tfrecord_dir not in manifest['dataset_args']:
+            return False, 'output directories changed'
+        file_names = output_files(tfrecord_dir)
+        if file_names is None:
+            return False, 'output missing: %s' % tfrecord_dir
+        for file_name in file_names:
+            if not os.path.exists(os.path.join(tfrecord_dir, file_name)):
+                return False, 'output missing: %s' % os.path.join(
+                    tfrecord_dir, file_name)
+    return True, None
@@ -17,8 +17,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import json
+import os
 from collections import namedtuple
 
+import numpy as np
 import tensorflow as tf
 from tensorflow.python.framework import sparse_tensor as sparse_tensor_lib
 from tensorflow.python.ops import parsing_ops
@@ -28,13 +31,42 @@ class Pipeline(object):
     def __init__(self, tfrecord_file, feature_map, batch_size=32,
                  num_threads=4, prefetch_buffer_size=1,
                  static_max_length=None, shuffle_buffer_size=10000,
-                 shuffle=True, num_epochs=None, one_shot=False):
+                 shuffle=True, num_epochs=None, one_shot=False,
+                 vocab_cutoff=None, vocab_keys=(), length_keys=(),
+                 bucket_boundaries=None, bucket_batch_sizes=None):
+        """
+        :param vocab_cutoff: if given, word ids at or beyond it are mapped to
+            the unknown token(0), applying a vocabulary cutoff to TFRecord
+            files written with the full vocabulary
+        :param vocab_keys: keys of the features holding word ids(int
+            features, e.g. tokens or <field>_types) or indexed by word
+            ids(SparseFeature, the binary l2-normalized sparse bag of words)
+            to apply vocab_cutoff to, see cut_vocab()
+        :param length_keys: keys of the int64 length features(e.g.
+            tokens_length) to bucket the examples by, the longest one of an
+            example being its length
+        :param bucket_boundaries: if given, the examples are batched with the
+            examples of similar length, bucket i holding the lengths in
+            [bucket_boundaries[i - 1], bucket_boundaries[i]) so that each
+            batch is only padded to the longest example of its bucket
+        :param bucket_batch_sizes: batch size of each of the
+            len(bucket_boundaries) + 1 buckets, batch_size for all of them
+            if None(see length_buckets())
+        """
         self._feature_map = feature_map
         self._batch_size = batch_size
         self._static_max_length = static_max_length
+        self._vocab_cutoff = vocab_cutoff
+        self._vocab_keys = set(vocab_keys) if vocab_cutoff else set()
 
-        # Initialize the dataset
-        dataset = tf.data.TFRecordDataset(tfrecord_file)
+        # Initialize the dataset, reading the shards in parallel if given a
+        # list of TFRecord files
+        if isinstance(tfrecord_file, (list, tuple)) and len(tfrecord_file) > 1:
+            dataset = tf.data.TFRecordDataset(
+                tfrecord_file,
+                num_parallel_reads=min(num_threads, len(tfrecord_file)))
+        else:
+            dataset = tf.data.TFRecordDataset(tfrecord_file)
 
         # Maybe randomize
         if shuffle:
@@ -46,9 +78,25 @@ class Pipeline(object):
         elif num_epochs > 1:
             dataset = dataset.repeat(count=num_epochs)
 
-        dataset = dataset.batch(batch_size)
-        dataset = dataset.map(self.parse_example,
-                              num_parallel_calls=num_threads)
+        if bucket_boundaries is not None:
+            if not length_keys:
+                raise ValueError("bucketing needs the length features")
+            if bucket_batch_sizes is None:
+                bucket_batch_sizes = [batch_size] * (
+                    len(bucket_boundaries) + 1)
+            if len(bucket_batch_sizes) != len(bucket_boundaries) + 1:
+                raise ValueError("unrecognized bucket batch sizes: %s" %
+                                 bucket_batch_sizes)
+            dataset = self.bucket_by_length(dataset, length_keys,
+                                            bucket_boundaries,
+                                            bucket_batch_sizes, num_threads)
+            dataset = dataset.map(
+                lambda serialized, lengths: self.parse_example(serialized),
+                num_parallel_calls=num_threads)
+        else:
+            dataset = dataset.batch(batch_size)
+            dataset = dataset.map(self.parse_example,
+                                  num_parallel_calls=num_threads)
 
         # Pre-fetch a batch for faster processing
         dataset = dataset.prefetch(prefetch_buffer_size)
@@ -67,10 +115,60 @@ class Pipeline(object):
         index = 0
         result = {}
         for key in sorted(self._feature_map.keys()):
-            result[key] = self._outputs[index]
+            feature = self._feature_map[key]
+            if isinstance(feature, tf.SparseFeature):
+                # make the static shape [batch_size, size] known
+                size = self._vocab_cutoff if key in self._vocab_keys \
+                    else feature.size
+                result[key] = tf.sparse_reshape(self._outputs[index],
+                                                [-1, size])
+            else:
+                result[key] = self._outputs[index]
             index += 1
         self._result = result
 
+    def bucket_by_length(self, dataset, length_keys, bucket_boundaries,
+                         bucket_batch_sizes, num_threads):
+        """Batch the serialized examples of each length bucket together
+
+        Only the length features are parsed to pick the buckets, a batch of
+        examples at a time, the examples being parsed once batched.
+
+        :return: dataset of (serialized examples, lengths) batches
+        """
+        length_features = {key: self._feature_map[key]
+                           for key in length_keys}
+
+        def parse_lengths(serialized):
+            parsed = parsing_ops.parse_example(serialized, length_features)
+            lengths = tf.reduce_max(
+                tf.stack([tf.reshape(parsed[key], [-1])
+                          for key in sorted(length_features)]), axis=0)
+            return serialized, lengths
+
+        dataset = dataset.batch(self._batch_size)
+        dataset = dataset.map(parse_lengths, num_parallel_calls=num_threads)
+        dataset = dataset.apply(tf.contrib.data.unbatch())
+
+        boundaries = tf.constant(bucket_boundaries, dtype=tf.int64)
+        batch_sizes = tf.constant(bucket_batch_sizes, dtype=tf.int64)
+
+        def key_func(serialized, length):
+            return tf.reduce_sum(
+                tf.cast(tf.less_equal(boundaries, length), tf.int64))
+
+        def window_size_func(bucket):
+            return batch_sizes[bucket]
+
+        def reduce_func(bucket, window):
+            return window.batch(batch_sizes[bucket])
+
+        return dataset.apply(
+            tf.contrib.data.group_by_window(
+                key_func=key_func,
+                reduce_func=reduce_func,
+                window_size_func=window_size_func))
+
     def pad(self, t):
         s = tf.shape(t)
         paddings = [[0, 0], [0, self._static_max_length - s[1]]]
@@ -79,12 +177,58 @@ class Pipeline(object):
         assert x.get_shape().as_list()[1] is self._static_max_length
         return x
 
+    def cut_vocab(self, t, feature):
+        """Map the word ids at or beyond vocab_cutoff to 0
+
+        Word ids as values(tokens, types) are replaced one by one, as in the
+        sequences written with the smaller vocabulary(the counts of the
+        types cut off then add up under the repeated 0).
+
+        A [batch_size, vocab_size] bag of words is made the one written
+        with the smaller vocabulary: the entries cut off are merged into
+        the unknown word's and each row is l2-normalized again, which
+        assumes binary bags of words(sparse_bag_of_words()). tf-idf can't
+        be cut since its idf is of the full vocabulary.
+        """
+        if isinstance(feature, tf.SparseFeature):
+            cutoff = tf.constant(self._vocab_cutoff, dtype=tf.int64)
+            rows = t.indices[:, 0]
+            word_ids = t.indices[:, 1]
+            word_ids = tf.where(word_ids < cutoff, word_ids,
+                                tf.zeros_like(word_ids))
+            # merge the entries of the same row and word id
+            keys, entries = tf.unique(rows * cutoff + word_ids)
+            values = tf.unsorted_segment_max(t.values, entries,
+                                             tf.size(keys))
+            rows = keys // cutoff
+            row_norms = tf.sqrt(tf.unsorted_segment_sum(
+                tf.square(values), rows,
+                tf.cast(t.dense_shape[0], tf.int32)))
+            values = values / tf.gather(row_norms, rows)
+            indices = tf.stack([rows, keys % cutoff], axis=1)
+            dense_shape = tf.stack([t.dense_shape[0], cutoff])
+            return tf.sparse_reorder(
+                tf.SparseTensor(indices, values, dense_shape))
+        if isinstance(t, sparse_tensor_lib.SparseTensor):
+            # word ids as values
+            return tf.SparseTensor(
+                t.indices,
+                tf.where(t.values < self._vocab_cutoff, t.values,
+                         tf.zeros_like(t.values)),
+                t.dense_shape)
+        return tf.where(t < self._vocab_cutoff, t, tf.zeros_like(t))
+
     def parse_example(self, serialized):
         parsed = parsing_ops.parse_example(serialized, self._feature_map)
         result = []
         for key in sorted(self._feature_map.keys()):
             val = parsed[key]
-            if isinstance(val, sparse_tensor_lib.SparseTensor):
+            if key in self._vocab_keys:
+                val = self.cut_vocab(val, self._feature_map[key])
+            if isinstance(self._feature_map[key], tf.SparseFeature):
+                # e.g. sparse bag of words, kept sparse
+                result.append(val)
+            elif isinstance(val, sparse_tensor_lib.SparseTensor):
                 dense_tensor = tf.sparse_tensor_to_dense(val)
                 if self._static_max_length is not None:
                     dense_tensor = self.pad(dense_tensor)
@@ -106,6 +250,79 @@ class Pipeline(object):
         return self._result
 
 
+def length_buckets(length_quantiles, num_buckets, batch_size,
+                   max_tokens=None, padded_length=None):
+    """Bucket boundaries and batch sizes from the recorded lengths
+
+    The buckets hold about as many examples each, their boundaries being
+    the percentiles of the training lengths(length_quantiles in args.json).
+
+    :param length_quantiles: the 0th, 1st, ..., 100th percentiles of the
+        lengths
+    :param num_buckets: number of buckets, fewer if percentiles are equal
+    :param batch_size: batch size of every bucket if max_tokens is None
+    :param max_tokens: if given, the batch size of a bucket is the number of
+        its longest examples that fit in max_tokens tokens(at least 1)
+    :param padded_length: length every sequence is padded to in the TFRecord
+        files(written with padding), which max_tokens is then divided by
+        instead of the lengths of the buckets
+    :return: (bucket_boundaries, bucket_batch_sizes, mean_batch_size), the
+        mean batch size weighting each bucket by its share of the examples
+    """
+    if num_buckets < 1 or len(length_quantiles) != 101:
+        raise ValueError("unrecognized length buckets: %d buckets of %d "
+                         "quantiles" % (num_buckets, len(length_quantiles)))
+    percentiles = [100 * i // num_buckets for i in range(1, num_buckets)]
+    # bucket i holds the lengths up to its percentile
+    bucket_boundaries = sorted(set(int(length_quantiles[p]) + 1
+                                   for p in percentiles))
+    max_length = int(length_quantiles[-1])
+    bucket_boundaries = [b for b in bucket_boundaries if b <= max_length]
+    if max_tokens is None:
+        bucket_batch_sizes = [batch_size] * (len(bucket_boundaries) + 1)
+    else:
+        max_lengths = [b - 1 for b in bucket_boundaries] + [max_length]
+        if padded_length is not None:
+            max_lengths = [padded_length] * len(max_lengths)
+        bucket_batch_sizes = [max(1, max_tokens // max(1, length))
+                              for length in max_lengths]
+
+    # share of the examples in each bucket, from the percentiles
+    shares = []
+    previous = 0
+    for boundary in bucket_boundaries + [max_length + 1]:
+        share = sum(1 for q in length_quantiles[1:] if q < boundary)
+        shares.append(share - previous)
+        previous = share
+    mean_batch_size = 100. / sum(
+        share / size for share, size in zip(shares, bucket_batch_sizes))
+    return bucket_boundaries, bucket_batch_sizes, mean_batch_size
+
+
+def load_length_buckets(dataset_path, num_buckets, batch_size,
+                        max_tokens=None):
+    """Length buckets of a dataset's training examples from the
+    length_quantiles in its args.json
+
+    An example is bucketed by its longest text field.
+
+    :param dataset_path: directory of the TFRecord files
+    :return: length_buckets() of the dataset, None if args.json has no length
+        statistics
+    """
+    with open(os.path.join(dataset_path, 'args.json')) as file:
+        args = json.load(file)
+    if not args.get('length_quantiles'):
+        return None
+    quantiles = np.max(list(args['length_quantiles'].values()),
+                       axis=0).tolist()
+    padded_length = None
+    if args.get('padding'):
+        padded_length = int(args['max_document_length'])
+    return length_buckets(quantiles, num_buckets, batch_size,
+                          max_tokens=max_tokens, padded_length=padded_length)
+
+
 # namedtuple for bucket_info object (used in Pipeline)
 # func: a mapping from examples to tf.int64 keys
 # pads: a set of tf shapes that correspond to padded examples
@@ -0,0 +1,79 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+
+
+class CSRSequences(object):
+    """Variable length integer sequences stored in one flat array
+
+    The i-th sequence is values[offsets[i]:offsets[i + 1]] (as in the CSR
+    sparse matrix format), which avoids a Python list and a numpy array
+    object per sequence.
+    """
+
+    def __init__(self, values, offsets):
+        """
+        :param values: 1-D array of all the sequences concatenated
+        :param offsets: 1-D int64 array of the len(sequences) + 1 start
+            offsets of the sequences in values, the last one being len(values)
+        """
+        assert len(offsets) > 0 and offsets[-1] == len(values)
+        self._values = values
+        self._offsets = offsets
+
+    @classmethod
+    def from_sequences(cls, sequences, dtype=np.int32):
+        """Concatenate an iterable of integer sequences
+
+        :param sequences: iterable of lists or 1-D arrays
+        :param dtype: dtype of the flat array
+        :return: CSRSequences
+        """
+        arrays = [np.asarray(seq, dtype=dtype) for seq in sequences]
+        offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in arrays], out=offsets[1:])
+        if arrays:
+            values = np.concatenate(arrays)
+        else:
+            values = np.zeros(0, dtype=dtype)
+        return cls(values, offsets)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        """The index-th sequence, a view of the flat array"""
+        return self._values[self._offsets[index]:self._offsets[index + 1]]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def values(self):
+        return self._values
+
+    @property
+    def offsets(self):
+        return self._offsets
+
+    @property
+    def lengths(self):
+        return np.diff(self._offsets)
@@ -16,6 +16,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import itertools
+import multiprocessing
 import re
 
 import numpy as np
@@ -24,6 +27,7 @@ from tensorflow.python.platform import gfile
 from tqdm import tqdm
 
 from mtl.util.categorical_vocabulary import CategoricalVocabulary
+from mtl.util.count_min_sketch import CountMinSketch
 
 try:
     import cPickle as pickle
@@ -70,6 +74,97 @@ def tokenizer(iterator):
         yield TOKENIZER_RE.findall(value)
 
 
+# documents and tokenizer shared with the forked counting processes
+_documents_to_count = None
+
+
+def _count_chunk(start, end):
+    documents, tokenizer_fn = _documents_to_count
+    return count_tokens(documents[start:end], tokenizer_fn)
+
+
+def count_tokens(documents, tokenizer_fn=tokenizer, num_workers=1,
+                 chunk_size=100000):
+    """Count the tokens of the documents
+
+    The tokens are counted by collections.Counter, chunk by chunk in forked
+    processes if num_workers > 1, the partial counts being merged in the
+    order of the chunks. Counting is serial when already running in a pool
+    worker, which can't start processes.
+
+    :param documents: list of documents
+    :param tokenizer_fn: tokenizer generator, see tokenizer()
+    :param num_workers: number of counting processes
+    :param chunk_size: number of documents counted by a process at a time
+    :return: collections.Counter, mapping from token to count
+    """
+    num_chunks = (len(documents) + chunk_size - 1) // chunk_size
+    num_workers = min(num_workers, num_chunks)
+    if num_workers <= 1 or multiprocessing.current_process().daemon:
+        counts = collections.Counter()
+        counts.update(itertools.chain.from_iterable(
+            tokenizer_fn(documents)))
+        return counts
+
+    global _documents_to_count
+    _documents_to_count = (documents, tokenizer_fn)
+    ranges = [(start, min(start + chunk_size, len(documents)))
+              for start in range(0, len(documents), chunk_size)]
+    pool = multiprocessing.get_context('fork').Pool(num_workers)
+    try:
+        partial_counts = pool.starmap(_count_chunk, ranges, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+        _documents_to_count = None
+    counts = partial_counts[0]
+    for chunk_counts in partial_counts[1:]:
+        counts.update(chunk_counts)
+    return counts
+
+
+def count_frequent_tokens(documents, tokenizer_fn=tokenizer, min_frequency=0,
+                          sketch_width=1 << 22, sketch_depth=4,
+                          chunk_size=10000):
+    """Count the tokens appearing more than min_frequency times in bounded
+    memory
+
+    The documents are read twice: the first pass counts all the tokens in a
+    count-min sketch, the second one counts exactly only the tokens whose
+    estimated count is above min_frequency. The estimates never being lower
+    than the true counts, all the tokens above min_frequency are found, with
+    their exact counts, while the memory used is that of the sketch and of
+    the frequent tokens(plus the few infrequent tokens overestimated by the
+    sketch, which are dropped).
+
+    :param documents: list of documents
+    :param tokenizer_fn: tokenizer generator, see tokenizer()
+    :param min_frequency: tokens appearing less than or equal to this number
+        of times are not counted
+    :param sketch_width: number of counters of each row of the sketch
+    :param sketch_depth: number of rows(hash functions) of the sketch
+    :param chunk_size: number of documents hashed at a time
+    :return: collections.Counter, mapping from token to count
+    """
+    def token_chunks():
+        for start in range(0, len(documents), chunk_size):
+            yield list(itertools.chain.from_iterable(
+                tokenizer_fn(documents[start:start + chunk_size])))
+
+    sketch = CountMinSketch(width=sketch_width, depth=sketch_depth)
+    for tokens in token_chunks():
+        sketch.update(tokens)
+
+    counts = collections.Counter()
+    for tokens in token_chunks():
+        frequent = sketch.estimate(tokens) > min_frequency
+        counts.update(itertools.compress(tokens, frequent))
+    for token in [token for token, count in six.iteritems(counts)
+                  if count <= min_frequency]:
+        del counts[token]
+    return counts
+
+
 class ByteProcessor(object):
     """Maps documents into sequence of ids for bytes."""
 
@@ -167,20 +262,34 @@ class VocabularyProcessor(object):
         else:
             self._tokenizer = tokenizer
 
-    def fit(self, raw_documents, unused_y=None):
+    def fit(self, raw_documents, unused_y=None, num_workers=1,
+            sketch_width=None, sketch_depth=4):
         """Learn a vocabulary dictionary of all tokens in the raw documents.
 
         Args:
-          raw_documents: An iterable which yield either str or unicode.
+          raw_documents: A list of str or unicode.
           unused_y: to match fit format signature of estimators.
+          num_workers: number of processes counting the tokens.
+          sketch_width: if given, only the tokens above min_frequency are
+            counted, using a count-min sketch of this width to find them(see
+            count_frequent_tokens()).
+          sketch_depth: number of rows of the count-min sketch.
 
         Returns:
           self
         """
         print("Fitting the vocabulary...")
-        for tokens in tqdm(self._tokenizer(raw_documents)):
-            for token in tokens:
-                self.vocabulary_.add(token)
+        if not isinstance(raw_documents, list):
+            raw_documents = list(raw_documents)
+        if sketch_width:
+            counts = count_frequent_tokens(raw_documents, self._tokenizer,
+                                           min_frequency=self.min_frequency,
+                                           sketch_width=sketch_width,
+                                           sketch_depth=sketch_depth)
+        else:
+            counts = count_tokens(raw_documents, self._tokenizer,
+                                  num_workers=num_workers)
+        self.vocabulary_.add_counts(counts)
         # if self.min_frequency > 0:
         self.vocabulary_.trim(min_frequency=self.min_frequency,
                               max_frequency=self.max_frequency,
@@ -247,6 +356,48 @@ class VocabularyProcessor(object):
                 word_ids[idx] = self.vocabulary_.get(token)
             yield word_ids
 
+    def transform_csr(self, raw_documents, pad=False):
+        """Transform documents to word ids in the CSR format.
+
+        Same word ids as transform()(or transform_pad() with pad=True), but
+        the tokens of all the documents are looked up at once.
+
+        Args:
+          raw_documents: An iterable which yield either str or unicode.
+          pad: whether to pad each document to max_document_length.
+
+        Returns:
+          (values, offsets): int64 numpy arrays, the word ids of all the
+          documents concatenated and the len(documents) + 1 offsets of each
+          document's word ids in values.
+        """
+        print("Transforming the texts into word ids%s..." % (
+            " with padding" if pad else " without padding"))
+        documents = list(self._tokenizer(raw_documents))
+        lengths = np.fromiter(map(len, documents), dtype=np.int64,
+                              count=len(documents))
+        if lengths.size and lengths.max() > self.max_document_length:
+            max_length = int(self.max_document_length)
+            lengths = np.minimum(lengths, max_length)
+            documents = [tokens[:max_length] for tokens in documents]
+        offsets = np.zeros(len(documents) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        values = self.vocabulary_.get_ids(
+            list(itertools.chain.from_iterable(documents)))
+        if not pad:
+            return values, offsets
+
+        # position of each word id in the padded documents: its document's
+        # padded offset plus its index in the document
+        max_length = int(self.max_document_length)
+        padded_offsets = np.arange(len(documents) + 1,
+                                   dtype=np.int64) * max_length
+        positions = np.repeat(padded_offsets[:-1] - offsets[:-1], lengths) + \
+            np.arange(len(values), dtype=np.int64)
+        padded_values = np.zeros(padded_offsets[-1], dtype=np.int64)
+        padded_values[positions] = values
+        return padded_values, padded_offsets
+
     def reverse(self, documents):
         """Reverses output of vocabulary mapping to words.
 
@@ -0,0 +1,165 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+# -*- coding: utf-8 -*-
+
+"""On-disk cache of the tokenized text of a dataset
+
+The cache of one preprocessing configuration is a directory containing
+
+  types.bin / types_offsets.npy:  utf-8 string table of all the token types
+  <i>_ids.npy / <i>_offsets.npy:  flat int32 type ids of the i-th text field
+                                  and the int64 start offset of each example
+  <i>_weights.npy / <i>_weights_offsets.npy: token weights, if any
+  meta.json:                      labels, ids and number of examples
+
+All the arrays can be memory-mapped.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from mtl.util.manifest import code_version
+from mtl.util.util import file_sha1, make_dir
+
+CACHE_VERSION = 1
+
+
+def token_cache_key(data_file_name, config):
+    """Key of the cache of a data file tokenized with the given config
+
+    :param data_file_name: path to the gzipped json(l) data file
+    :param config: dict of the preprocessing arguments
+    :return: hex digest identifying the input file, the configuration and
+        the preprocessing code
+    """
+    key = {
+        'version': CACHE_VERSION,
+        'data': file_sha1(data_file_name),
+        'config': config,
+        'code': code_version()
+    }
+    return hashlib.sha1(
+        json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _flatten(seqs, dtype):
+    offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(seq) for seq in seqs])
+    flat = np.fromiter((x for seq in seqs for x in seq), dtype=dtype,
+                       count=int(offsets[-1]))
+    return flat, offsets
+
+
+def _split(flat, offsets):
+    return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def save_token_cache(cache_dir, text_field_names, sequences, weights, meta):
+    """Save tokenized sequences to cache_dir
+
+    The cache is written to a uniquely named temporary directory first and
+    renamed so that an interrupted run never leaves a partial cache behind.
+    If another process renamed its cache of the same key first, that one is
+    kept.
+
+    :param cache_dir: directory of the cache
+    :param text_field_names: list of the text field names
+    :param sequences: dict mapping text field names to lists of token lists
+    :param weights: dict mapping text field names to lists of weight lists
+    :param meta: json serializable dict saved along with the sequences
+    """
+    parent_dir = os.path.dirname(os.path.abspath(cache_dir))
+    make_dir(parent_dir)
+    tmp_dir = tempfile.mkdtemp(prefix=os.path.basename(cache_dir) + '.tmp',
+                               dir=parent_dir)
+
+    type_ids = dict()
+    for i, text_field_name in enumerate(text_field_names):
+        seqs = sequences[text_field_name]
+        ids = [[type_ids.setdefault(token, len(type_ids)) for token in seq]
+               for seq in seqs]
+        flat, offsets = _flatten(ids, np.int32)
+        np.save(os.path.join(tmp_dir, '%d_ids.npy' % i), flat)
+        np.save(os.path.join(tmp_dir, '%d_offsets.npy' % i), offsets)
+        if text_field_name in weights:
+            flat, offsets = _flatten(weights[text_field_name], np.float32)
+            np.save(os.path.join(tmp_dir, '%d_weights.npy' % i), flat)
+            np.save(os.path.join(tmp_dir, '%d_weights_offsets.npy' % i),
+                    offsets)
+
+    encoded = [t.encode('utf-8') for t in type_ids]
+    type_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    type_offsets[1:] = np.cumsum([len(t) for t in encoded])
+    with open(os.path.join(tmp_dir, 'types.bin'), 'wb') as file:
+        file.write(b''.join(encoded))
+    np.save(os.path.join(tmp_dir, 'types_offsets.npy'), type_offsets)
+
+    with codecs.open(os.path.join(tmp_dir, 'meta.json'), mode='w',
+                     encoding='utf-8') as file:
+        json.dump(meta, file, ensure_ascii=False)
+
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        # unless another process wrote the cache of the same key meanwhile
+        if not os.path.exists(os.path.join(cache_dir, 'meta.json')):
+            raise
+
+
+def load_token_cache(cache_dir, text_field_names):
+    """Load the tokenized sequences saved by save_token_cache()
+
+    :param cache_dir: directory of the cache
+    :param text_field_names: list of the text field names
+    :return: (sequences, weights, meta) as passed to save_token_cache()
+    """
+    with open(os.path.join(cache_dir, 'types.bin'), 'rb') as file:
+        blob = file.read()
+    type_offsets = np.load(os.path.join(cache_dir, 'types_offsets.npy'))
+    types = np.array([blob[type_offsets[i]:type_offsets[i + 1]].decode('utf-8')
+                      for i in range(len(type_offsets) - 1)], dtype=object)
+
+    sequences = dict()
+    weights = dict()
+    for i, text_field_name in enumerate(text_field_names):
+        ids = np.load(os.path.join(cache_dir, '%d_ids.npy' % i),
+                      mmap_mode='r')
+        offsets = np.load(os.path.join(cache_dir, '%d_offsets.npy' % i))
+        sequences[text_field_name] = [
+            seq.tolist() for seq in _split(types[ids], offsets)]
+        weights_path = os.path.join(cache_dir, '%d_weights.npy' % i)
+        if os.path.exists(weights_path):
+            offsets = np.load(
+                os.path.join(cache_dir, '%d_weights_offsets.npy' % i))
+            weights[text_field_name] = [
+                seq.tolist() for seq in _split(np.load(weights_path), offsets)]
+
+    with codecs.open(os.path.join(cache_dir, 'meta.json'), mode='r',
+                     encoding='utf-8') as file:
+        meta = json.load(file)
+
+    return sequences, weights, meta
@@ -17,6 +17,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import gzip
+import hashlib
 import json
 import os
 import threading
@@ -94,8 +96,8 @@ def threadsafe_generator(f):
 
 def bag_of_words(words, vocab_size, freq=False, norm=True, dtype=np.float32):
     """This assumes words are integers."""
-    if type(words) != list:
-        raise ValueError("words should be list")
+    if not isinstance(words, (list, np.ndarray)):
+        raise ValueError("words should be list or numpy array")
 
     if len(words) < 1:
         raise ValueError("empty word sequence")
@@ -105,12 +107,9 @@ def bag_of_words(words, vocab_size, freq=False, norm=True, dtype=np.float32):
 
     X = np.zeros(vocab_size, dtype=dtype)
     if freq:
-        for word in words:
-            X[word] += 1
+        np.add.at(X, words, 1)
     else:
-        types = set(words)
-        for word in types:
-            X[word] = 1
+        X[words] = 1
 
     if norm:
         denom = np.linalg.norm(X)
@@ -120,6 +119,101 @@ def bag_of_words(words, vocab_size, freq=False, norm=True, dtype=np.float32):
     return X
 
 
+def sparse_bag_of_words(words, freq=False, norm=True, dtype=np.float32):
+    """Sparse version of bag_of_words(), only the non-zero entries
+
+    :return: (indices, values), the sorted word ids and their values, equal
+        to bag_of_words(words, vocab_size, ...)[indices]
+    """
+    if not isinstance(words, (list, np.ndarray)):
+        raise ValueError("words should be list or numpy array")
+
+    if len(words) < 1:
+        raise ValueError("empty word sequence")
+
+    indices, counts = np.unique(words, return_counts=True)
+    if freq:
+        values = counts.astype(dtype)
+    else:
+        values = np.ones(len(indices), dtype=dtype)
+
+    if norm:
+        denom = np.linalg.norm(values)
+        denom += np.finfo(values.dtype).eps
+        values = values / denom
+
+    return indices.astype(np.int64), values
+
+
+def document_frequencies(sequences, vocab_size, chunk_size=100000):
+    """Number of sequences each word id appears in
+
+    Sequences are processed chunk by chunk: the (sequence, word id) pairs of
+    a chunk are sorted and deduplicated and the remaining word ids are
+    counted with np.bincount.
+
+    :param sequences: iterable of integer sequences(lists or 1-D arrays)
+    :param vocab_size: size of the vocabulary, larger than all the word ids
+    :param chunk_size: number of sequences processed at a time
+    :return: (df, num_docs), the int64 array of the document frequency of
+        each word id and the number of sequences
+    """
+    df = np.zeros(vocab_size, dtype=np.int64)
+    num_docs = 0
+    chunk = []
+    for seq in sequences:
+        chunk.append(seq)
+        if len(chunk) == chunk_size:
+            df += _chunk_document_frequencies(chunk, vocab_size)
+            num_docs += len(chunk)
+            chunk = []
+    if chunk:
+        df += _chunk_document_frequencies(chunk, vocab_size)
+        num_docs += len(chunk)
+    return df, num_docs
+
+
+def _chunk_document_frequencies(chunk, vocab_size):
+    docs = np.repeat(np.arange(len(chunk), dtype=np.int64),
+                     [len(seq) for seq in chunk])
+    words = np.concatenate(chunk).astype(np.int64)
+    keys = np.sort(docs * vocab_size + words)
+    # the first occurrence of each word in each sequence
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = keys[1:] != keys[:-1]
+    return np.bincount(keys[first] % vocab_size, minlength=vocab_size)
+
+
+def inverse_document_frequencies(df, num_docs):
+    """idf = 1 + log(num_docs / df), words never seen count as df = 1
+
+    Same formula as _inverse_document_frequencies() below.
+    """
+    return 1 + np.log(num_docs / np.maximum(df, 1))
+
+
+def sparse_tfidf(words, idf, norm=True, dtype=np.float32):
+    """Sparse tf-idf vector of a sequence of word ids
+
+    Uses the sublinear term frequency 1 + log(count).
+
+    :param words: list or numpy array of word ids
+    :param idf: inverse document frequencies indexed by word id
+    :param norm: whether to l2-normalize the vector
+    :return: (indices, values), the sorted word ids and their tf-idf values
+    """
+    if len(words) < 1:
+        raise ValueError("empty word sequence")
+
+    indices, counts = np.unique(words, return_counts=True)
+    values = (1 + np.log(counts)) * idf[indices]
+
+    if norm:
+        values = values / (np.linalg.norm(values) + np.finfo(dtype).eps)
+
+    return indices.astype(np.int64), values.astype(dtype)
+
+
 # TF-IDF
 # https://stevenloria.com/tf-idf/
 # https://gist.github.com/anabranch/48c5c0124ba4e162b2e3
@@ -204,6 +298,106 @@ def load_json(json_file_name):
         return json.loads(json_minified)
 
 
+def file_sha1(file_name, chunk_size=1 << 20):
+    """Hex sha1 digest of the content of a file, read chunk by chunk"""
+    sha1 = hashlib.sha1()
+    with open(file_name, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def iter_json_array(file, chunk_size=1 << 20):
+    """Incrementally decode the elements of a top-level json array
+
+    Only one chunk of the file plus the element being decoded are kept in
+    memory, instead of the whole parsed list `json.load` would build.
+
+    :param file: text file object positioned at the beginning of the array
+    :param chunk_size: number of characters to read at a time
+    :return: generator of the decoded array elements
+    """
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    # '[' first, then a value or ']', then ',' or ']' after each value and
+    # a value after each ','
+    expecting = '['
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n':
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise ValueError('Unexpected end of json array')
+            buf = file.read(chunk_size)
+            pos = 0
+            eof = not buf
+            continue
+
+        char = buf[pos]
+        if expecting == '[':
+            if char != '[':
+                raise ValueError('Expecting "[" at the beginning of the file')
+            expecting = 'first value'
+            pos += 1
+        elif expecting == 'separator':
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('Expecting "," or "]" after an array '
+                                 'element: %r' % buf[pos:pos + 20])
+            expecting = 'value'
+            pos += 1
+        elif char == ']' and expecting == 'first value':
+            return
+        else:
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+                # a prefix of the element may decode too(e.g. 12 of 12345
+                # or 1 of 1.5), so it has to be followed by a delimiter
+                complete = eof or (end < len(buf) and
+                                   buf[end] in ' \t\r\n,]')
+            except ValueError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                # the element may be cut by the end of the buffer, read more
+                more = file.read(max(chunk_size, len(buf) - pos))
+                buf = buf[pos:] + more
+                pos = 0
+                eof = not more
+                continue
+            yield item
+            pos = end
+            expecting = 'separator'
+
+        if pos >= chunk_size:
+            buf = buf[pos:]
+            pos = 0
+
+
+def iter_json_examples(file_name):
+    """Stream the examples of a gzipped json data file one at a time
+
+    Supports both the json array format (`data.json.gz`) and the line
+    delimited format with one json object per line (`data.jsonl.gz`).
+
+    :param file_name: path to the gzipped json(l) file
+    :return: generator of the examples (dicts)
+    """
+    with gzip.open(file_name, mode='rt', encoding='utf-8') as file:
+        if file_name.endswith('.jsonl.gz'):
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            for item in iter_json_array(file):
+                yield item
+
+
 if __name__ == "__main__":
     """Test bag of words"""
     # words = [1, 2, 3, 4, 4, 5]
@@ -0,0 +1,173 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# =============================================================================
+
+"""External sort-merge of word frequency dictionaries(vocab_freq.json)
+
+The merged vocabulary may not fit in memory when merging the vocabularies of
+many large datasets. Each vocabulary is written to a run file sorted by word,
+the runs are merged adding up the counts of the same word, and the merged
+counts are sorted by decreasing frequency in runs of bounded size again, so
+that at most one input vocabulary or max_words_in_memory words are held in
+memory at a time. Its binary version(see binary_vocab.py) can be written
+from the same runs: the words are added in order from the runs sorted by
+word, and the id of each word is its position in the merged dictionary.
+
+The merged dictionary is the same as dataset.merge_vocab_freq_dicts(): words
+of the same frequency are in the order they first appear in the input
+vocabularies, each word carrying the position of its first appearance
+through the runs.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import heapq
+import itertools
+import json
+import os
+import shutil
+import tempfile
+
+from mtl.util.binary_vocab import BinaryVocabWriter
+
+
+def _frequency_order(item):
+    # (word, count, first position[, position in the sorted words])
+    return -item[1], item[2]
+
+
+def write_run(items, run_path):
+    """Write (word, count, first position[, position in the sorted words])
+    items to a run file, one json list per line"""
+    with codecs.open(run_path, mode='w', encoding='utf-8') as file:
+        for item in items:
+            file.write(json.dumps(item, ensure_ascii=False))
+            file.write('\n')
+
+
+def read_run(run_path):
+    """Iterate over the items of a run file, as tuples"""
+    with codecs.open(run_path, mode='r', encoding='utf-8') as file:
+        for line in file:
+            yield tuple(json.loads(line))
+
+
+def add_up_counts(items):
+    """Add up the counts of the consecutive items of the same word
+
+    :param items: iterable of (word, count, first position) sorted by word
+    :return: iterator of (word, total count, first position of the word)
+    """
+    for word, group in itertools.groupby(items, key=lambda item: item[0]):
+        group = list(group)
+        yield (word, sum(count for _, count, _ in group),
+               min(first for _, _, first in group))
+
+
+def write_vocab_freq(items, save_path):
+    """Write (word, count, ...) items as a compact json dictionary of the
+    counts, in order"""
+    with codecs.open(save_path, mode='w', encoding='utf-8') as file:
+        file.write('{')
+        for i, item in enumerate(items):
+            word, count = item[:2]
+            if i:
+                file.write(',')
+            file.write(json.dumps(word, ensure_ascii=False))
+            file.write(':')
+            file.write(json.dumps(count))
+        file.write('}')
+
+
+def add_ids(items, binary_writer, chunk_size):
+    """Pass the items through, adding the sorted word position and the count
+    of each one to a BinaryVocabWriter as the next id"""
+    positions, counts = [], []
+    for item in items:
+        positions.append(item[3])
+        counts.append(item[1])
+        if len(positions) == chunk_size:
+            binary_writer.add_ids(positions, counts)
+            positions, counts = [], []
+        yield item
+    binary_writer.add_ids(positions, counts)
+
+
+def external_merge_vocab_freq(vocab_paths, save_path,
+                              max_words_in_memory=1000000, tmp_dir=None,
+                              binary_dir=None):
+    """Merge vocab_freq.json files with on-disk runs
+
+    :param vocab_paths: list of word frequency dictionary(json) paths
+    :param save_path: path to save the merged dictionary, sorted by
+        decreasing frequency then first appearance
+    :param max_words_in_memory: number of merged words sorted by frequency at
+        a time
+    :param tmp_dir: directory of the temporary run files, the system's
+        default if None
+    :param binary_dir: if given, directory to save the binary version of
+        the merged dictionary to
+    """
+    run_dir = tempfile.mkdtemp(prefix='vocab_merge_', dir=tmp_dir)
+    binary_writer = None
+    if binary_dir:
+        binary_writer = BinaryVocabWriter(binary_dir)
+    try:
+        word_runs = []
+        # position of the words in all the input vocabularies
+        offset = 0
+        for i, path in enumerate(vocab_paths):
+            with codecs.open(path, mode='r', encoding='utf-8') as file:
+                vocab_dict = json.load(file)
+            word_runs.append(os.path.join(run_dir, 'words-%05d' % i))
+            write_run(sorted((word, count, offset + j)
+                             for j, (word, count) in
+                             enumerate(vocab_dict.items())),
+                      word_runs[-1])
+            offset += len(vocab_dict)
+            del vocab_dict
+
+        merged = add_up_counts(
+            heapq.merge(*[read_run(run) for run in word_runs]))
+        freq_runs = []
+        num_words = 0
+        while True:
+            chunk = list(itertools.islice(merged, max_words_in_memory))
+            if not chunk:
+                break
+            if binary_writer:
+                binary_writer.add_sorted_words([item[0] for item in chunk])
+            # carry the position of each word in the sorted words
+            chunk = [(word, count, first, num_words + j)
+                     for j, (word, count, first) in enumerate(chunk)]
+            num_words += len(chunk)
+            chunk.sort(key=_frequency_order)
+            freq_runs.append(os.path.join(run_dir,
+                                          'freq-%05d' % len(freq_runs)))
+            write_run(chunk, freq_runs[-1])
+            del chunk
+
+        items = heapq.merge(*[read_run(run) for run in freq_runs],
+                            key=_frequency_order)
+        if binary_writer:
+            items = add_ids(items, binary_writer, max_words_in_memory)
+        write_vocab_freq(items, save_path)
+        if binary_writer:
+            # after the json file, which it mustn't be older than
+            binary_writer.close()
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
@@ -0,0 +1,179 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or  implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ============================================================================
+
+"""Conformance of the fast preprocessing path and tweet tokenizer with the
+original ones"""
+
+import codecs
+import os
+import random
+
+import tensorflow as tf
+from nltk.stem.porter import PorterStemmer
+from nltk.stem.snowball import EnglishStemmer
+from nltk.tokenize import TweetTokenizer
+
+from mtl.util.data_prep import (FastTweetTokenizer,
+                                clean_str,
+                                fast_clean_str,
+                                fast_remove_urls,
+                                porter_stemmer,
+                                preproc,
+                                preproc_reference,
+                                remove_urls,
+                                snowball_stemmer,
+                                stem_cache_stats)
+
+EXAMPLES = [
+    '',
+    '   ',
+    'plain text without any markup',
+    "I don't think it's what we'd've said, they're sure we'll go",
+    "can't won't isn't n't 's 've 're 'd 'll ''s n''t",
+    'commas, bangs! (parens) questions? ((nested)) ?!,',
+    'back\\slash \\\' \\" "quotes" `ticks` \'single\'',
+    'see http://www.test.com and https://x.org/a?b=1 now',
+    'glued:http://www.test.com http:no-slashes https: ftp://f.org',
+    'HTTP://UPPER.COM mixed http//broken.com',
+    'tabs\tnew\nlines\r\nand\rreturns \x0b\x0c\x1c\x85\xa0  spaces',
+    'first line.<br /><br />second line <br />third<br /> <br />',
+    '<br />leading and trailing linebreaks<br />',
+    'a <br /><br /> review <b>bold</b> and <i>italic</i>',
+    'entities &amp; &lt;tag&gt; &quot; &#39; &nbsp; &#128; & alone',
+    'lone < and > signs, 3 < 4 > 2',
+    '<img<!-- --> src=x onerror=alert(1);//><!-- --><ref/> test ref <ref>',
+    '<td><a href="http://www.fakewebsite.com">Please can you strip me?</a>'
+    '<br/><a href="http://www.fakewebsite.com">I am waiting....</a></td>',
+    'nul\x00char and control \x01\x07\x1b\x7f\x9f chars',
+    'unicode caf\xe9 na\xefve 中文 \U0001f600 emoji',
+    '#hashtag @handle :) :( ;-) <3 </3',
+]
+
+TWEETS = [
+    '@user Loooool this is sooooo gooood :D http://t.co/abc #win &amp; yes!!!!',
+    'RT @some_user_with_a_long_name: call me at +1 (555) 123-4567 or 555.1234',
+    'mail me@example.com, visit www.example.org/path?x=1 or example.com...',
+    ':) :-( ;P XD <3 </3 :D =) 8-) >:( -->>> <--- ->',
+    'CAPS and MiXeD case, emoticons keep theirs :P :D but not WORDS',
+    'caf\xe9 na\xefve \xc9T\xc9 \u4e2d\u6587 \U0001f600\U0001f600\U0001f600 '
+    '\U0001f44d\U0001f3fd \U0001f1eb\U0001f1f7 e\u0301',
+    'entities &lt;3 &gt;:( &#39;quoted&#39; &#x263a; &notanentity; &',
+    'hang on.....\n\n\n\n\nnew lines\r\r\r\r!!!!???? ----- ____',
+    'separators\x1c\x1d\x1e\x1fand\x0b\x0ccontrols\x00\x7f',
+    "it's isn't y'all rock'n'roll well-known 3.14 1/2 -5 +10 12:30",
+    '@a@b @@handle foo@bar @abcdefghijklmnopqrstuvwxyz @_under #tag #tag\'s',
+]
+
+
+def random_example(rng):
+    alphabet = ['a', 'n', 't', 's', 'v', 'e', 'r', 'd', 'l', 'A', '0',
+                "'", '`', '"', '\\', ',', '!', '?', '(', ')', '.', '-',
+                ' ', '  ', '\t', '\n', '\r', '\x00', '\xe9', '中',
+                '<', '>', '&', ';', '#', '/', '=', '<b>', '</b>', '<br />',
+                '&amp;', '&#39;', 'http://a.b/c', 'https:', ' http:x ']
+    return ''.join(rng.choice(alphabet)
+                   for _ in range(rng.randint(0, 40)))
+
+
+def random_tweet(rng):
+    alphabet = [chr(i) for i in range(128)] + [
+        ' ', ' ', 'lol', 'Sooooo', '!!!!', '\n\n\n\n\n', '@user', '#tag',
+        ':)', ':D', '<3', 'http://t.co/x', 'a.com', '555-1234', '&amp;',
+        '&#39;', '\xe9', '\xc9', 'e\u0301', '\u4e2d', '\U0001f600']
+    return ''.join(rng.choice(alphabet)
+                   for _ in range(rng.randint(0, 30)))
+
+
+def read_reviews():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'LMRD_neg.txt')
+    with codecs.open(path, mode='r', encoding='utf-8') as file:
+        return file.read().splitlines()
+
+
+class DataPrepTest(tf.test.TestCase):
+    def test_remove_urls(self):
+        for example in EXAMPLES:
+            self.assertEqual(fast_remove_urls(example),
+                             remove_urls(example))
+
+    def test_clean_str(self):
+        for example in EXAMPLES:
+            self.assertEqual(fast_clean_str(example), clean_str(example))
+
+    def test_preproc_examples(self):
+        for example in EXAMPLES:
+            self.assertEqual(preproc(example), preproc_reference(example))
+
+    def test_preproc_reviews(self):
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'LMRD_neg.txt')
+        with codecs.open(path, mode='r', encoding='utf-8') as file:
+            for line in file:
+                self.assertEqual(preproc(line), preproc_reference(line))
+
+    def test_preproc_random(self):
+        rng = random.Random(42)
+        for _ in range(2000):
+            example = random_example(rng)
+            self.assertEqual(preproc(example), preproc_reference(example))
+            self.assertEqual(fast_clean_str(example), clean_str(example))
+
+
+class FastTweetTokenizerTest(tf.test.TestCase):
+    CONFIGS = [
+        dict(strip_handles=True, preserve_case=False, reduce_len=True),
+        dict(strip_handles=False, preserve_case=False, reduce_len=True),
+        dict(strip_handles=False, preserve_case=True, reduce_len=False),
+        dict(strip_handles=True, reduce_len=True, match_phone_numbers=False)
+    ]
+
+    def assertSameTokens(self, texts):
+        for config in self.CONFIGS:
+            reference = TweetTokenizer(**config)
+            fast = FastTweetTokenizer(**config)
+            self.assertEqual([fast.tokenize(text) for text in texts],
+                             [reference.tokenize(text) for text in texts])
+
+    def test_tweets(self):
+        self.assertSameTokens(TWEETS + EXAMPLES)
+
+    def test_reviews(self):
+        self.assertSameTokens(read_reviews())
+
+    def test_random(self):
+        rng = random.Random(42)
+        self.assertSameTokens([random_tweet(rng) for _ in range(5000)])
+
+
+class StemmerTest(tf.test.TestCase):
+    def test_cached_stemmers(self):
+        tokens = [token for review in read_reviews()[:200]
+                  for token in review.lower().split()]
+        for stemmer, reference in [(porter_stemmer, PorterStemmer()),
+                                   (snowball_stemmer, EnglishStemmer())]:
+            expected = [reference.stem(token) for token in tokens]
+            hits, misses = stem_cache_stats()
+            self.assertEqual(stemmer(tokens), expected)
+            self.assertEqual(stemmer(tokens), expected)
+            # the second pass only hits the cache
+            new_hits, new_misses = stem_cache_stats()
+            self.assertGreaterEqual(new_hits - hits, len(tokens))
+            self.assertEqual(new_hits - hits + new_misses - misses,
+                             2 * len(tokens))
+
+
+if __name__ == '__main__':
+    tf.test.main()
@@ -0,0 +1,295 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import codecs
+import gzip
+import json
+import os
+import random
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.binary_vocab import BINARY_VOCAB_ARRAYS, load_binary_vocab
+from mtl.util.constants import BINARY_VOCAB_FREQ_NAME
+from mtl.util.dataset import Dataset, append_write_tfrecord, \
+    merge_dict_write_tfrecord, merge_save_vocab_dicts, save_vocab_freq_dict
+from mtl.util.pipeline import load_length_buckets
+from mtl.util.util import inverse_document_frequencies, sparse_tfidf
+
+WORDS = ['good', 'bad', 'movie', 'plot', 'actor', 'great', 'boring', 'fun']
+
+
+def write_data(json_dir, num_examples, seed=42):
+    """Write a data.json.gz of random examples of 1 to 30 words"""
+    rng = random.Random(seed)
+    examples = [{'text': ' '.join(rng.choice(WORDS)
+                                  for _ in range(rng.randint(1, 30))),
+                 'label': rng.randint(0, 1)}
+                for _ in range(num_examples)]
+    if not os.path.exists(json_dir):
+        os.makedirs(json_dir)
+    with gzip.open(os.path.join(json_dir, 'data.json.gz'), mode='wt',
+                   encoding='utf-8') as file:
+        json.dump(examples, file)
+    return examples
+
+
+def read_indices(tfrecord_dir, args):
+    """index features of the records of each split"""
+    indices = dict()
+    for split in ['train', 'valid', 'test', 'unlabeled']:
+        indices[split] = []
+        for shard in args.get(split + '_shards') or []:
+            for record in tf.python_io.tf_record_iterator(
+                    os.path.join(tfrecord_dir, shard)):
+                example = tf.train.Example.FromString(record)
+                indices[split].extend(
+                    example.features.feature['index'].int64_list.value)
+    return indices
+
+
+def read_records(tfrecord_dir):
+    """serialized records of each split"""
+    args = load_args(tfrecord_dir)
+    records = dict()
+    for split in ['train', 'valid', 'test', 'unlabeled']:
+        records[split] = [
+            record for shard in args.get(split + '_shards') or []
+            for record in tf.python_io.tf_record_iterator(
+                os.path.join(tfrecord_dir, shard))]
+    return records
+
+
+def load_args(tfrecord_dir):
+    with codecs.open(os.path.join(tfrecord_dir, 'args.json'), mode='r',
+                     encoding='utf-8') as file:
+        return json.load(file)
+
+
+def read_text(path):
+    with codecs.open(path, mode='r', encoding='utf-8') as file:
+        return file.read()
+
+
+class DatasetTests(tf.test.TestCase):
+    def test_padded_length_buckets(self):
+        json_dir = os.path.join(self.get_temp_dir(), 'padded')
+        tfrecord_dir = os.path.join(json_dir, 'tf')
+        write_data(json_dir, 200)
+        Dataset(json_dir, vocab_given=False, generate_basic_vocab=False,
+                generate_tf_record=True, tfrecord_dir=tfrecord_dir,
+                vocab_dir=tfrecord_dir, label_field_name='label',
+                padding=True, max_document_length=25)
+
+        # the quantiles are of the real lengths capped at
+        # max_document_length, not of the padded ones
+        quantiles = load_args(tfrecord_dir)['length_quantiles']['text']
+        self.assertEqual(len(quantiles), 101)
+        self.assertLess(quantiles[0], 25)
+        self.assertEqual(quantiles[-1], 25)
+
+        boundaries, batch_sizes, _ = load_length_buckets(
+            tfrecord_dir, 4, 32, max_tokens=100)
+        self.assertGreater(len(boundaries), 1)
+        # every sequence is padded to 25 tokens in the TFRecord files
+        self.assertEqual(batch_sizes, [4] * (len(boundaries) + 1))
+
+    def test_append_round_trip(self):
+        json_dir = os.path.join(self.get_temp_dir(), 'append')
+        tfrecord_dir = os.path.join(json_dir, 'tf')
+        write_data(json_dir, 100)
+        Dataset(json_dir, vocab_given=False, generate_basic_vocab=False,
+                generate_tf_record=True, tfrecord_dir=tfrecord_dir,
+                vocab_dir=tfrecord_dir, label_field_name='label')
+        args = load_args(tfrecord_dir)
+        self.assertEqual(args['num_examples'], 100)
+
+        append_dir = os.path.join(json_dir, 'new')
+        write_data(append_dir, 30, seed=7)
+        append_write_tfrecord(os.path.join(append_dir, 'data.json.gz'),
+                              tfrecord_dir)
+        args = load_args(tfrecord_dir)
+        self.assertEqual(args['num_examples'], 130)
+        self.assertEqual(args['num_appends'], 1)
+
+        indices = read_indices(tfrecord_dir, args)
+        # the appended examples are indexed after the original ones
+        self.assertEqual(sorted(sum(indices.values(), [])),
+                         list(range(130)))
+        for split in ['train', 'valid', 'test']:
+            self.assertEqual(args[split + '_size'], len(indices[split]))
+
+        # the quantiles are merged with the appended training lengths
+        # (1 to 30 words with BOS and EOS)
+        quantiles = args['length_quantiles']['text']
+        self.assertEqual(len(quantiles), 101)
+        self.assertEqual(quantiles, sorted(quantiles))
+        self.assertGreaterEqual(quantiles[0], 3)
+        self.assertLessEqual(quantiles[-1], 32)
+
+    def test_external_vocab_merge(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'vocab_merge')
+        vocab_dicts = [{'b': 3, 'a': 2, 'c': 2, 'x': 1},
+                       {'d': 5, 'c': 1, 'e': 1, 'a': 1, 'y': 1},
+                       {'z': 4, 'e': 3, 'b': 1, 'f': 1}]
+        vocab_paths = []
+        for i, vocab_dict in enumerate(vocab_dicts):
+            vocab_paths.append(os.path.join(temp_dir, str(i), 'vocab.json'))
+            os.makedirs(os.path.dirname(vocab_paths[-1]))
+            save_vocab_freq_dict(vocab_dict, vocab_paths[-1])
+
+        def binary_arrays(merged_path):
+            binary_dir = os.path.join(os.path.dirname(merged_path),
+                                      BINARY_VOCAB_FREQ_NAME)
+            self.assertIsNotNone(load_binary_vocab(binary_dir, merged_path))
+            return [np.load(os.path.join(binary_dir, name + '.npy')).tolist()
+                    for name in BINARY_VOCAB_ARRAYS]
+
+        in_memory_path = os.path.join(temp_dir, 'in_memory',
+                                      'vocab_freq.json')
+        os.makedirs(os.path.dirname(in_memory_path))
+        merge_save_vocab_dicts(vocab_paths, in_memory_path)
+        for max_words_in_memory in [1, 2, 3, 100]:
+            external_path = os.path.join(
+                temp_dir, 'external_%d' % max_words_in_memory,
+                'vocab_freq.json')
+            os.makedirs(os.path.dirname(external_path))
+            merge_save_vocab_dicts(vocab_paths, external_path,
+                                   max_words_in_memory=max_words_in_memory)
+            self.assertEqual(read_text(external_path),
+                             read_text(in_memory_path))
+            # the same binary version, written from the runs
+            self.assertEqual(binary_arrays(external_path),
+                             binary_arrays(in_memory_path))
+        # words of the same frequency are in order of first appearance
+        self.assertEqual(read_text(in_memory_path),
+                         '{"d":5,"b":4,"e":4,"z":4,"a":3,"c":3,"x":1,"y":1,'
+                         '"f":1}')
+
+    def test_merged_single_tokenization(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'merged_once')
+        names = ['first', 'second']
+        json_dirs = [os.path.join(temp_dir, 'json', name) for name in names]
+        for seed, json_dir in enumerate(json_dirs):
+            write_data(json_dir, 60, seed=seed)
+        merged_dir = os.path.join(temp_dir, 'merged')
+        tfrecord_dirs = [os.path.join(merged_dir, name) for name in names]
+        for tfrecord_dir in tfrecord_dirs:
+            os.makedirs(tfrecord_dir)
+        merge_dict_write_tfrecord(json_dirs, tfrecord_dirs, merged_dir,
+                                  min_frequency=2, write_bow=True)
+
+        # the records are the same as those of each dataset read again and
+        # written with the merged vocabulary
+        for json_dir, tfrecord_dir in zip(json_dirs, tfrecord_dirs):
+            again_dir = os.path.join(temp_dir, 'again',
+                                     os.path.basename(json_dir))
+            Dataset(json_dir, vocab_given=True, generate_basic_vocab=False,
+                    generate_tf_record=True, tfrecord_dir=again_dir,
+                    vocab_dir=merged_dir, vocab_name='vocab_v2i.json',
+                    label_field_name='label', stemmer='porter_stemmer',
+                    min_frequency=2, write_bow=True)
+            self.assertEqual(read_records(again_dir),
+                             read_records(tfrecord_dir))
+
+    def test_parallel_merged_datasets(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'merged_parallel')
+        names = ['first', 'second', 'third']
+        json_dirs = [os.path.join(temp_dir, 'json', name) for name in names]
+        for seed, json_dir in enumerate(json_dirs):
+            write_data(json_dir, 40, seed=seed)
+
+        merged_dirs = []
+        for num_dataset_workers in [1, 2]:
+            merged_dirs.append(os.path.join(temp_dir,
+                                            str(num_dataset_workers)))
+            tfrecord_dirs = [os.path.join(merged_dirs[-1], name)
+                             for name in names]
+            for tfrecord_dir in tfrecord_dirs:
+                os.makedirs(tfrecord_dir)
+            merge_dict_write_tfrecord(
+                json_dirs, tfrecord_dirs, merged_dirs[-1], write_tfidf=True,
+                num_dataset_workers=num_dataset_workers)
+
+        serial_dir, parallel_dir = merged_dirs
+        for name in ['vocab_freq.json', 'vocab_v2i.json']:
+            self.assertEqual(read_text(os.path.join(parallel_dir, name)),
+                             read_text(os.path.join(serial_dir, name)))
+        for name in names:
+            self.assertEqual(read_records(os.path.join(parallel_dir, name)),
+                             read_records(os.path.join(serial_dir, name)))
+
+    def test_merged_predict_tfidf(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'merged_tfidf')
+        names = ['first', 'second']
+        json_dirs = [os.path.join(temp_dir, 'json', name) for name in names]
+        for seed, json_dir in enumerate(json_dirs):
+            write_data(json_dir, 50, seed=seed)
+        merged_dir = os.path.join(temp_dir, 'merged')
+        tfrecord_dirs = [os.path.join(merged_dir, name) for name in names]
+        for tfrecord_dir in tfrecord_dirs:
+            os.makedirs(tfrecord_dir)
+        merge_dict_write_tfrecord(json_dirs, tfrecord_dirs, merged_dir,
+                                  min_frequency=1, write_tfidf=True)
+
+        # the idf of the training data of both datasets, saved with the
+        # merged vocabulary and used by each dataset
+        idf = np.load(os.path.join(merged_dir, 'idf.npy'))
+        df = np.zeros(len(idf), dtype=np.int64)
+        num_docs = 0
+        for tfrecord_dir in tfrecord_dirs:
+            self.assertEqual(
+                np.load(os.path.join(tfrecord_dir, 'idf.npy')).tolist(),
+                idf.tolist())
+            for record in read_records(tfrecord_dir)['train']:
+                word_ids = tf.train.Example.FromString(
+                    record).features.feature['text'].int64_list.value
+                df[sorted(set(word_ids))] += 1
+                num_docs += 1
+        self.assertEqual(idf.tolist(),
+                         inverse_document_frequencies(df, num_docs).tolist())
+
+        # predicting with the merged vocabulary and idf
+        predict_dir = os.path.join(temp_dir, 'predict')
+        write_data(predict_dir, 20, seed=7)
+        predict_tf_path = os.path.join(predict_dir, 'tf', 'predict.tf')
+        os.makedirs(os.path.dirname(predict_tf_path))
+        Dataset(json_dir=None, tfrecord_dir=None, vocab_dir=merged_dir,
+                generate_basic_vocab=False, vocab_given=True,
+                vocab_name='vocab_v2i.json', generate_tf_record=True,
+                predict_mode=True,
+                predict_json_path=os.path.join(predict_dir, 'data.json.gz'),
+                predict_tf_path=predict_tf_path, label_field_name='label',
+                stemmer='porter_stemmer', write_tfidf=True)
+        records = list(tf.python_io.tf_record_iterator(predict_tf_path))
+        self.assertEqual(len(records), 20)
+        for record in records:
+            feature = tf.train.Example.FromString(record).features.feature
+            indices, values = sparse_tfidf(
+                np.asarray(feature['text'].int64_list.value), idf)
+            self.assertEqual(
+                list(feature['text_tfidf_indices'].int64_list.value),
+                list(indices))
+            self.assertTrue(np.allclose(
+                feature['text_tfidf_values'].float_list.value, values))
+
+
+if __name__ == '__main__':
+    tf.test.main()
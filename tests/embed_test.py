@@ -13,9 +13,17 @@
 # limitations under the License.
 # ============================================================================
 
+import codecs
+import json
+import os
+
 import numpy as np
 import tensorflow as tf
 
+from mtl.embedders.pretrained import (assign_pretrained_embeddings,
+                                      get_pretrained_variable,
+                                      init_pretrained)
+
 
 class EmbedTests(tf.test.TestCase):
     def test_template(self):
@@ -47,6 +55,96 @@ class EmbedTests(tf.test.TestCase):
             self.assertNotAlmostEqual(np.sum(embed1_val), np.sum(embed3_val))
             self.assertNotAlmostEqual(np.sum(embed1_val), np.sum(embed1_2_val))
 
+    def test_pretrained_variable(self):
+        matrix = np.random.RandomState(0).rand(1000, 50).astype(np.float32)
+        with self.test_session() as sess:
+            temp = tf.make_template('embedding',
+                                    get_pretrained_variable,
+                                    name='embedding_pretrained',
+                                    shape=[1000, 50],
+                                    value_fn=lambda: matrix,
+                                    trainable=True)
+            variable = temp()
+            self.assertIs(variable, temp())
+
+            # every collection of the graph can be exported
+            self.assertEqual(
+                sorted(tf.train.export_meta_graph().collection_def),
+                sorted(sess.graph.get_all_collection_keys()))
+
+            # the matrix isn't stored in the graph
+            self.assertLess(sess.graph.as_graph_def().ByteSize(),
+                            matrix.nbytes)
+
+            sess.run(tf.global_variables_initializer())
+            self.assertAllEqual(sess.run(variable), np.zeros([1000, 50]))
+            assign_pretrained_embeddings(sess)
+            self.assertAllEqual(sess.run(variable), matrix)
+
+    def test_init_pretrained_rows(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'init_pretrained')
+        os.makedirs(temp_dir)
+        vectors = {'the': [0.5, -1.0, 2.0],
+                   'cat': [1.5, 0.25, -3.0],
+                   'dog': [-0.5, 4.0, 1.0],
+                   'bird': [7.0, 8.0, 9.0]}
+        pretrained_path = os.path.join(temp_dir, 'vectors.txt')
+        with codecs.open(pretrained_path, mode='w', encoding='utf-8') as file:
+            for word, vector in sorted(vectors.items()):
+                file.write(' '.join([word] + [str(x) for x in vector]))
+                file.write('\n')
+        # the first 2 words are randomly initialized, 'zebra' isn't in
+        # the file
+        words = ['<unk>', 'movie', 'the', 'cat', 'zebra', 'dog']
+        reverse_vocab_path = os.path.join(temp_dir, 'vocab_i2v.json')
+        with codecs.open(reverse_vocab_path, mode='w',
+                         encoding='utf-8') as file:
+            json.dump({str(i): word for i, word in enumerate(words)}, file)
+
+        with self.test_session() as sess:
+            init_pretrained(tf.constant([[1, 2, 3]]),
+                            vocab_size=len(words),
+                            embed_dim=3,
+                            pretrained_path=pretrained_path,
+                            reverse_vocab_path=reverse_vocab_path,
+                            random_size=2,
+                            trainable=True,
+                            is_training=True)
+            variable, = [v for v in tf.global_variables()
+                         if v.op.name == 'embedding_pretrained']
+            sess.run(tf.global_variables_initializer())
+            assign_pretrained_embeddings(sess)
+            self.assertAllEqual(sess.run(variable),
+                                [vectors['the'], vectors['cat'], [0] * 3,
+                                 vectors['dog']])
+
+    def test_restored_not_assigned(self):
+        checkpoint_path = os.path.join(self.get_temp_dir(), 'restored',
+                                       'model')
+        saved = np.arange(6, dtype=np.float32).reshape([2, 3])
+        with tf.Graph().as_default() as graph:
+            get_pretrained_variable('saved', [2, 3], lambda: saved, True)
+            with tf.Session(graph=graph) as sess:
+                sess.run(tf.global_variables_initializer())
+                assign_pretrained_embeddings(sess)
+                tf.train.Saver().save(sess, checkpoint_path)
+
+        def not_loaded():
+            raise AssertionError('restored embeddings loaded')
+
+        with tf.Graph().as_default() as graph:
+            variable = get_pretrained_variable('saved', [2, 3],
+                                               not_loaded, True)
+            missing = get_pretrained_variable('missing', [1, 3],
+                                              lambda: np.ones([1, 3]), True)
+            with tf.Session(graph=graph) as sess:
+                sess.run(tf.global_variables_initializer())
+                tf.train.Saver([variable]).restore(sess, checkpoint_path)
+                # the variable missing from the checkpoint is assigned
+                assign_pretrained_embeddings(sess, checkpoint_path)
+                self.assertAllEqual(sess.run(variable), saved)
+                self.assertAllEqual(sess.run(missing), np.ones([1, 3]))
+
 
 if __name__ == '__main__':
     tf.test.main()
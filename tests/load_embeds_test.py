@@ -0,0 +1,121 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+from zipfile import ZipFile
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.constants import PRETRAINED_CACHE_SUFFIX
+from mtl.util.load_embeds import (load_pretrained_matrix,
+                                  load_pretrained_rows,
+                                  load_pretrianed_vocab_dict,
+                                  pretrained_cache_up_to_date)
+
+WORDS = ['the', ',', 'caf\xe9', 'dog', '中文', 'a', 'cat', '<unk>']
+
+
+def embedding_lines(dim):
+    rng = np.random.RandomState(0)
+    return [' '.join([word] + ['%.6f' % x for x in rng.randn(dim)])
+            for word in WORDS]
+
+
+def write_glove(path, dim=5):
+    with io.open(path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(embedding_lines(dim)) + '\n')
+
+
+def write_fasttext(path, dim=5):
+    # the zip contains the file of the same name without .zip
+    name = os.path.basename(path)[:-len('.zip')]
+    text = '{} {}\n'.format(len(WORDS), dim) + '\n'.join(
+        embedding_lines(dim)) + '\n'
+    with ZipFile(path, 'w') as myzip:
+        myzip.writestr(name, text.encode('utf-8'))
+
+
+def reference_load(path):
+    """Vocab dictionary and matrix parsed from the file every time
+
+    :return: (dict, float64 matrix)
+    """
+    if path.endswith('.zip'):
+        with ZipFile(path, 'r') as myzip:
+            name = os.path.basename(path)[:-len('.zip')]
+            lines = myzip.read(name).decode('utf-8').splitlines()[1:]
+    else:
+        with io.open(path, 'r', encoding='utf-8') as file:
+            lines = file.read().splitlines()
+    entries = [line.split(' ') for line in lines]
+    return ({e[0]: i for i, e in enumerate(entries)},
+            np.array([[float(x) for x in e[1:]] for e in entries]))
+
+
+class PretrainedCacheTest(tf.test.TestCase):
+    def test_same_as_parsed_file(self):
+        glove_path = os.path.join(self.get_temp_dir(), 'glove.6B.5d.txt')
+        fasttext_path = os.path.join(self.get_temp_dir(), 'wiki.en.vec.zip')
+        write_glove(glove_path)
+        write_fasttext(fasttext_path)
+        for path in [glove_path, fasttext_path]:
+            cache_dir = path + PRETRAINED_CACHE_SUFFIX
+            self.assertFalse(pretrained_cache_up_to_date(path, cache_dir))
+            vocab_dict, matrix = reference_load(path)
+            self.assertEqual(load_pretrianed_vocab_dict(path), vocab_dict)
+            cached = load_pretrained_matrix(path)
+            self.assertEqual(cached.dtype, np.float32)
+            self.assertEqual(cached.tolist(),
+                             matrix.astype(np.float32).tolist())
+
+            # converted once, and again once the file is newer
+            self.assertTrue(pretrained_cache_up_to_date(path, cache_dir))
+            matrix_time = os.path.getmtime(os.path.join(cache_dir,
+                                                        'matrix.npy'))
+            os.utime(path, (matrix_time + 1, matrix_time + 1))
+            self.assertFalse(pretrained_cache_up_to_date(path, cache_dir))
+
+    def test_rows_same_as_matrix(self):
+        # repeated words and words not in the files
+        words = ['dog', 'missing', 'the', '中文', 'dog', '<unk>', 'c', ',']
+        for name, write_fn in [('glove.6B.5d.txt', write_glove),
+                               ('wiki.en.vec.zip', write_fasttext)]:
+            path = os.path.join(self.get_temp_dir(), name)
+            write_fn(path)
+            vocab_dict, matrix = reference_load(path)
+            expected = [matrix[vocab_dict[word]].astype(np.float32).tolist()
+                        if word in vocab_dict else [0.0] * matrix.shape[1]
+                        for word in words]
+            # parsing the file line by line, then from the cache
+            rows = load_pretrained_rows(path, words)
+            self.assertFalse(pretrained_cache_up_to_date(
+                path, path + PRETRAINED_CACHE_SUFFIX))
+            self.assertEqual(rows.dtype, np.float32)
+            self.assertEqual(rows.tolist(), expected)
+            load_pretrained_matrix(path)
+            self.assertEqual(load_pretrained_rows(path, words).tolist(),
+                             expected)
+            self.assertEqual(load_pretrained_rows(path, []).shape,
+                             (0, matrix.shape[1]))
+
+
+if __name__ == '__main__':
+    tf.test.main()
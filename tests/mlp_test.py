@@ -0,0 +1,61 @@
+#! /usr/bin/env python
+
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.layers.mlp import dense_layer
+from mtl.util.util import bag_of_words, sparse_bag_of_words
+
+
+class MLPTests(tf.test.TestCase):
+    def test_sparse_bag_of_words(self):
+        vocab_size = 50
+        rng = np.random.RandomState(0)
+        sequences = [rng.randint(0, vocab_size, size=rng.randint(1, 20))
+                     for _ in range(8)]
+        dense = np.stack([bag_of_words(seq, vocab_size, freq=True)
+                          for seq in sequences])
+
+        indices, values = [], []
+        for i, seq in enumerate(sequences):
+            bow_indices, bow_values = sparse_bag_of_words(seq, freq=True)
+            # the same non-zero entries as the dense bag of words
+            self.assertAllClose(bow_values, dense[i, bow_indices])
+            self.assertEqual(np.count_nonzero(dense[i]), len(bow_indices))
+            indices.extend([i, j] for j in bow_indices)
+            values.extend(bow_values)
+        sparse = tf.SparseTensor(np.int64(indices), np.float32(values),
+                                 [len(sequences), vocab_size])
+
+        # the first MLP layer gives the same outputs with the same variables
+        sparse_outputs = dense_layer(sparse, 16, 'layer')
+        with tf.variable_scope(tf.get_variable_scope(), reuse=True):
+            dense_outputs = dense_layer(tf.constant(dense), 16, 'layer')
+        self.assertEqual(len(tf.trainable_variables()), 2)
+        with self.test_session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sparse_v, dense_v = sess.run([sparse_outputs, dense_outputs])
+            self.assertAllClose(sparse_v, dense_v, atol=1e-5)
+
+
+if __name__ == '__main__':
+    tf.test.main()
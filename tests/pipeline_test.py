@@ -27,6 +27,8 @@ import tensorflow as tf
 from mtl.util.pipeline import Pipeline
 from mtl.util.pipeline import int64_feature
 from mtl.util.pipeline import int64_list_feature
+from mtl.util.pipeline import length_buckets
+from mtl.util.util import bag_of_words, sparse_bag_of_words
 
 
 def random_sequences(N, maxlen, maxint):
@@ -96,6 +98,91 @@ class PipelineTests(tf.test.TestCase):
             with self.assertRaises(tf.errors.OutOfRangeError):
                 batch_v = sess.run(dataset.batch)
 
+    def test_length_buckets(self):
+        tf_path = self.write_examples()
+        feature_map = {
+            'sequence': tf.VarLenFeature(tf.int64),
+            'length': tf.FixedLenFeature([1], tf.int64)
+        }
+        bucket_boundaries = [3]
+        bucket_batch_sizes = [3, 2]
+        dataset = Pipeline(tf_path, feature_map, num_epochs=1,
+                           one_shot=True, batch_size=self._batch_size,
+                           length_keys=['length'],
+                           bucket_boundaries=bucket_boundaries,
+                           bucket_batch_sizes=bucket_batch_sizes)
+        num_examples = 0
+        with self.test_session() as sess:
+            while True:
+                try:
+                    batch_v = sess.run(dataset.batch)
+                except tf.errors.OutOfRangeError:
+                    break
+                lengths = batch_v['length'][:, 0]
+                bucket = int(lengths[0] >= bucket_boundaries[0])
+                self.assertTrue(np.all(
+                    (lengths >= bucket_boundaries[0]) == bucket))
+                self.assertLessEqual(len(lengths), bucket_batch_sizes[bucket])
+                # padded to the longest example of the batch
+                self.assertEqual(batch_v['sequence'].shape[1], max(lengths))
+                num_examples += len(lengths)
+        self.assertEqual(num_examples, self._N)
+
+    def test_length_buckets_token_budget(self):
+        quantiles = list(range(101))
+        boundaries, batch_sizes, mean_batch_size = length_buckets(
+            quantiles, 4, 32, max_tokens=100)
+        self.assertEqual(boundaries, [26, 51, 76])
+        self.assertEqual(batch_sizes, [4, 2, 1, 1])
+        self.assertGreater(mean_batch_size, 1)
+        self.assertLess(mean_batch_size, 4)
+        boundaries, batch_sizes, mean_batch_size = length_buckets(
+            quantiles, 4, 32)
+        self.assertEqual(batch_sizes, [32] * 4)
+        self.assertEqual(mean_batch_size, 32)
+
+    def test_vocab_cutoff(self):
+        tmp_dir = self.get_temp_dir()
+        file_name = os.path.join(tmp_dir, 'full_vocab.tf')
+        sequences = list(random_sequences(self._N, 5, 5))
+        with tf.python_io.TFRecordWriter(file_name) as w:
+            for s in sequences:
+                bow_indices, bow_values = sparse_bag_of_words(s)
+                example = tf.train.Example(features=tf.train.Features(
+                    feature={'sequence': int64_list_feature(s),
+                             'bow_indices': int64_list_feature(bow_indices),
+                             'bow_values': tf.train.Feature(
+                                 float_list=tf.train.FloatList(
+                                     value=bow_values))}
+                ))
+                w.write(example.SerializeToString())
+
+        vocab_cutoff = 3
+        feature_map = {
+            'sequence': tf.VarLenFeature(tf.int64),
+            'bow': tf.SparseFeature(index_key='bow_indices',
+                                    value_key='bow_values',
+                                    dtype=tf.float32,
+                                    size=5)
+        }
+        dataset = Pipeline(file_name, feature_map,
+                           batch_size=self._N, num_epochs=1,
+                           shuffle=False, one_shot=True,
+                           vocab_cutoff=vocab_cutoff,
+                           vocab_keys=['sequence', 'bow'])
+        with self.test_session() as sess:
+            batch_v = sess.run(dataset.batch)
+        bow = batch_v['bow']
+        self.assertEqual(list(bow.dense_shape), [self._N, vocab_cutoff])
+        dense_bow = np.zeros(bow.dense_shape, dtype=np.float32)
+        dense_bow[bow.indices[:, 0], bow.indices[:, 1]] = bow.values
+        for i, s in enumerate(sequences):
+            # as written with the smaller vocabulary
+            cut = [w if w < vocab_cutoff else 0 for w in s]
+            self.assertEqual(batch_v['sequence'][i, :len(s)].tolist(), cut)
+            self.assertAllClose(dense_bow[i],
+                                bag_of_words(cut, vocab_cutoff))
+
 
 if __name__ == "__main__":
     tf.test.main()
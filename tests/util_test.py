@@ -0,0 +1,183 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.dataset import get_types_and_counts
+from mtl.util.manifest import (json_input_files, manifest_unchanged,
+                               remove_manifest, write_manifest)
+from mtl.util.sequences import CSRSequences
+from mtl.util.util import (document_frequencies,
+                           inverse_document_frequencies, iter_json_array,
+                           sparse_tfidf, tfidf)
+
+ARRAYS = [
+    '[]',
+    ' [ ] ',
+    '[12345, 67]',
+    '[1,2,3]',
+    '[-1.5e10, 0.25, true, false, null, "a string, with ] and [ in it"]',
+    '[{"text": "first example", "label": 1}, {"text": "", "label": 0.5},\n'
+    ' {"nested": {"list": [1, 2, [3, 4]], "s": "\\"escaped\\""}}]',
+    '[\n  "caf\\u00e9",\n  "中文",\n  12345678901234567890\n]\n',
+]
+
+INVALID = [
+    '',
+    '{"a": 1}',
+    '[1 2 3]',
+    '[{"a": 1} {"b": 2}]',
+    '[,1]',
+    '[1,,2]',
+    '[1,]',
+    '[1, 2',
+    '[1, {"a": ',
+]
+
+
+class IterJsonArrayTest(tf.test.TestCase):
+    def test_chunk_boundaries(self):
+        for text in ARRAYS:
+            for chunk_size in [1, 2, 3, 5, 7, 1 << 20]:
+                self.assertEqual(
+                    list(iter_json_array(io.StringIO(text), chunk_size)),
+                    json.loads(text))
+
+    def test_invalid(self):
+        for text in INVALID:
+            for chunk_size in [1, 2, 3, 1 << 20]:
+                with self.assertRaises(ValueError):
+                    list(iter_json_array(io.StringIO(text), chunk_size))
+
+
+def random_sequences(rng, num_sequences, vocab_size=20, max_length=15):
+    return [rng.randint(0, vocab_size,
+                        size=rng.randint(0, max_length + 1)).tolist()
+            for _ in range(num_sequences)]
+
+
+class CSRSequencesTest(tf.test.TestCase):
+    def test_same_as_lists(self):
+        sequences = random_sequences(np.random.RandomState(0), 200)
+        csr = CSRSequences.from_sequences(sequences)
+        self.assertEqual(len(csr), len(sequences))
+        self.assertEqual([seq.tolist() for seq in csr], sequences)
+        self.assertEqual(csr[17].tolist(), sequences[17])
+        self.assertEqual(csr.lengths.tolist(),
+                         [len(seq) for seq in sequences])
+
+        empty = CSRSequences.from_sequences([])
+        self.assertEqual(len(empty), 0)
+        self.assertEqual(list(empty), [])
+
+    def test_types_and_counts(self):
+        sequences = random_sequences(np.random.RandomState(1), 200)
+        csr = CSRSequences.from_sequences(sequences)
+        for seq, array in zip(sequences, csr):
+            if not seq:
+                continue
+            # list.count() in a dict, as before the CSR arrays
+            counts = {x: seq.count(x) for x in seq}
+            types, type_counts = get_types_and_counts(array)
+            self.assertEqual(types.tolist(), list(counts.keys()))
+            self.assertEqual(type_counts.tolist(), list(counts.values()))
+
+
+class TfidfTest(tf.test.TestCase):
+    def test_sparse_tfidf(self):
+        vocab_size = 30
+        rng = np.random.RandomState(2)
+        documents = [rng.randint(0, vocab_size - 5,
+                                 size=rng.randint(1, 15)).tolist()
+                     for _ in range(50)]
+        # the dense tf-idf of the whole vocabulary, word by word
+        dense = np.array(tfidf(documents, vocab=list(range(vocab_size))))
+
+        df, num_docs = document_frequencies(documents, vocab_size,
+                                            chunk_size=7)
+        self.assertEqual(num_docs, len(documents))
+        self.assertEqual(df.tolist(),
+                         [sum(word in doc for doc in documents)
+                          for word in range(vocab_size)])
+        idf = inverse_document_frequencies(df, num_docs)
+        for document, row in zip(documents, dense):
+            indices, values = sparse_tfidf(document, idf, norm=False)
+            self.assertEqual(indices.tolist(), np.flatnonzero(row).tolist())
+            self.assertTrue(np.allclose(values, row[indices]))
+
+
+def write_file(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as file:
+        file.write(content)
+
+
+class ManifestTest(tf.test.TestCase):
+    def test_skip_only_unchanged(self):
+        temp_dir = os.path.join(self.get_temp_dir(), 'manifest')
+        json_dir = os.path.join(temp_dir, 'json')
+        data_path = os.path.join(json_dir, 'data.json.gz')
+        write_file(data_path, b'first content')
+        output_dir = os.path.join(temp_dir, 'merged')
+        tfrecord_dir = os.path.join(output_dir, 'json')
+        write_file(os.path.join(tfrecord_dir, 'args.json'),
+                   json.dumps({'train_shards': ['train.tf'],
+                               'test_path': 'test.tf'}).encode('utf-8'))
+        write_file(os.path.join(tfrecord_dir, 'train.tf'), b'records')
+        write_file(os.path.join(tfrecord_dir, 'test.tf'), b'records')
+        inputs = json_input_files(json_dir)
+        args = {'min_frequency': 1, 'num_workers': 1}
+
+        def unchanged(args):
+            return manifest_unchanged(output_dir, inputs, args,
+                                      [tfrecord_dir])
+
+        self.assertEqual(unchanged(args), (False, 'no manifest'))
+        write_manifest(output_dir, inputs, args, [tfrecord_dir])
+        self.assertEqual(unchanged(args), (True, None))
+        # only the arguments changing the files are compared
+        self.assertEqual(unchanged(dict(args, num_workers=4)), (True, None))
+        self.assertEqual(unchanged(dict(args, min_frequency=2)),
+                         (False, 'arguments changed'))
+
+        # the same content written again
+        write_file(data_path, b'first content')
+        os.utime(data_path, (0, 0))
+        self.assertEqual(unchanged(args), (True, None))
+        # the same size and a different content
+        write_file(data_path, b'other content')
+        os.utime(data_path, (1, 1))
+        self.assertFalse(unchanged(args)[0])
+        write_file(data_path, b'first content')
+        self.assertEqual(unchanged(args), (True, None))
+
+        os.remove(os.path.join(tfrecord_dir, 'test.tf'))
+        self.assertFalse(unchanged(args)[0])
+        remove_manifest(output_dir)
+        self.assertEqual(unchanged(args), (False, 'no manifest'))
+
+
+if __name__ == '__main__':
+    tf.test.main()
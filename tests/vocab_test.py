@@ -0,0 +1,205 @@
+# Copyright 2018 Johns Hopkins University. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import os
+import random
+
+import numpy as np
+import tensorflow as tf
+
+from mtl.util.binary_vocab import load_binary_vocab, save_binary_vocab
+from mtl.util.categorical_vocabulary import CategoricalVocabulary
+from mtl.util.count_min_sketch import CountMinSketch
+from mtl.util.text import (VocabularyProcessor,
+                           count_frequent_tokens,
+                           count_tokens)
+
+WORDS = ['w%d' % i for i in range(40)]
+
+
+def random_documents(rng, num_documents):
+    """Documents of words of very different frequencies, with many ties"""
+    return [' '.join(WORDS[min(int(rng.expovariate(0.15)), len(WORDS) - 1)]
+                     for _ in range(rng.randint(0, 12)))
+            for _ in range(num_documents)]
+
+
+def split_documents(documents):
+    for document in documents:
+        yield document.split()
+
+
+def reference_trim(freq, min_frequency, max_frequency=-1,
+                   max_vocab_size=None):
+    """CategoricalVocabulary.trim() sorting all the categories twice
+
+    :return: (mapping, freq) of the trimmed vocabulary
+    """
+    if not max_vocab_size:
+        max_vocab_size = float('inf')
+    items = sorted(sorted(freq.items(),
+                          key=lambda x: (isinstance(x[0], str), x[0])),
+                   key=lambda x: x[1],
+                   reverse=True)
+    mapping = {'<UNK>': 0}
+    idx = 1
+    vocab_size = 1
+    for category, count in items:
+        if 0 < max_frequency <= count:
+            continue
+        if count <= min_frequency:
+            break
+        mapping[category] = idx
+        idx += 1
+        vocab_size += 1
+        if vocab_size == max_vocab_size:
+            break
+    return mapping, dict(items[:idx - 1])
+
+
+class CategoricalVocabularyTest(tf.test.TestCase):
+    def test_count_and_trim(self):
+        documents = random_documents(random.Random(0), 300)
+        reference_counts = collections.Counter()
+        for document in documents:
+            reference_counts.update(document.split())
+        for num_workers in [1, 2]:
+            counts = count_tokens(documents, tokenizer_fn=split_documents,
+                                  num_workers=num_workers, chunk_size=7)
+            self.assertEqual(list(counts.items()),
+                             list(reference_counts.items()))
+
+        for min_frequency in [0, 1, 3]:
+            for max_frequency in [-1, 20, 60]:
+                for max_vocab_size in [None, -1, 1, 2, 5, 2.5, 12, 1000]:
+                    vocab = CategoricalVocabulary()
+                    vocab.add_counts(reference_counts)
+                    vocab.trim(min_frequency, max_frequency, max_vocab_size)
+                    mapping, freq = reference_trim(
+                        reference_counts, min_frequency, max_frequency,
+                        max_vocab_size)
+                    self.assertEqual(vocab.mapping, mapping)
+                    self.assertEqual(list(vocab.freq.items()),
+                                     list(freq.items()))
+                    self.assertEqual(vocab.reverse_mapping,
+                                     sorted(mapping, key=mapping.get))
+
+
+class VocabularyProcessorTest(tf.test.TestCase):
+    def assertSameIds(self, make_processor, documents):
+        for pad, transform in [(False, VocabularyProcessor.transform),
+                               (True, VocabularyProcessor.transform_pad)]:
+            # a processor per path, since an unfrozen vocabulary grows
+            processor = make_processor()
+            values, offsets = processor.transform_csr(documents, pad=pad)
+            expected = list(transform(make_processor(), documents))
+            self.assertEqual(offsets.tolist(),
+                             np.cumsum([0] + [len(ids) for ids in expected])
+                             .tolist())
+            self.assertEqual(values.tolist(),
+                             [int(i) for ids in expected for i in ids])
+            self.assertEqual(values.dtype, np.int64)
+            self.assertEqual(offsets.dtype, np.int64)
+
+    def test_transform_csr(self):
+        documents = random_documents(random.Random(2), 200)
+        for max_document_length in [1, 5, 20]:
+            def fitted():
+                processor = VocabularyProcessor(
+                    max_document_length, min_frequency=2,
+                    tokenizer_fn=split_documents)
+                return processor.fit(documents[:100])
+
+            def unfrozen():
+                return VocabularyProcessor(max_document_length,
+                                           tokenizer_fn=split_documents)
+
+            self.assertSameIds(fitted, documents)
+            self.assertSameIds(unfrozen, documents)
+            self.assertSameIds(fitted, [])
+
+
+class CountMinSketchTest(tf.test.TestCase):
+    def test_frequent_tokens(self):
+        documents = random_documents(random.Random(1), 300)
+        exact = collections.Counter()
+        for document in documents:
+            exact.update(document.split())
+
+        # a narrow sketch, so that many tokens share their cells
+        sketch = CountMinSketch(width=8, depth=2)
+        for document in documents:
+            sketch.update(document.split())
+        estimates = sketch.estimate(list(exact))
+        self.assertTrue(all(estimate >= exact[token] for token, estimate in
+                            zip(exact, estimates)))
+        self.assertGreater(sum(estimate > exact[token] for token, estimate in
+                               zip(exact, estimates)), 0)
+
+        for min_frequency in [0, 1, 5, 30]:
+            for width in [8, 1 << 10]:
+                counts = count_frequent_tokens(
+                    documents, tokenizer_fn=split_documents,
+                    min_frequency=min_frequency, sketch_width=width,
+                    sketch_depth=2, chunk_size=7)
+                # the exact counts of the tokens above min_frequency, in the
+                # same order
+                self.assertEqual(list(counts.items()),
+                                 [(token, count) for token, count in
+                                  exact.items() if count > min_frequency])
+
+
+class BinaryVocabTest(tf.test.TestCase):
+    def test_same_as_json_dicts(self):
+        # words sharing their first 8 bytes, non-ascii words and a word
+        # saved twice
+        words = ['<UNK>', 'the', 'prefix00', 'prefix001', 'prefix000',
+                 'prefix00a', 'caf\xe9', '\u4e2d\u6587', 'b', 'a', '',
+                 'the', 'zebra', 'prefix0']
+        counts = list(range(len(words), 0, -1))
+        binary_dir = os.path.join(self.get_temp_dir(), 'vocab.bin')
+        save_binary_vocab(binary_dir, words, counts)
+        vocab = load_binary_vocab(binary_dir)
+
+        # the dictionaries built from the words in id order
+        mapping = {word: word_id for word_id, word in enumerate(words)}
+        freq = dict(zip(words, counts))
+        self.assertEqual(len(vocab), len(words))
+        self.assertEqual(vocab.words(), words)
+        self.assertEqual(list(vocab), words)
+        self.assertEqual(vocab.to_dict(), mapping)
+        self.assertEqual(vocab.freq_dict(), freq)
+        for word in words + ['th', 'thee', 'prefix', 'prefix00b', 'cafe', 1]:
+            self.assertEqual(word in vocab, word in mapping)
+            self.assertEqual(vocab.get(word), mapping.get(word))
+            self.assertEqual(vocab.count(word), freq.get(word, 0))
+
+        # not used once the json vocabulary is newer
+        json_path = os.path.join(self.get_temp_dir(), 'vocab_v2i.json')
+        with open(json_path, 'w') as file:
+            file.write('{}')
+        offsets_time = os.path.getmtime(os.path.join(binary_dir,
+                                                     'offsets.npy'))
+        os.utime(json_path, (offsets_time + 1, offsets_time + 1))
+        self.assertIsNone(load_binary_vocab(binary_dir, json_path))
+
+
+if __name__ == '__main__':
+    tf.test.main()